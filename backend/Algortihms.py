@@ -1,43 +1,177 @@
-from datetime import datetime
-from Medicine import findMedicineEntitiesByName
-from schemaUtils import createTableIfNotExists, getMedicineTableName
-
-def getStoresWithMedicationGreedy(medicationNames: set[str]) -> tuple[set[str], set[str]]:
-    _, medicationsTable = createTableIfNotExists(getMedicineTableName())
-    medication_to_stores = {med: set[str]() for med in medicationNames}
-    
-    for medicationName in medicationNames:
-        entities = findMedicineEntitiesByName(medicationsTable, medicationName)
-        for entity in entities:
-            if isViableMedicine(entity):
-                medication_to_stores[medicationName].add(entity['StoreName'])  # type: ignore
-
-    noStoreMedications = {med for med, stores in medication_to_stores.items() if not stores}
-    medicationNames -= noStoreMedications
-    
-    notFoundMedications = set(medicationNames)
+from __future__ import annotations
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+from AvailabilitySnapshot import getAvailabilityView
+from CacheUtils import LRUCache
+from Medicine import findMedicineIndexEntitiesByNames, findMedicineIndexEntitiesByNamesAsync, inventoryVersions
+from StoreLocator import Location, getStoreDistances
+from schemaUtils import createTableIfNotExists, createTableIfNotExistsAsync, getMedicineIndexTableName
+from Tracing import recordCacheLookup, span
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from azure.data.tables import TableEntity
+
+# Added to every store's distance so a store right next to the user still has a positive cost
+DISTANCE_COST_OFFSET_KM = 1.0
+
+# Covers of recent prescriptions, keyed by the sorted medications, the day and the location cell, an entry holds the
+# inventory versions of its medications and is only used while they are unchanged. Users in one cell share the
+# selected stores, the distances are always measured from the request's own location.
+_locateResults: LRUCache[tuple, tuple[tuple[int, ...], frozenset[str], frozenset[str]]] = LRUCache(
+    int(os.getenv('LocateResultCacheMaxBytes', str(8 * 1024 * 1024))),
+    ttlSeconds=float(os.getenv('LocateResultCacheTtlSeconds', '300')))
+
+def _getResultCellDegrees() -> float:
+    return float(os.getenv('LocateResultCellDegrees', '0.01'))
+
+def locateResultKey(medications: tuple[str, ...], location: Optional[Location]) -> tuple:
+    cell = None if location is None else (*location.cell(_getResultCellDegrees()), location.RadiusKm)
+    # Batches expire at midnight UTC, results don't outlive the day they were computed on
+    return (medications, cell, datetime.now(timezone.utc).date().toordinal())
+
+def _cachedLocateResult(key: tuple, medications: tuple[str, ...]) -> Optional[tuple[set[str], set[str]]]:
+    cached = _locateResults.get(key)
+    hit = cached is not None and cached[0] == inventoryVersions.versions(medications)
+    recordCacheLookup("locateResultCache", hit)
+    if not hit:
+        return None
+    return set(cached[1]), set(cached[2]) # type: ignore
+
+def _cacheLocateResult(key: tuple, versions: tuple[int, ...], selectedStores: set[str], notFoundMedications: set[str]) -> None:
+    # Approximate bytes held by the entry, names dominate
+    size = 512 + sum(64 + len(name) for name in (*key[0], *selectedStores, *notFoundMedications)) + 8 * len(versions)
+    _locateResults.put(key, (versions, frozenset(selectedStores), frozenset(notFoundMedications)), size)
+
+def _distancesFrom(location: Optional[Location], storeNames: set[str]) -> dict[str, float]:
+    if location is None or not storeNames:
+        return {}
+    return getStoreDistances(Location(location.Latitude, location.Longitude), storeNames)
+
+def getStoresWithMedicationGreedy(medicationNames: set[str], location: Optional[Location] = None) -> tuple[set[str], set[str]]:
+    selectedStores, notFoundMedications, _ = getStoresWithMedicationNearby(medicationNames, location)
+    return selectedStores, notFoundMedications
+
+def getStoresWithMedicationNearby(medicationNames: set[str], location: Optional[Location]) -> tuple[set[str], set[str], dict[str, float]]:
+    # The snapshot refresh comes first, it is what brings other workers' inventory changes into the versions
+    availability = getAvailabilityView()
+    availability.refreshIfDue()
+    medications = tuple(sorted(set(medicationNames)))
+    key = locateResultKey(medications, location)
+    cached = _cachedLocateResult(key, medications)
+    if cached is not None:
+        return cached[0], cached[1], _distancesFrom(location, cached[0])
+    versions = inventoryVersions.versions(medications)
+    medicationBits = toMedicationBits(medications)
+    with span("inventory.snapshot", medications=len(medicationNames)):
+        storeMasks = availability.storeMasks(medicationBits)
+    if storeMasks is None:
+        _, medicationsIndex = createTableIfNotExists(getMedicineIndexTableName())
+        with span("inventory.lookup", medications=len(medicationNames)):
+            entities = findMedicineIndexEntitiesByNames(medicationsIndex, medicationNames)
+        storeMasks = buildStoreMedicationIndex(entities, medicationBits)
+    with span("inventory.cover"):
+        result = coverStoreMasks(medicationBits, storeMasks, location)
+    _cacheLocateResult(key, versions, result[0], result[1])
+    return result
+
+async def getStoresWithMedicationNearbyAsync(medicationNames: set[str], location: Optional[Location]) -> tuple[set[str], set[str], dict[str, float]]:
+    availability = getAvailabilityView()
+    if availability.isRefreshDue():
+        await asyncio.to_thread(availability.refreshIfDue)
+    medications = tuple(sorted(set(medicationNames)))
+    key = locateResultKey(medications, location)
+    cached = _cachedLocateResult(key, medications)
+    if cached is not None:
+        if location is None:
+            return cached[0], cached[1], {}
+        return cached[0], cached[1], await asyncio.to_thread(_distancesFrom, location, cached[0])
+    versions = inventoryVersions.versions(medications)
+    medicationBits = toMedicationBits(medications)
+    with span("inventory.snapshot", medications=len(medicationNames)):
+        storeMasks = availability.storeMasks(medicationBits)
+    if storeMasks is None:
+        medicationsIndex = await createTableIfNotExistsAsync(getMedicineIndexTableName())
+        with span("inventory.lookup", medications=len(medicationNames)):
+            entities = await findMedicineIndexEntitiesByNamesAsync(medicationsIndex, medicationNames)
+        storeMasks = buildStoreMedicationIndex(entities, medicationBits)
+    with span("inventory.cover"):
+        if location is None:
+            result = coverStoreMasks(medicationBits, storeMasks, None)
+        else:
+            # The store locations may need a reload from storage, keep that off the event loop
+            result = await asyncio.to_thread(coverStoreMasks, medicationBits, storeMasks, location)
+    _cacheLocateResult(key, versions, result[0], result[1])
+    return result
+
+def toMedicationBits(medicationNames: Iterable[str]) -> dict[str, int]:
+    return {med: 1 << index for index, med in enumerate(sorted(set(medicationNames)))}
+
+def coverMedications(medicationNames: set[str], entities: Iterable[TableEntity], location: Optional[Location]) -> tuple[set[str], set[str], dict[str, float]]:
+    medicationBits = toMedicationBits(medicationNames)
+    return coverStoreMasks(medicationBits, buildStoreMedicationIndex(entities, medicationBits), location)
+
+def coverStoreMasks(medicationBits: dict[str, int], storeMasks: dict[str, int], location: Optional[Location]) -> tuple[set[str], set[str], dict[str, float]]:
+    storeDistances: dict[str, float] = {}
+    storeCosts = None
+    if location is not None:
+        # With a radius only stores inside it stay candidates, the cover then prefers closer stores
+        storeDistances = getStoreDistances(location, set(storeMasks))
+        storeMasks = {store: mask for store, mask in storeMasks.items() if store in storeDistances}
+        storeCosts = {store: distance + DISTANCE_COST_OFFSET_KM for store, distance in storeDistances.items()}
+
+    foundMask = 0
+    for mask in storeMasks.values():
+        foundMask |= mask
+    noStoreMedications = {med for med, bit in medicationBits.items() if not foundMask & bit}
+
+    selectedStores, notFoundMask = greedySetCover(storeMasks, foundMask, storeCosts)
+
+    # The remaining uncoveredMedications are those for which no stores were found within the algorithm
+    notFoundMedications = {med for med, bit in medicationBits.items() if notFoundMask & bit}
+    notFoundMedications.update(noStoreMedications)
+
+    selectedDistances = {store: storeDistances[store] for store in selectedStores if store in storeDistances}
+    return selectedStores, notFoundMedications, selectedDistances
+
+def buildStoreMedicationIndex(entities: Iterable[TableEntity], medicationBits: dict[str, int]) -> dict[str, int]:
+    # Inverted index of store -> bitmask of the requested medications it has in stock, the index query only returns available batches
+    storeMasks: dict[str, int] = {}
+    for entity in entities:
+        bit = medicationBits.get(entity['MedicineName'])
+        if bit is None:
+            continue
+        store = entity['StoreName']
+        storeMasks[store] = storeMasks.get(store, 0) | bit
+    return storeMasks
+
+def greedySetCover(storeMasks: dict[str, int], targetMask: int, storeCosts: Optional[dict[str, float]] = None) -> tuple[set[str], int]:
+    # Without costs every store costs the same and the store covering the most medications wins,
+    # with costs the store with the lowest cost per newly covered medication wins
+    remaining = targetMask
     selectedStores = set[str]()
-    
-    while notFoundMedications:
+    candidates = [(store, mask & targetMask) for store, mask in sorted(storeMasks.items()) if mask & targetMask]
+
+    while remaining and candidates:
         bestStore = None
-        medicationsCoveredByBest = set[str]()
-        
-        for store in {store for stores in medication_to_stores.values() for store in stores}:
-            medications_covered = {med for med in notFoundMedications if store in medication_to_stores[med]}
-            if len(medications_covered) > len(medicationsCoveredByBest): # type: ignore
-                bestStore = store
-                medicationsCoveredByBest = medications_covered
-        
-        if not bestStore:
+        bestCovered = 0
+        bestCount = 0
+        bestCost = 1.0
+        for store, mask in candidates:
+            covered = mask & remaining
+            # int.bit_count() needs Python 3.10
+            count = bin(covered).count("1")
+            cost = storeCosts[store] if storeCosts is not None else 1.0
+            if count * bestCost > bestCount * cost:
+                bestStore, bestCovered, bestCount, bestCost = store, covered, count, cost
+
+        if bestStore is None:
             break  # If no best store found, break out of the loop
-        
+
         selectedStores.add(bestStore)
-        notFoundMedications -= medicationsCoveredByBest
-    
-    # The remaining uncoveredMedications are those for which no stores were found within the algorithm
-    notFoundMedications.update(noStoreMedications)
-    
-    return selectedStores, notFoundMedications
+        remaining &= ~bestCovered
+        # Stores that cannot cover anything that is still missing are never considered again
+        candidates = [(store, mask) for store, mask in candidates if mask & remaining]
 
-def isViableMedicine(entity):
-    return int(entity['Quantity']) > 0 and datetime.strptime(entity['ExpiryDate'], "%Y-%m-%d") >= datetime.now()
\ No newline at end of file
+    return selectedStores, remaining
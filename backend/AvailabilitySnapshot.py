@@ -0,0 +1,297 @@
+import argparse
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from datetime import date, datetime, timezone
+from typing import Any, Iterable, Optional
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.data.tables import TableClient, TableTransactionError
+from Medicine import AVAILABILITY_CHANGES_PARTITION, availabilityChangeRowKey, availabilityFilter, inventoryVersions, toExpiryDatetime
+from schemaUtils import MAX_BATCH_OPERATIONS, chunked, createTableIfNotExists, getAvailabilityChangesTableName, getContainerClient, getMedicineIndexTableName, getStorageConnectionString
+from Tracing import recordCacheLookup
+
+# Which stores have which medication in stock, precomputed from the name index into a compact blob that every
+# worker maps into memory, so LocateMedicine answers without querying the index.
+# The blob is rebuilt on a timer, writers append every availability flip to a change log table and workers
+# patch their snapshot from it between rebuilds. Stale snapshots are never served: when a worker cannot refresh
+# for AvailabilitySnapshotMaxStalenessSeconds, or no snapshot exists, LocateMedicine queries the index instead.
+#
+# Layout, little endian:
+#   header      magic "MAVS", u32 version, f64 builtAt (unix seconds), u32 stores, u32 medications, u32 entries
+#   stores      u32 offsets[stores + 1], utf-8 names, padded to 4 bytes
+#   medications u32 offsets[medications + 1], utf-8 names sorted, padded to 4 bytes
+#   entries     u32 entryOffsets[medications + 1], u32 storeIds[entries], i32 expiryDays[entries]
+# The entries of medication m are entryOffsets[m] to entryOffsets[m + 1], expiryDays is the latest expiry of the
+# store's available batches in days since 1970-01-01, so the snapshot ages correctly between rebuilds.
+
+SNAPSHOT_MAGIC = b"MAVS"
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct("<4sIdIII")
+# Writers and the rebuild's scan overlap, changes this much older than the last one seen are applied again
+CHANGE_OVERLAP_SECONDS = 60
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def isSnapshotEnabled() -> bool:
+    return os.getenv('AvailabilitySnapshotEnabled', 'true').lower() == 'true'
+
+def getSnapshotContainerName() -> str:
+    return os.getenv('AvailabilitySnapshotContainer', 'availability')
+
+def getSnapshotBlobName() -> str:
+    return os.getenv('AvailabilitySnapshotBlob', f"snapshot-v{SNAPSHOT_VERSION}.bin")
+
+def getRefreshSeconds() -> float:
+    return float(os.getenv('AvailabilitySnapshotRefreshSeconds', '30'))
+
+def getMaxStalenessSeconds() -> float:
+    return float(os.getenv('AvailabilitySnapshotMaxStalenessSeconds', '900'))
+
+def toDayNumber(value: Any) -> int:
+    return toExpiryDatetime(value).date().toordinal() - _EPOCH_ORDINAL
+
+def todayDayNumber() -> int:
+    return datetime.now(timezone.utc).date().toordinal() - _EPOCH_ORDINAL
+
+def _littleEndian(values: array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _encodeStrings(names: list[str]) -> bytes:
+    encoded = [name.encode() for name in names]
+    offsets = array('I', [0])
+    for name in encoded:
+        offsets.append(offsets[-1] + len(name))
+    data = b"".join(encoded)
+    return _littleEndian(offsets) + data + b"\0" * (-len(data) % 4)
+
+def encodeSnapshot(builtAt: float, availability: dict[str, dict[str, int]]) -> bytes:
+    # availability maps medication -> store -> latest expiry day
+    medications = sorted(availability)
+    stores = sorted({store for storeDays in availability.values() for store in storeDays})
+    storeIds = {store: index for index, store in enumerate(stores)}
+    entryOffsets = array('I', [0])
+    entryStores = array('I')
+    expiryDays = array('i')
+    for medication in medications:
+        for store, day in sorted(availability[medication].items()):
+            entryStores.append(storeIds[store])
+            expiryDays.append(day)
+        entryOffsets.append(len(entryStores))
+    header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, builtAt, len(stores), len(medications), len(entryStores))
+    return b"".join([header, _encodeStrings(stores), _encodeStrings(medications),
+                     _littleEndian(entryOffsets), _littleEndian(entryStores), _littleEndian(expiryDays)])
+
+def _readArray(view: memoryview, offset: int, typecode: str, count: int) -> tuple[Any, int]:
+    end = offset + 4 * count
+    if sys.byteorder == 'little':
+        return view[offset:end].cast(typecode), end
+    values = array(typecode, view[offset:end].tobytes())
+    values.byteswap()
+    return values, end
+
+def _readStrings(view: memoryview, offset: int, count: int) -> tuple[list[str], int]:
+    offsets, offset = _readArray(view, offset, 'I', count + 1)
+    names = [bytes(view[offset + offsets[index]:offset + offsets[index + 1]]).decode() for index in range(count)]
+    length = offsets[count]
+    return names, offset + length + (-length % 4)
+
+class AvailabilitySnapshot:
+    def __init__(self, buffer: Any, etag: str) -> None:
+        view = memoryview(buffer)
+        magic, version, builtAt, storeCount, medicationCount, entryCount = HEADER.unpack_from(view, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported availability snapshot {magic!r} version {version}")
+        self.etag = etag
+        self.builtAt = builtAt
+        self.size = len(view)
+        self.stores, offset = _readStrings(view, HEADER.size, storeCount)
+        medications, offset = _readStrings(view, offset, medicationCount)
+        self.medicationIds = {name: index for index, name in enumerate(medications)}
+        self.entryOffsets, offset = _readArray(view, offset, 'I', medicationCount + 1)
+        self.storeIds, offset = _readArray(view, offset, 'I', entryCount)
+        self.expiryDays, offset = _readArray(view, offset, 'i', entryCount)
+
+    def storeExpiries(self, medication: str) -> Iterable[tuple[str, int]]:
+        medicationId = self.medicationIds.get(medication)
+        if medicationId is None:
+            return
+        for entry in range(self.entryOffsets[medicationId], self.entryOffsets[medicationId + 1]):
+            yield self.stores[self.storeIds[entry]], self.expiryDays[entry]
+
+def loadSnapshot(blob: Any) -> AvailabilitySnapshot:
+    # Spooled to an anonymous temporary file and mapped, the entry arrays are read in place
+    download = blob.download_blob()
+    with tempfile.TemporaryFile() as spool:
+        download.readinto(spool)
+        spool.flush()
+        mapped = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+    return AvailabilitySnapshot(mapped, download.properties.etag)
+
+class AvailabilityView:
+    # The snapshot and its overlay of (medication, store) -> expiry day, None when no longer available, are replaced
+    # together so readers never need the lock
+    def __init__(self) -> None:
+        self.state: tuple[Optional[AvailabilitySnapshot], dict[str, dict[str, Optional[int]]]] = (None, {})
+        self.changesSince = 0.0
+        self.refreshedAt: Optional[float] = None
+        self.nextRefreshAt = 0.0
+        self.refreshLock = threading.Lock()
+
+    def isRefreshDue(self) -> bool:
+        return isSnapshotEnabled() and time.monotonic() >= self.nextRefreshAt
+
+    def refreshIfDue(self) -> None:
+        # Only one caller refreshes, the others keep using the current state
+        if not self.isRefreshDue() or not self.refreshLock.acquire(blocking=False):
+            return
+        try:
+            self.nextRefreshAt = time.monotonic() + getRefreshSeconds()
+            self._refresh()
+            self.refreshedAt = time.monotonic()
+        except ResourceNotFoundError:
+            logging.info("No availability snapshot yet, locating through the index")
+            self.state = (None, {})
+        except (HttpResponseError, ValueError) as e:
+            logging.warning(f"Could not refresh the availability snapshot {e}")
+        finally:
+            self.refreshLock.release()
+
+    def _refresh(self) -> None:
+        snapshot, overlay = self.state
+        blob = getContainerClient(getStorageConnectionString(), getSnapshotContainerName()).get_blob_client(getSnapshotBlobName())
+        if snapshot is None or blob.get_blob_properties().etag != snapshot.etag:
+            snapshot = loadSnapshot(blob)
+            overlay = {}
+            self.changesSince = snapshot.builtAt - CHANGE_OVERLAP_SECONDS
+            inventoryVersions.bumpAll()
+            logging.info(f"Loaded availability snapshot of {snapshot.size} bytes built at {snapshot.builtAt}")
+        _, changes_table = createTableIfNotExists(getAvailabilityChangesTableName())
+        changes = changes_table.query_entities(
+            f"PartitionKey eq '{AVAILABILITY_CHANGES_PARTITION}' and RowKey ge '{availabilityChangeRowKey(self.changesSince)}'") # type: ignore
+        changed: dict[str, dict[str, Optional[int]]] = {}
+        snapshotDays: dict[str, dict[str, int]] = {}
+        latest = self.changesSince
+        # Change rows come ordered by RowKey, the last change of a pair wins
+        for change in changes:
+            medication, store = change['MedicineName'], change['StoreName']
+            expiry = toDayNumber(change['LatestExpiry']) if change.get('Available') else None
+            if change.get('Extends'):
+                # A batch became available, the pair stays available at least as long as it already was
+                if medication in changed and store in changed[medication]:
+                    known = changed[medication][store]
+                elif store in overlay.get(medication, {}):
+                    known = overlay[medication][store]
+                else:
+                    if medication not in snapshotDays:
+                        snapshotDays[medication] = dict(snapshot.storeExpiries(medication))
+                    known = snapshotDays[medication].get(store)
+                if known is not None and expiry is not None:
+                    expiry = max(known, expiry)
+            changed.setdefault(medication, {})[store] = expiry
+            latest = max(latest, int(change['RowKey'].split('_')[0]) / 1000 - CHANGE_OVERLAP_SECONDS)
+        # Changes seen before are read again with the overlap, only ones that differ invalidate cached results
+        inventoryVersions.bump(medication for medication, stores in changed.items()
+                               if any(overlay.get(medication, {}).get(store, -1) != expiry for store, expiry in stores.items()))
+        if changed:
+            overlay = {**overlay, **{medication: {**overlay.get(medication, {}), **stores} for medication, stores in changed.items()}}
+        self.state = (snapshot, overlay)
+        self.changesSince = latest
+
+    def medicationNames(self) -> set[str]:
+        # Every medication in stock somewhere as of the current state, empty without a snapshot
+        snapshot, overlay = self.state
+        if snapshot is None:
+            return set()
+        names = set(snapshot.medicationIds)
+        names.update(medication for medication, stores in overlay.items() if any(day is not None for day in stores.values()))
+        return names
+
+    def storeMasks(self, medicationBits: dict[str, int]) -> Optional[dict[str, int]]:
+        # None when the snapshot can't be used and the index has to be queried
+        snapshot, overlay = self.state
+        if not isSnapshotEnabled() or snapshot is None or self.refreshedAt is None or time.monotonic() - self.refreshedAt > getMaxStalenessSeconds():
+            recordCacheLookup("availabilitySnapshot", False)
+            return None
+        recordCacheLookup("availabilitySnapshot", True)
+        today = todayDayNumber()
+        storeMasks: dict[str, int] = {}
+        for medication, bit in medicationBits.items():
+            changed = overlay.get(medication, {})
+            for store, day in snapshot.storeExpiries(medication):
+                if store not in changed and day >= today:
+                    storeMasks[store] = storeMasks.get(store, 0) | bit
+            for store, day in changed.items():
+                if day is not None and day >= today:
+                    storeMasks[store] = storeMasks.get(store, 0) | bit
+        return storeMasks
+
+_availability = AvailabilityView()
+
+def getAvailabilityView() -> AvailabilityView:
+    return _availability
+
+class SnapshotReport:
+    def __init__(self) -> None:
+        self.medications = 0
+        self.stores = 0
+        self.entries = 0
+        self.bytes = 0
+        self.prunedChanges = 0
+
+    def __str__(self) -> str:
+        return (f"{self.medications} medications, {self.stores} stores, {self.entries} entries, {self.bytes} bytes, "
+                f"pruned {self.prunedChanges} changes")
+
+def buildSnapshot(index_table: TableClient) -> bytes:
+    builtAt = time.time()
+    availability: dict[str, dict[str, int]] = {}
+    for entity in index_table.query_entities(availabilityFilter(), select=['MedicineName', 'StoreName', 'ExpiryDate']): # type: ignore
+        stores = availability.setdefault(entity['MedicineName'], {})
+        day = toDayNumber(entity['ExpiryDate'])
+        if day > stores.get(entity['StoreName'], -1):
+            stores[entity['StoreName']] = day
+    return encodeSnapshot(builtAt, availability)
+
+def pruneChanges(changes_table: TableClient, before: float) -> int:
+    keys = [{'PartitionKey': change['PartitionKey'], 'RowKey': change['RowKey']} for change in changes_table.query_entities(
+        f"PartitionKey eq '{AVAILABILITY_CHANGES_PARTITION}' and RowKey lt '{availabilityChangeRowKey(before)}'",
+        select=['PartitionKey', 'RowKey'])] # type: ignore
+    for chunk in chunked(keys, MAX_BATCH_OPERATIONS):
+        try:
+            changes_table.submit_transaction([("delete", key) for key in chunk]) # type: ignore
+        except TableTransactionError as e:
+            if e.status_code != 404:
+                raise
+            for key in chunk:
+                changes_table.delete_entity(partition_key=key['PartitionKey'], row_key=key['RowKey']) # type: ignore
+    return len(keys)
+
+def rebuildAvailabilitySnapshot() -> SnapshotReport:
+    report = SnapshotReport()
+    _, index_table = createTableIfNotExists(getMedicineIndexTableName())
+    content = buildSnapshot(index_table)
+    snapshot = AvailabilitySnapshot(content, '')
+    report.medications = len(snapshot.medicationIds)
+    report.stores = len(snapshot.stores)
+    report.entries = len(snapshot.storeIds)
+    report.bytes = len(content)
+    container = getContainerClient(getStorageConnectionString(), getSnapshotContainerName())
+    container.get_blob_client(getSnapshotBlobName()).upload_blob(content, overwrite=True)
+    # Workers on an older snapshot still need its changes until they give up on it
+    _, changes_table = createTableIfNotExists(getAvailabilityChangesTableName())
+    report.prunedChanges = pruneChanges(changes_table, snapshot.builtAt - getMaxStalenessSeconds() - CHANGE_OVERLAP_SECONDS)
+    return report
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Rebuild the medication availability snapshot from the name index")
+    parser.parse_args()
+    logging.info(f"Availability snapshot {rebuildAvailabilitySnapshot()}")
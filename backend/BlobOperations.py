@@ -1,39 +1,124 @@
-from io import BytesIO
-import pickle
-from typing import Optional
-from azure.storage.blob import ContainerClient,FilteredBlob,StorageStreamDownloader
+from __future__ import annotations
+import hashlib
+import json
+import os
+from typing import Any, Optional
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from azure.storage.blob import ContainerClient
+    from azure.storage.blob.aio import ContainerClient as AsyncContainerClient
 
-from schemaUtils import getContainerClient
+from CacheUtils import LRUCache
+from schemaUtils import getAsyncContainerClient, getContainerClient
+from Tracing import increment, recordCacheLookup, span
+
+# Bump when the layout of cached payloads changes, older entries are then simply never looked up again
+CACHE_FORMAT_VERSION = 1
+
+# Recently read or written payloads, shared by every container in the worker and bounded by their encoded size
+_recentBlobs: LRUCache[str, dict[str, Any]] = LRUCache(int(os.getenv('BlobCacheMaxBytes', str(16 * 1024 * 1024))))
+
+def contentAddress(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part)
+    return f"v{CACHE_FORMAT_VERSION}/{digest.hexdigest()}"
+
+def _encode(data: dict[str, Any]) -> bytes:
+    return json.dumps({"version": CACHE_FORMAT_VERSION, "data": data}, separators=(",", ":")).encode()
+
+def _decode(blob_data: bytes) -> Optional[dict[str, Any]]:
+    try:
+        payload = json.loads(blob_data)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or payload.get("version") != CACHE_FORMAT_VERSION:
+        return None
+    return payload.get("data")
 
 class BlobOperaions:
     def __init__(self,connection : str, container_name: str) -> None:
         self.container_client : ContainerClient = getContainerClient(connection ,container_name)
 
         
-    def readBlobData(self, blob_name : str):
+    def readBlobData(self, blob_name : str) -> Optional[dict[str, Any]]:
+        # Blob names are deterministic so a lookup is a direct download, a missing blob is a cache miss
+        cacheKey = self._cacheKey(blob_name)
+        cached = _recentBlobs.get(cacheKey)
+        recordCacheLookup("blobMemoryCache", cached is not None)
+        if cached is not None:
+            return cached
         blob_client = self.container_client.get_blob_client(blob_name) # type: ignore
-        blob_stream: StorageStreamDownloader[bytes] = blob_client.download_blob() # type: ignore
-        blob_data: bytes = blob_stream.readall()
-        readObject = pickle.loads(blob_data)
-        return readObject
+        try:
+            with span("blob.read", container=self.container_client.container_name):
+                blob_data: bytes = blob_client.download_blob().readall() # type: ignore
+        except ResourceNotFoundError:
+            return None
+        finally:
+            increment("blob.roundTrips")
+        increment("blob.bytesRead", len(blob_data))
+        data = _decode(blob_data)
+        if data is not None:
+            _recentBlobs.put(cacheKey, data, len(blob_data))
+        return data
     
-    def saveBlob(self,blobName:str, data) -> None: # type: ignore
-        tags = {self._getBlobTagName():blobName}
+    def saveBlob(self,blobName:str, data: dict[str, Any]) -> None:
         blob_client = self.container_client.get_blob_client(blobName)
-        stream = BytesIO()
-        pickle.dump(data,stream) # type: ignore
-        stream.seek(0)
-        blob_client.upload_blob(stream.read(),tags=tags,overwrite=True) # type: ignore
-        
-    def getBlob(self,blobName : str) -> Optional[FilteredBlob]:
-        filter_expressions = f"\"{self._getBlobTagName()}\"='{blobName}'"
-        blobs_iter = self.container_client.find_blobs_by_tags(filter_expression=filter_expressions)
-        blobs = list(blobs_iter)
-        if not blobs:
-            return None
-        if len(blobs) > 1:
-            raise ValueError("More than one entry found")
-        return blobs[0]
+        encoded = _encode(data)
+        try:
+            with span("blob.write", container=self.container_client.container_name):
+                blob_client.upload_blob(encoded,overwrite=False) # type: ignore
+        except ResourceExistsError:
+            pass  # Content addressed, whoever wrote it first wrote the same thing
+        increment("blob.roundTrips")
+        increment("blob.bytesWritten", len(encoded))
+        _recentBlobs.put(self._cacheKey(blobName), data, len(encoded))
     
-    def _getBlobTagName(self) -> str:
-        return "BlobName"
\ No newline at end of file
+    def _cacheKey(self, blob_name: str) -> str:
+        return f"{self.container_client.container_name}/{blob_name}"
+
+class AsyncBlobOperaions:
+    # Same cache as BlobOperaions on top of the aio container client, build it with AsyncBlobOperaions.create
+    def __init__(self, container_client: AsyncContainerClient) -> None:
+        self.container_client = container_client
+
+    @staticmethod
+    async def create(connection : str, container_name: str) -> 'AsyncBlobOperaions':
+        return AsyncBlobOperaions(await getAsyncContainerClient(connection, container_name))
+
+    async def readBlobData(self, blob_name : str) -> Optional[dict[str, Any]]:
+        cacheKey = self._cacheKey(blob_name)
+        cached = _recentBlobs.get(cacheKey)
+        recordCacheLookup("blobMemoryCache", cached is not None)
+        if cached is not None:
+            return cached
+        blob_client = self.container_client.get_blob_client(blob_name)
+        try:
+            with span("blob.read", container=self.container_client.container_name):
+                downloader = await blob_client.download_blob()
+                blob_data: bytes = await downloader.readall()
+        except ResourceNotFoundError:
+            return None
+        finally:
+            increment("blob.roundTrips")
+        increment("blob.bytesRead", len(blob_data))
+        data = _decode(blob_data)
+        if data is not None:
+            _recentBlobs.put(cacheKey, data, len(blob_data))
+        return data
+
+    async def saveBlob(self,blobName:str, data: dict[str, Any]) -> None:
+        blob_client = self.container_client.get_blob_client(blobName)
+        encoded = _encode(data)
+        try:
+            with span("blob.write", container=self.container_client.container_name):
+                await blob_client.upload_blob(encoded,overwrite=False)
+        except ResourceExistsError:
+            pass
+        increment("blob.roundTrips")
+        increment("blob.bytesWritten", len(encoded))
+        _recentBlobs.put(self._cacheKey(blobName), data, len(encoded))
+
+    def _cacheKey(self, blob_name: str) -> str:
+        return f"{self.container_client.container_name}/{blob_name}"
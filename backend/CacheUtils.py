@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Iterable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+class LRUCache(Generic[K, V]):
+    # Thread safe least recently used cache, bounded by the total size of its values,
+    # measured by sizeOf unless the caller already knows an entry's size.
+    # With ttlSeconds entries also expire that long after they were put.
+    def __init__(self, maxSize: int, sizeOf: Callable[[V], int] = lambda _: 1, ttlSeconds: Optional[float] = None) -> None:
+        self.maxSize = maxSize
+        self.sizeOf = sizeOf
+        self.ttlSeconds = ttlSeconds
+        self.size = 0
+        self._entries: OrderedDict[K, tuple[V, int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: K, value: V, size: Optional[int] = None) -> None:
+        size = self.sizeOf(value) if size is None else size
+        with self._lock:
+            self._remove(key)
+            if size > self.maxSize:
+                return
+            expiresAt = time.monotonic() + self.ttlSeconds if self.ttlSeconds is not None else float("inf")
+            self._entries[key] = (value, size, expiresAt)
+            self.size += size
+            while self.size > self.maxSize:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def invalidate(self, key: K) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: K) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+class VersionCounters(Generic[K]):
+    # Thread safe version number per key, a value derived from some keys stays valid while versions() of those
+    # keys is unchanged. bumpAll invalidates every key at once.
+    def __init__(self) -> None:
+        self._versions: dict[K, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def bump(self, keys: Iterable[K]) -> None:
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def bumpAll(self) -> None:
+        with self._lock:
+            self._epoch += 1
+
+    def versions(self, keys: Iterable[K]) -> tuple[int, ...]:
+        with self._lock:
+            return (self._epoch, *(self._versions.get(key, 0) for key in keys))
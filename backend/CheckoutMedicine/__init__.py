@@ -3,7 +3,7 @@ import azure.functions as func
 from azure.core.exceptions import HttpResponseError
 import jwt
 from schemaUtils import createTableIfNotExists, getMedicineTableName
-from Medicine import MedicineRequestParser,removeMedicineFromInventory
+from Medicine import MedicineRequestParser,applyInventoryChanges,removeMedicineFromInventory
 from TokenUtils import TokenCredentials
 def main(
         req: func.HttpRequest
@@ -11,10 +11,13 @@ def main(
     try:
         token = TokenCredentials.decodeRequestToken(req)
         storeName = token['store_name']
-        medicine = MedicineRequestParser.parse(req,storeName)
+        items = MedicineRequestParser.parseItems(req,storeName)
         _,table_client = createTableIfNotExists(getMedicineTableName())
-        with table_client as table:
-            removeMedicineFromInventory(medicine, table,storeName)
+        if items is not None:
+            applyInventoryChanges(table_client, [(medicine, -quantity) for medicine, quantity in items])
+        else:
+            medicine = MedicineRequestParser.parse(req,storeName)
+            removeMedicineFromInventory(medicine, table_client,storeName)
         return func.HttpResponse(f"Medicine checkout processed successfully", status_code=200)
     except ValueError as e:
         logging.error(f"ValueError: {e}")
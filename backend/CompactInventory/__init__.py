@@ -0,0 +1,16 @@
+import logging
+import azure.functions as func
+from azure.core.exceptions import HttpResponseError
+from InventoryCompaction import compactInventory
+
+def main(timer: func.TimerRequest) -> None:
+    if timer.past_due:
+        logging.warning("Inventory compaction is running late")
+    try:
+        report = compactInventory()
+    except HttpResponseError as e:
+        logging.error(f"Inventory compaction failed: {e}")
+        raise
+    if not report.complete:
+        logging.warning("Inventory compaction ran out of time, the next run continues where it stopped")
+    logging.info(f"Inventory compaction {report}")
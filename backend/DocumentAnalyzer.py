@@ -1,49 +1,92 @@
-from azure.ai.formrecognizer import AnalyzeResult
-from azure.ai.textanalytics import AnalyzeHealthcareEntitiesResult
-from schemaUtils import getStorageConnectionString, getTextAnalyticsClient
-from BlobOperations import BlobOperaions
+from __future__ import annotations
+import asyncio
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from azure.ai.textanalytics import AnalyzeHealthcareEntitiesResult
+from schemaUtils import getAsyncTextAnalyticsClient, getStorageConnectionString, getTextAnalyticsClient
+from BlobOperations import AsyncBlobOperaions, BlobOperaions, contentAddress
+from DocumentReader import ReadDocument
+from EntityBatcher import getAsyncEntityBatcher, getEntityBatcher
+from MedicationLexicon import getMedicationLexicon
+from Tracing import increment, recordCacheLookup, span
 import re
 
 class DocumentAnalyzer:
-    def getMedicationsNames(self,documentName :str,readDocument:AnalyzeResult) -> set[str]:
-        wordsSentence = self._getPossibleMedicineNamesString(readDocument)
+    def getMedicationsNames(self,readDocument:ReadDocument) -> set[str]:
+        # Words the lexicon resolves never leave the worker, only the rest go to text analytics
+        lexicon = getMedicationLexicon()
+        lexicon.refreshIfDue()
+        knownMedications, unresolvedWords = self._resolveLocally(readDocument)
+        if not unresolvedWords:
+            return knownMedications
+        # Cached by the hash of the words sent for analysis, different images with the same text share an entry
+        wordsSentence = "\n".join(sorted(unresolvedWords))
+        blobName = contentAddress(wordsSentence.encode())
         blobOperations = BlobOperaions(getStorageConnectionString(),self._getDocumentProccesedContainerName())
-        blob = blobOperations.getBlob(documentName)
-        if blob: 
-            analysisResult = blobOperations.readBlobData(blob.name) # type: ignore
+        cached = blobOperations.readBlobData(blobName)
+        recordCacheLookup("nerCache", cached is not None)
+        if cached is not None:
+            medicationEntities : list[str] = cached["medications"]
         else:
-            analysisResult = self._analyzeHealthcareEntities(wordsSentence)
-            blobOperations.saveBlob(documentName, analysisResult) # type: ignore
-        medicationNames = self._analyzeMedicationsNames(analysisResult)  # type: ignore
-        return medicationNames
+            with span("ner", words=wordsSentence.count("\n") + 1):
+                medicationEntities = self._getMedicationEntities(self._analyzeHealthcareEntities(wordsSentence))
+            increment("ner.charactersSent", len(wordsSentence))
+            blobOperations.saveBlob(blobName, {"medications": medicationEntities})
+            lexicon.learn(unresolvedWords, medicationEntities)
+        medicationNames = self._analyzeMedicationsNames(medicationEntities)
+        return knownMedications | medicationNames
 
+    async def getMedicationsNamesAsync(self,readDocument:ReadDocument) -> set[str]:
+        lexicon = getMedicationLexicon()
+        if lexicon.isRefreshDue():
+            await asyncio.to_thread(lexicon.refreshIfDue)
+        knownMedications, unresolvedWords = self._resolveLocally(readDocument)
+        if not unresolvedWords:
+            return knownMedications
+        wordsSentence = "\n".join(sorted(unresolvedWords))
+        blobName = contentAddress(wordsSentence.encode())
+        blobOperations = await AsyncBlobOperaions.create(getStorageConnectionString(),self._getDocumentProccesedContainerName())
+        cached = await blobOperations.readBlobData(blobName)
+        recordCacheLookup("nerCache", cached is not None)
+        if cached is not None:
+            medicationEntities : list[str] = cached["medications"]
+        else:
+            with span("ner", words=wordsSentence.count("\n") + 1):
+                medicationEntities = self._getMedicationEntities(await self._analyzeHealthcareEntitiesAsync(wordsSentence))
+            increment("ner.charactersSent", len(wordsSentence))
+            await blobOperations.saveBlob(blobName, {"medications": medicationEntities})
+            await asyncio.to_thread(lexicon.learn, unresolvedWords, medicationEntities)
+        return knownMedications | self._analyzeMedicationsNames(medicationEntities)
+
+    def _resolveLocally(self,readDocument: ReadDocument) -> tuple[set[str], set[str]]:
+        words = self._getPossibleMedicineNames(readDocument)
+        knownMedications, unresolvedWords = getMedicationLexicon().resolve(words)
+        increment("lexicon.resolvedWords", len(words) - len(unresolvedWords))
+        increment("lexicon.unresolvedWords", len(unresolvedWords))
+        return knownMedications, unresolvedWords
 
-    def _getPossibleMedicineNames(self,readDocument: AnalyzeResult)-> set[str]: 
+    def _getPossibleMedicineNames(self,readDocument: ReadDocument)-> set[str]: 
         words : set[str] = set()
-        for page in readDocument.pages:
-            for _, line in enumerate(page.lines):
-                line_words = line.get_words()
-                for word in line_words:
-                    if word.confidence > 0.85 and bool(re.match('^[a-zA-Z]+$', word.content)):
-                        words.add(word.content.lower())
+        for content, confidence in readDocument.words:
+            if confidence > 0.85 and bool(re.match('^[a-zA-Z]+$', content)):
+                words.add(content.lower())
         return words
-    def _getPossibleMedicineNamesString(self,readDocument: AnalyzeResult)-> str:
-        words = self._getPossibleMedicineNames(readDocument)
-        words_list = "\n".join(words)
-        return words_list
 
 
+    def _getMedicationEntities(self,doc: AnalyzeHealthcareEntitiesResult) -> list[str]:
+        return [entity.text for entity in doc.entities if entity.category == "MedicationName"]
 
-    def _analyzeMedicationsNames(self,doc: AnalyzeHealthcareEntitiesResult) -> set[str] :
+    def _analyzeMedicationsNames(self,medicationEntities: list[str]) -> set[str] :
         medications : set[str] = set()
-        for entity in doc.entities:
-            if not entity.category == "MedicationName":
-                continue
-            medications.add(entity.text.lower().split(" ")[0])
+        for text in medicationEntities:
+            medications.add(text.lower().split(" ")[0])
 
         return medications 
 
     def _analyzeHealthcareEntities(self,wordsSentence : str) -> AnalyzeHealthcareEntitiesResult:
+        batcher = getEntityBatcher()
+        if batcher is not None:
+            return self._getSingleDocument([batcher.submit(wordsSentence).result()])
         client = getTextAnalyticsClient()
         documents = [
             wordsSentence
@@ -52,6 +95,20 @@ class DocumentAnalyzer:
         poller = client.begin_analyze_healthcare_entities(documents)
         result = poller.result()
         docs = [doc for doc in result if not doc.is_error]
+        return self._getSingleDocument(docs)
+
+    async def _analyzeHealthcareEntitiesAsync(self,wordsSentence : str) -> AnalyzeHealthcareEntitiesResult:
+        # Batched prescriptions share one operation run on this event loop, this invocation only awaits its document
+        batcher = getAsyncEntityBatcher()
+        if batcher is not None:
+            return self._getSingleDocument([await batcher.submit(wordsSentence)])
+        client = getAsyncTextAnalyticsClient()
+        poller = await client.begin_analyze_healthcare_entities([wordsSentence])
+        result = await poller.result()
+        docs = [doc async for doc in result if not doc.is_error]
+        return self._getSingleDocument(docs)
+
+    def _getSingleDocument(self,docs : list) -> AnalyzeHealthcareEntitiesResult:
         if not docs:
             raise ValueError("No documents found")
         if len(docs) > 1:
@@ -62,4 +119,4 @@ class DocumentAnalyzer:
     def _getDocumentProccesedContainerName(self)-> str:
         return "processed-text"
 
-        
\ No newline at end of file
+        
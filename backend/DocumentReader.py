@@ -1,20 +1,98 @@
-
-import base64
-from Image import Image
-from schemaUtils import getDocumentAnalysisClient, getStorageConnectionString
-from BlobOperations import BlobOperaions
-from azure.ai.formrecognizer import AnalyzeResult
+from __future__ import annotations
+import asyncio
+from dataclasses import dataclass
+from Image import Image, normalizeImage
+from NearDuplicateImages import getNearDuplicateIndex
+from schemaUtils import getAsyncDocumentAnalysisClient, getDocumentAnalysisClient, getStorageConnectionString
+from BlobOperations import AsyncBlobOperaions, BlobOperaions, contentAddress
+from Tracing import increment, recordCacheLookup, span
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from azure.ai.formrecognizer import AnalyzeResult
 from io import BytesIO
+
+@dataclass
+class ReadDocument:
+    # The only part of the OCR result the pipeline uses: every word with its confidence
+    words: list[tuple[str, float]]
+
+    @staticmethod
+    def fromAnalyzeResult(result: AnalyzeResult) -> 'ReadDocument':
+        words = [(word.content, word.confidence) for page in result.pages for line in page.lines for word in line.get_words()]
+        return ReadDocument(words=words)
+
+    @staticmethod
+    def fromDict(data: dict) -> 'ReadDocument':
+        return ReadDocument(words=[(content, confidence) for content, confidence in data["words"]])
+
+    def asdict(self) -> dict:
+        return {"words": [[content, confidence] for content, confidence in self.words]}
+
 class DocumentReader:
     @staticmethod
-    def getDocumentText(image : Image) -> AnalyzeResult:
+    def getDocumentText(image : Image) -> ReadDocument:
+        # Cached by the hash of the image as uploaded, the same photo under another name is still a hit
+        binaryData = image.data
+        blobName = contentAddress(binaryData)
         blobOperations = BlobOperaions(getStorageConnectionString(),DocumentReader._getDocumentReadContainerName())
-        blob = blobOperations.getBlob(image.name)
-        if blob: 
-            readDocument = blobOperations.readBlobData(blob.name) # type: ignore
-        else:
-            readDocument = DocumentReader._analyzeDocumentBase64(image.base64Data)
-            blobOperations.saveBlob(image.name,readDocument) # type: ignore
+        cached = blobOperations.readBlobData(blobName)
+        recordCacheLookup("ocrCache", cached is not None)
+        if cached is not None:
+            return ReadDocument.fromDict(cached)
+        # Another photo of the same prescription may have been read already
+        nearDuplicates = getNearDuplicateIndex()
+        nearDuplicates.refreshIfDue()
+        with span("fingerprint"):
+            fingerprint = nearDuplicates.hashOf(binaryData)
+        if fingerprint is not None:
+            nearBlobName = nearDuplicates.find(fingerprint)
+            cached = blobOperations.readBlobData(nearBlobName) if nearBlobName is not None else None
+            recordCacheLookup("ocrNearDuplicate", cached is not None)
+            if cached is not None:
+                # Saved under this image as well, the same upload again is then an exact hit
+                blobOperations.saveBlob(blobName,cached)
+                return ReadDocument.fromDict(cached)
+        with span("normalizeImage"):
+            document = normalizeImage(binaryData)
+        with span("ocr", bytes=len(document)):
+            readDocument = ReadDocument.fromAnalyzeResult(DocumentReader._analyzeDocument(BytesIO(document)))
+        increment("ocr.bytesSent", len(document))
+        blobOperations.saveBlob(blobName,readDocument.asdict())
+        if fingerprint is not None:
+            nearDuplicates.record(fingerprint, blobName)
+        return readDocument
+    @staticmethod
+    async def getDocumentTextAsync(image : Image) -> ReadDocument:
+        binaryData = image.data
+        blobName = contentAddress(binaryData)
+        blobOperations = await AsyncBlobOperaions.create(getStorageConnectionString(),DocumentReader._getDocumentReadContainerName())
+        cached = await blobOperations.readBlobData(blobName)
+        recordCacheLookup("ocrCache", cached is not None)
+        if cached is not None:
+            return ReadDocument.fromDict(cached)
+        nearDuplicates = getNearDuplicateIndex()
+        nearDuplicates.refreshIfDue()
+        with span("fingerprint"):
+            fingerprint = await asyncio.to_thread(nearDuplicates.hashOf, binaryData)
+        if fingerprint is not None:
+            # Confirming a match downloads and compares the recorded regions, keep it off the event loop
+            nearBlobName = await asyncio.to_thread(nearDuplicates.find, fingerprint)
+            cached = await blobOperations.readBlobData(nearBlobName) if nearBlobName is not None else None
+            recordCacheLookup("ocrNearDuplicate", cached is not None)
+            if cached is not None:
+                await blobOperations.saveBlob(blobName,cached)
+                return ReadDocument.fromDict(cached)
+        with span("normalizeImage"):
+            # Decoding and resizing is CPU bound, keep it off the event loop
+            document = await asyncio.to_thread(normalizeImage, binaryData)
+        client = getAsyncDocumentAnalysisClient()
+        with span("ocr", bytes=len(document)):
+            poller = await client.begin_analyze_document("prebuilt-document", document=document)
+            readDocument = ReadDocument.fromAnalyzeResult(await poller.result())
+        increment("ocr.bytesSent", len(document))
+        await blobOperations.saveBlob(blobName,readDocument.asdict())
+        if fingerprint is not None:
+            await asyncio.to_thread(nearDuplicates.record, fingerprint, blobName)
         return readDocument
     @staticmethod
     def _analyzeDocument(binaryData: BytesIO) -> AnalyzeResult:
@@ -25,9 +103,5 @@ class DocumentReader:
         readDocument = poller.result()
         return readDocument
     @staticmethod
-    def _analyzeDocumentBase64(base64Data :str) -> AnalyzeResult:
-        binaryData = BytesIO(base64.b64decode(base64Data))
-        return DocumentReader._analyzeDocument(binaryData)
-    @staticmethod
     def _getDocumentReadContainerName() -> str:
         return "image-text"
\ No newline at end of file
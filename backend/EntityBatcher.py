@@ -0,0 +1,177 @@
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional
+from weakref import WeakKeyDictionary
+from schemaUtils import getAsyncTextAnalyticsClient, getTextAnalyticsClient
+
+# Collects the word lists of concurrent prescriptions and submits them to text analytics as one healthcare operation
+# of up to NerBatchMaxDocuments documents, so a burst of prescriptions pays one long running operation instead of one
+# each. A document that arrives while no operation is running goes out right away, one that arrives while an operation
+# is running waits until the batch is full or NerBatchWindowMs after the batch's first document, so a lone request
+# never pays the window. Every caller gets a future of its own document's result. Sync invocations share a batcher
+# whose threads use the sync client, async ones a batcher per event loop on the aio client. NerBatchWindowMs=0
+# disables batching.
+
+# Documents per healthcare entities request allowed by the service
+MAX_DOCUMENTS_PER_REQUEST = 25
+
+def getBatchWindowSeconds() -> float:
+    return float(os.getenv('NerBatchWindowMs', '50')) / 1000
+
+def getBatchMaxDocuments() -> int:
+    return min(int(os.getenv('NerBatchMaxDocuments', str(MAX_DOCUMENTS_PER_REQUEST))), MAX_DOCUMENTS_PER_REQUEST)
+
+def getMaxBatchesInFlight() -> int:
+    return int(os.getenv('NerBatchMaxInFlight', '4'))
+
+def analyzeHealthcareDocuments(documents: list[str]) -> list[Any]:
+    # One result per document in the order they were sent, documents the service failed on are returned with is_error set
+    client = getTextAnalyticsClient()
+    poller = client.begin_analyze_healthcare_entities([{"id": str(index), "text": text} for index, text in enumerate(documents)])
+    return list(poller.result())
+
+async def analyzeHealthcareDocumentsAsync(documents: list[str]) -> list[Any]:
+    client = getAsyncTextAnalyticsClient()
+    poller = await client.begin_analyze_healthcare_entities([{"id": str(index), "text": text} for index, text in enumerate(documents)])
+    return [result async for result in await poller.result()]
+
+def _resolve(batch: dict[str, list], results: Optional[list[Any]], error: Optional[BaseException]) -> None:
+    # Hands every caller its document's result, or the error of the whole operation
+    if error is None and results is not None and len(results) != len(batch):
+        error = ValueError("Text analytics returned a different number of documents")
+    for index, futures in enumerate(batch.values()):
+        for future in futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[index]) # type: ignore
+
+class EntityBatcher:
+    def __init__(self, analyze: Callable[[list[str]], list[Any]], windowSeconds: float, maxDocuments: int, maxInFlight: int) -> None:
+        self.analyze = analyze
+        self.windowSeconds = windowSeconds
+        self.maxDocuments = maxDocuments
+        # Identical word lists share one document and its result
+        self.pending: dict[str, list[Future]] = {}
+        self.firstPendingAt = 0.0
+        self.inFlight = 0
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=maxInFlight, thread_name_prefix="ner-batch")
+        self.flusher = threading.Thread(target=self._flushLoop, name="ner-batcher", daemon=True)
+        self.flusher.start()
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        with self.condition:
+            if not self.pending:
+                self.firstPendingAt = time.monotonic()
+            self.pending.setdefault(text, []).append(future)
+            if len(self.pending) == 1 or len(self.pending) >= self.maxDocuments:
+                self.condition.notify()
+        return future
+
+    def _flushLoop(self) -> None:
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                while len(self.pending) < self.maxDocuments and self.inFlight > 0:
+                    remaining = self.firstPendingAt + self.windowSeconds - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch, self.pending = self.pending, {}
+                self.inFlight += 1
+            self.executor.submit(self._run, batch)
+
+    def _run(self, batch: dict[str, list[Future]]) -> None:
+        try:
+            results = self.analyze(list(batch))
+            logging.debug(f"Analyzed {len(batch)} documents for {sum(len(futures) for futures in batch.values())} prescriptions in one operation")
+            _resolve(batch, results, None)
+        except Exception as e:
+            _resolve(batch, None, e)
+        finally:
+            with self.condition:
+                self.inFlight -= 1
+                self.condition.notify()
+
+class AsyncEntityBatcher:
+    # The same batching on one event loop, no threads: a flush is a task awaiting the aio client
+    def __init__(self, analyze: Callable[[list[str]], Awaitable[list[Any]]], windowSeconds: float, maxDocuments: int, maxInFlight: int) -> None:
+        self.analyze = analyze
+        self.windowSeconds = windowSeconds
+        self.maxDocuments = maxDocuments
+        self.maxInFlight = maxInFlight
+        self.pending: dict[str, list[asyncio.Future]] = {}
+        self.inFlight = 0
+        self.flushHandle: Optional[asyncio.Handle] = None
+        self.tasks: set[asyncio.Task] = set()
+
+    def submit(self, text: str) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.setdefault(text, []).append(future)
+        if len(self.pending) >= self.maxDocuments:
+            self._flush()
+        elif self.flushHandle is None:
+            # Idle: documents submitted in this loop iteration still join, running: wait for the batch window
+            delay = 0 if self.inFlight == 0 else self.windowSeconds
+            self.flushHandle = loop.call_later(delay, self._flush)
+        return future
+
+    def _flush(self) -> None:
+        if self.flushHandle is not None:
+            self.flushHandle.cancel()
+            self.flushHandle = None
+        if not self.pending:
+            return
+        if self.inFlight >= self.maxInFlight:
+            # Picked up again when a running operation finishes
+            return
+        batch, self.pending = self.pending, {}
+        self.inFlight += 1
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch: dict[str, list[asyncio.Future]]) -> None:
+        try:
+            _resolve(batch, await self.analyze(list(batch)), None)
+        except Exception as e:
+            _resolve(batch, None, e)
+        finally:
+            self.inFlight -= 1
+            if self.pending and self.flushHandle is None:
+                self._flush()
+
+_batcher: Optional[EntityBatcher] = None
+_batcherLock = threading.Lock()
+_asyncBatchers: WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncEntityBatcher] = WeakKeyDictionary()
+
+def getEntityBatcher() -> Optional[EntityBatcher]:
+    global _batcher
+    if getBatchWindowSeconds() <= 0:
+        return None
+    with _batcherLock:
+        if _batcher is None:
+            _batcher = EntityBatcher(analyzeHealthcareDocuments, getBatchWindowSeconds(), getBatchMaxDocuments(), getMaxBatchesInFlight())
+        return _batcher
+
+def getAsyncEntityBatcher() -> Optional[AsyncEntityBatcher]:
+    # One per event loop, its futures and tasks belong to that loop
+    if getBatchWindowSeconds() <= 0:
+        return None
+    loop = asyncio.get_running_loop()
+    batcher = _asyncBatchers.get(loop)
+    if batcher is None:
+        batcher = AsyncEntityBatcher(analyzeHealthcareDocumentsAsync, getBatchWindowSeconds(), getBatchMaxDocuments(), getMaxBatchesInFlight())
+        _asyncBatchers[loop] = batcher
+    return batcher
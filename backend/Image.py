@@ -1,17 +1,131 @@
+import base64
+import binascii
+import logging
+import os
+from email.message import Message
+from email.parser import HeaderParser
+from io import BytesIO
+from typing import Any, Optional
 from schemaUtils import BaseEntity
 from dataclasses import dataclass
 import azure.functions as func
 @dataclass
 class Image(BaseEntity):
-   base64Data: str
+   data: bytes
    name: str
-   
+
+# The photo comes base64 encoded in a JSON body (imageData, imageName), as the raw body with Content-Type
+# application/octet-stream or image/*, or as the "image" file of a multipart/form-data body. The binary forms
+# take imageName and the location from the query string.
+BINARY_MEDIA_TYPES = ('application/octet-stream', 'multipart/form-data')
+DEFAULT_IMAGE_NAME = 'upload'
+JPEG_QUALITY = 85
+
+def getMediaType(req: func.HttpRequest) -> str:
+    return req.headers.get('Content-Type', '').split(';')[0].strip().lower()
+
+def isBinaryUpload(req: func.HttpRequest) -> bool:
+    mediaType = getMediaType(req)
+    return mediaType in BINARY_MEDIA_TYPES or mediaType.startswith('image/')
+
+def _headerParameter(value: str, header: str, parameter: str) -> Optional[str]:
+    message = Message()
+    message[header] = value
+    result = message.get_param(parameter, header=header)
+    return result if isinstance(result, str) else None
+
 class ImageParser:
     @staticmethod
     def parse(req: func.HttpRequest) -> Image:
+        if getMediaType(req) == 'multipart/form-data':
+            return ImageParser._parseMultipart(req)
+        if isBinaryUpload(req):
+            data = req.get_body()
+            if not data:
+                raise ValueError("No image data")
+            return Image(data=data, name=req.params.get('imageName', DEFAULT_IMAGE_NAME))
         req_body = req.get_json()
+        imageData = req_body.get("imageData")
+        if not imageData:
+            raise ValueError("No image data")
+        try:
+            data = base64.b64decode(imageData)
+        except (binascii.Error, TypeError):
+            raise ValueError("Invalid image data")
         return Image(
-            base64Data=req_body.get("imageData"),
+            data=data,
             name=req_body.get("imageName")
         )
-        
\ No newline at end of file
+
+    @staticmethod
+    def _parseMultipart(req: func.HttpRequest) -> Image:
+        # The part named "image", or else the first file, is sliced out of the body once
+        body = req.get_body()
+        boundary = _headerParameter(req.headers.get('Content-Type', ''), 'content-type', 'boundary')
+        if not boundary:
+            raise ValueError("Missing multipart boundary")
+        delimiter = b"--" + boundary.encode()
+        position = body.find(delimiter)
+        fallback: Optional[Image] = None
+        while position != -1 and body[position + len(delimiter):position + len(delimiter) + 2] != b"--":
+            headersStart = position + len(delimiter) + 2
+            headersEnd = body.find(b"\r\n\r\n", headersStart)
+            end = body.find(b"\r\n" + delimiter, headersEnd + 4) if headersEnd != -1 else -1
+            if end == -1:
+                break
+            headers = HeaderParser().parsestr(body[headersStart:headersEnd].decode('latin-1'))
+            fieldName = headers.get_param('name', header='content-disposition')
+            fileName = headers.get_filename()
+            if fieldName == 'image' or (fileName and fallback is None):
+                image = Image(data=body[headersEnd + 4:end], name=fileName or req.params.get('imageName', DEFAULT_IMAGE_NAME))
+                if fieldName == 'image':
+                    return image
+                fallback = image
+            position = end + 2
+        if fallback is None or not fallback.data:
+            raise ValueError("No image in the form")
+        return fallback
+
+_pillow: Any = None
+_pillowLoaded = False
+
+def getPillow() -> Any:
+    # Optional dependency, without Pillow images go to OCR as uploaded
+    global _pillow, _pillowLoaded
+    if not _pillowLoaded:
+        try:
+            from PIL import Image as PILImage, ImageOps
+            _pillow = (PILImage, ImageOps)
+        except ImportError:
+            logging.warning("Pillow is not installed, images are sent to OCR as uploaded")
+        _pillowLoaded = True
+    return _pillow
+
+def isImageNormalizationEnabled() -> bool:
+    return os.getenv('ImageNormalizationEnabled', 'true').lower() == 'true'
+
+def getMaxImageDimension() -> int:
+    return int(os.getenv('ImageMaxDimension', '2000'))
+
+def normalizeImage(data: bytes) -> bytes:
+    # Upright, grayscale, at most ImageMaxDimension on the long side and JPEG encoded, kept only when smaller.
+    # Anything Pillow can't read, PDFs and multi page scans included, is sent as uploaded.
+    pillow = getPillow() if isImageNormalizationEnabled() else None
+    if pillow is None:
+        return data
+    PILImage, ImageOps = pillow
+    maxDimension = getMaxImageDimension()
+    try:
+        with PILImage.open(BytesIO(data)) as image:
+            if getattr(image, 'n_frames', 1) > 1:
+                return data
+            # JPEGs are decoded straight at a reduced scale when that is still large enough
+            image.draft('L', (maxDimension, maxDimension))
+            normalized = ImageOps.exif_transpose(image).convert('L')
+            normalized.thumbnail((maxDimension, maxDimension), PILImage.LANCZOS)
+            output = BytesIO()
+            normalized.save(output, format='JPEG', quality=JPEG_QUALITY)
+    except (OSError, ValueError, PILImage.DecompressionBombError) as e:
+        logging.info(f"Sending the image as uploaded, it could not be normalized: {e}")
+        return data
+    return output.getvalue() if output.tell() < len(data) else data
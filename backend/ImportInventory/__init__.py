@@ -0,0 +1,36 @@
+import json
+import logging
+import azure.functions as func
+from azure.core.exceptions import HttpResponseError
+import jwt
+from schemaUtils import createTableIfNotExists, getMedicineTableName
+from InventoryImport import importInventory
+from TokenUtils import TokenCredentials
+
+# Body is CSV (Content-Type: text/csv, header row with the AddMedicine field names plus quantity)
+# or JSON lines with one AddMedicine object per line
+def main(
+        req: func.HttpRequest
+    ) -> func.HttpResponse:
+    try:
+        token = TokenCredentials.decodeRequestToken(req)
+        storeName = token['store_name']
+        _,table_client = createTableIfNotExists(getMedicineTableName())
+        report = importInventory(table_client, storeName, req.get_body(), req.headers.get('Content-Type', ''))
+        logging.info(f"Imported {report.imported} rows for {storeName}, {report.failed} failed")
+        status_code = 200 if report.failed == 0 else 206
+        return func.HttpResponse(json.dumps(report.asdict()), status_code=status_code, mimetype="application/json")
+    except ValueError as e:
+        logging.error(f"ValueError: {e}")
+        return func.HttpResponse(str(e), status_code=400)
+    except HttpResponseError as e:
+        logging.error(f"Could not create table {e}")
+        return func.HttpResponse(f"Server communication went wrong", status_code=500)
+    except jwt.ExpiredSignatureError as e:
+        return func.HttpResponse(f"Expired Token", status_code=401)
+    except jwt.InvalidTokenError as e:
+        logging.error(f"Bad Token {e}")
+        return func.HttpResponse(f"Invalid Token", status_code=401)
+    except Exception as e:
+        logging.error(f"Exception: {e}")
+        return func.HttpResponse(f"Something went wrong", status_code=500)
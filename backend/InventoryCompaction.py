@@ -0,0 +1,135 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterable
+from azure.core import MatchConditions
+from azure.data.tables import TableClient, TableTransactionError
+from Medicine import toMedicineIndexEntity
+from schemaUtils import MAX_BATCH_OPERATIONS, chunked, createTableIfNotExists, getContainerClient, getMedicineIndexTableName, getMedicineTableName, getStorageConnectionString
+
+# Removes batches that are out of stock or past their expiry from the Medicine table and the name index.
+# Every page of dead rows is first written to a gzipped JSON lines archive blob, then deleted in per partition
+# transactions that only succeed if the row is unchanged, so a batch restocked meanwhile is kept.
+# Runs are bounded in time, whatever is left is picked up by the next run.
+
+PAGE_SIZE = 1000
+
+def getArchiveContainerName() -> str:
+    return os.getenv('InventoryArchiveContainer', 'inventory-archive')
+
+def getExpiryGraceDays() -> int:
+    # Expired batches are kept this many days before they are compacted
+    return int(os.getenv('InventoryCompactionGraceDays', '0'))
+
+def getMaxRunSeconds() -> float:
+    return float(os.getenv('InventoryCompactionMaxSeconds', '240'))
+
+def deadInventoryFilter() -> str:
+    cutoff = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=getExpiryGraceDays())
+    return f"Quantity le 0 or ExpiryDate lt datetime'{cutoff.strftime('%Y-%m-%dT%H:%M:%SZ')}'"
+
+class CompactionReport:
+    def __init__(self, runId: str) -> None:
+        self.runId = runId
+        self.scanned = 0
+        self.deleted = 0
+        self.conflicts = 0
+        self.indexDeleted = 0
+        self.archives: list[str] = []
+        self.complete = True
+
+    def asdict(self) -> dict:
+        return {'runId': self.runId, 'scanned': self.scanned, 'deleted': self.deleted, 'conflicts': self.conflicts,
+                'indexDeleted': self.indexDeleted, 'archives': self.archives, 'complete': self.complete}
+
+    def __str__(self) -> str:
+        return json.dumps(self.asdict())
+
+def _jsonValue(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def archivePage(runId: str, pageNumber: int, entities: list) -> str:
+    blobName = f"{datetime.now(timezone.utc).strftime('%Y/%m/%d')}/{runId}-{pageNumber:05d}.jsonl.gz"
+    lines = "\n".join(json.dumps(dict(entity), default=_jsonValue, separators=(",", ":")) for entity in entities)
+    container = getContainerClient(getStorageConnectionString(), getArchiveContainerName())
+    container.get_blob_client(blobName).upload_blob(gzip.compress(lines.encode()), overwrite=True)
+    return blobName
+
+def _deletePartition(table: TableClient, entities: list) -> tuple[list, int]:
+    # Returns the deleted entities and how many were skipped because they changed after being read
+    deleted = []
+    conflicts = 0
+    for chunk in chunked(entities, MAX_BATCH_OPERATIONS):
+        operations = [("delete", entity, {"etag": entity.metadata['etag'], "match_condition": MatchConditions.IfNotModified}) for entity in chunk]
+        try:
+            table.submit_transaction(operations) # type: ignore
+            deleted.extend(chunk)
+        except TableTransactionError as e:
+            if e.status_code not in (404, 409, 412):
+                raise
+            # One changed row fails the whole transaction, settle the rest of the chunk one row at a time
+            for entity in chunk:
+                try:
+                    table.submit_transaction([("delete", entity, {"etag": entity.metadata['etag'], "match_condition": MatchConditions.IfNotModified})]) # type: ignore
+                    deleted.append(entity)
+                except TableTransactionError as rowError:
+                    if rowError.status_code not in (404, 409, 412):
+                        raise
+                    conflicts += 1
+    return deleted, conflicts
+
+def _deleteIndexEntries(index_table: TableClient, entities: Iterable) -> int:
+    partitions: dict[str, list] = {}
+    for entity in entities:
+        index_entity = toMedicineIndexEntity(entity)
+        partitions.setdefault(index_entity['PartitionKey'], []).append(index_entity)
+    removed = 0
+    for index_entities in partitions.values():
+        for chunk in chunked(index_entities, MAX_BATCH_OPERATIONS):
+            try:
+                index_table.submit_transaction([("delete", index_entity) for index_entity in chunk]) # type: ignore
+            except TableTransactionError as e:
+                if e.status_code != 404:
+                    raise
+                # Some entries were already gone, delete_entity ignores missing rows
+                for index_entity in chunk:
+                    index_table.delete_entity(partition_key=index_entity['PartitionKey'], row_key=index_entity['RowKey']) # type: ignore
+            removed += len(chunk)
+    return removed
+
+def compactInventory(dryRun: bool = False) -> CompactionReport:
+    report = CompactionReport(uuid.uuid4().hex[:12])
+    _, medicine_table = createTableIfNotExists(getMedicineTableName())
+    _, index_table = createTableIfNotExists(getMedicineIndexTableName())
+    deadline = time.monotonic() + getMaxRunSeconds()
+    pages = medicine_table.query_entities(deadInventoryFilter(), results_per_page=PAGE_SIZE).by_page() # type: ignore
+    for pageNumber, page in enumerate(pages):
+        entities = list(page)
+        report.scanned += len(entities)
+        if not entities or dryRun:
+            continue
+        report.archives.append(archivePage(report.runId, pageNumber, entities))
+        partitions: dict[str, list] = {}
+        for entity in entities:
+            partitions.setdefault(entity['PartitionKey'], []).append(entity)
+        for partitionEntities in partitions.values():
+            deleted, conflicts = _deletePartition(medicine_table, partitionEntities)
+            report.deleted += len(deleted)
+            report.conflicts += conflicts
+            report.indexDeleted += _deleteIndexEntries(index_table, deleted)
+        if time.monotonic() > deadline:
+            report.complete = False
+            break
+    return report
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Archive and delete out of stock and expired medicine batches")
+    parser.add_argument("--dry-run", action="store_true", help="only count the rows that would be compacted")
+    args = parser.parse_args()
+    logging.info(f"Inventory compaction {compactInventory(args.dry_run)}")
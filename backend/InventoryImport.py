@@ -0,0 +1,87 @@
+import codecs
+import csv
+import json
+from typing import Iterator
+from azure.core.exceptions import HttpResponseError
+from azure.data.tables import TableClient
+from Medicine import Medicine, MedicineRequestParser, commitInventoryChanges
+
+# Rows are validated and committed in windows so memory stays flat for large imports
+IMPORT_WINDOW_ROWS = 1000
+MAX_REPORTED_ERRORS = 1000
+
+def _iterLines(body: bytes) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    start = 0
+    while start < len(body):
+        end = body.find(b'\n', start)
+        if end == -1:
+            end = len(body)
+        yield decoder.decode(body[start:end + 1])
+        start = end + 1
+
+def parseInventoryRows(body: bytes, contentType: str) -> Iterator[tuple[int, object]]:
+    # Yields (row number, parsed row) where the row is a dict, or the error that made it unreadable
+    if 'csv' in contentType:
+        for rowNumber, row in enumerate(csv.DictReader(_iterLines(body)), start=2):
+            yield rowNumber, row
+        return
+    for rowNumber, line in enumerate(_iterLines(body), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield rowNumber, ValueError(f"Invalid JSON: {e.msg}")
+            continue
+        yield rowNumber, row if isinstance(row, dict) else ValueError("Row must be a JSON object")
+
+class InventoryImportReport:
+    def __init__(self) -> None:
+        self.imported = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+
+    def addError(self, rowNumber: int, error: Exception) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': rowNumber, 'error': str(error)})
+
+    def asdict(self) -> dict:
+        return {'imported': self.imported, 'failed': self.failed, 'errors': self.errors}
+
+def _commitWindow(table: TableClient, window: list[tuple[int, Medicine, int]], report: InventoryImportReport) -> None:
+    try:
+        failures = commitInventoryChanges(table, [(medicine, quantity) for _, medicine, quantity in window])
+    except HttpResponseError as e:
+        # Looking up the window's batches failed before anything of it was committed, earlier windows stay reported
+        for rowNumber, _, _ in window:
+            report.addError(rowNumber, e)
+        return
+    for rowNumber, medicine, _ in window:
+        error = failures.get(medicine.key())
+        if error is None:
+            report.imported += 1
+        else:
+            report.addError(rowNumber, error)
+
+def importInventory(table: TableClient, storeName: str, body: bytes, contentType: str) -> InventoryImportReport:
+    report = InventoryImportReport()
+    window: list[tuple[int, Medicine, int]] = []
+    for rowNumber, row in parseInventoryRows(body, contentType):
+        if isinstance(row, Exception):
+            report.addError(rowNumber, row)
+            continue
+        try:
+            medicine = MedicineRequestParser.parseJson(row, storeName) # type: ignore
+            quantity = MedicineRequestParser.parseQuantity(row) # type: ignore
+        except (ValueError, TypeError, AttributeError) as e:
+            report.addError(rowNumber, e if isinstance(e, ValueError) else ValueError("Invalid row"))
+            continue
+        window.append((rowNumber, medicine, quantity))
+        if len(window) == IMPORT_WINDOW_ROWS:
+            _commitWindow(table, window, report)
+            window = []
+    if window:
+        _commitWindow(table, window, report)
+    return report
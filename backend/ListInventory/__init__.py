@@ -0,0 +1,42 @@
+import json
+import logging
+from dataclasses import asdict
+import azure.functions as func
+from azure.core.exceptions import HttpResponseError
+import jwt
+from schemaUtils import createTableIfNotExists, getMedicineTableName
+from Medicine import DEFAULT_INVENTORY_PAGE_SIZE, MAX_INVENTORY_PAGE_SIZE, listStoreInventory
+from TokenUtils import TokenCredentials
+
+# Pages through the caller's inventory: GET ?pageSize=n&continuationToken=t, the response has the page's items and
+# the continuationToken of the next page, null on the last one
+def main(
+        req: func.HttpRequest
+    ) -> func.HttpResponse:
+    try:
+        token = TokenCredentials.decodeRequestToken(req)
+        storeName = token['store_name']
+        try:
+            pageSize = int(req.params.get('pageSize', DEFAULT_INVENTORY_PAGE_SIZE))
+        except ValueError:
+            raise ValueError("Invalid page size")
+        if not 1 <= pageSize <= MAX_INVENTORY_PAGE_SIZE:
+            raise ValueError(f"Page size must be between 1 and {MAX_INVENTORY_PAGE_SIZE}")
+        _,table_client = createTableIfNotExists(getMedicineTableName())
+        medicines, continuationToken = listStoreInventory(table_client, storeName, pageSize, req.params.get('continuationToken'))
+        body = {'items': [asdict(medicine) for medicine in medicines], 'continuationToken': continuationToken}
+        return func.HttpResponse(json.dumps(body), status_code=200, mimetype="application/json")
+    except ValueError as e:
+        logging.error(f"ValueError: {e}")
+        return func.HttpResponse(str(e), status_code=400)
+    except HttpResponseError as e:
+        logging.error(f"Could not read inventory {e}")
+        return func.HttpResponse(f"Server communication went wrong", status_code=500)
+    except jwt.ExpiredSignatureError as e:
+        return func.HttpResponse(f"Expired Token", status_code=401)
+    except jwt.InvalidTokenError as e:
+        logging.error(f"Bad Token {e}")
+        return func.HttpResponse(f"Invalid Token", status_code=401)
+    except Exception as e:
+        logging.error(f"Exception: {e}")
+        return func.HttpResponse(f"Something went wrong", status_code=500)
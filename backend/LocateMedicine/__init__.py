@@ -3,23 +3,39 @@ import logging
 import azure.functions as func
 from azure.core.exceptions import HttpResponseError
 
-from Algortihms import getStoresWithMedicationGreedy
-from Store import getStore
+from Algortihms import getStoresWithMedicationNearbyAsync
+from Store import getStoresAsync
+from StoreLocator import LocationParser
 from Image import ImageParser
 from DocumentReader import DocumentReader
 from DocumentAnalyzer import DocumentAnalyzer
+from Tracing import addServerTiming, span, startTrace
 
 
-def main(
+async def main(
+        req: func.HttpRequest
+    ) -> func.HttpResponse:
+    with startTrace("LocateMedicine") as trace:
+        response = await locateMedicine(req)
+    return addServerTiming(response, trace)
+
+async def locateMedicine(
         req: func.HttpRequest
     ) -> func.HttpResponse:
     try:
         image = ImageParser.parse(req)
-        readDocument = DocumentReader.getDocumentText(image) # Includes caching by file name as sent by api
-        medicationsNames = DocumentAnalyzer().getMedicationsNames(image.name,readDocument) # Includes caching by file name as sent by api
-        storesNames,notFoundMedications = getStoresWithMedicationGreedy(medicationsNames)
-        stores = [getStore(storeName) for storeName in storesNames]
-        stores = [store.asdict() for store in stores if store is not None]
+        location = LocationParser.parse(req)
+        # The OCR and text analytics polls are awaited, the worker keeps serving other prescriptions meanwhile
+        with span("readDocument"):
+            readDocument = await DocumentReader.getDocumentTextAsync(image) # Includes caching by the image content
+        with span("medicationNames"):
+            medicationsNames = await DocumentAnalyzer().getMedicationsNamesAsync(readDocument) # Includes caching by the recognized words
+        with span("findStores"):
+            storesNames,notFoundMedications,storeDistances = await getStoresWithMedicationNearbyAsync(medicationsNames,location)
+        with span("storeProfiles"):
+            storesByName = await getStoresAsync(storesNames)
+        stores = [storesByName.get(storeName) for storeName in sorted(storesNames, key=lambda name: storeDistances.get(name, 0))]
+        stores = [{**store.asdict(), "DistanceKm": storeDistances.get(store.StoreName)} for store in stores if store is not None]
         if None in stores or len(notFoundMedications) != 0:
             response_data = {
                 "stores": stores,
@@ -0,0 +1,158 @@
+from __future__ import annotations
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+from azure.core.exceptions import HttpResponseError
+from azure.data.tables import TableTransactionError, UpdateMode
+from AvailabilitySnapshot import getAvailabilityView
+from schemaUtils import MAX_BATCH_OPERATIONS, chunked, createTableIfNotExists, getMedicationLexiconTableName
+
+# Resolves prescription words in process before text analytics: the medications in stock (from the availability
+# snapshot) and medication names text analytics recognized before are known medications, matched exactly. Words text
+# analytics was sent several times (MedicationLexiconNegativeHits) and never recognized are taken as not being one for
+# MedicationLexiconNegativeTtlDays after they were last missed, a single miss can come from OCR noise or too little
+# context. Everything else, near misses of a known name included, is sent to text analytics, whose answers are learned
+# and shared with the other workers through a table.
+
+MEDICATIONS_PARTITION = 'medication'
+WORDS_PARTITION = 'word'
+
+def isLexiconEnabled() -> bool:
+    return os.getenv('MedicationLexiconEnabled', 'true').lower() == 'true'
+
+def getRefreshSeconds() -> float:
+    return float(os.getenv('MedicationLexiconRefreshSeconds', '300'))
+
+def getNegativeHits() -> int:
+    return int(os.getenv('MedicationLexiconNegativeHits', '3'))
+
+def getNegativeTtlSeconds() -> float:
+    return float(os.getenv('MedicationLexiconNegativeTtlDays', '7')) * 24 * 3600
+
+class MedicationLexicon:
+    def __init__(self) -> None:
+        self.medications: set[str] = set()
+        # Word -> (times text analytics didn't recognize it, unix time of the last miss)
+        self.misses: dict[str, tuple[int, float]] = {}
+        self.mergedSnapshot: Optional[object] = None
+        self.lock = threading.Lock()
+        self.nextRefreshAt = 0.0
+        self.refreshLock = threading.Lock()
+
+    def isRefreshDue(self) -> bool:
+        return isLexiconEnabled() and time.monotonic() >= self.nextRefreshAt
+
+    def refreshIfDue(self) -> None:
+        if not self.isRefreshDue() or not self.refreshLock.acquire(blocking=False):
+            return
+        try:
+            self.nextRefreshAt = time.monotonic() + getRefreshSeconds()
+            medications: set[str] = set()
+            misses: dict[str, tuple[int, float]] = {}
+            expired: list[str] = []
+            expiredBefore = time.time() - getNegativeTtlSeconds()
+            _, table = createTableIfNotExists(getMedicationLexiconTableName())
+            for entity in table.list_entities(select=['PartitionKey', 'RowKey', 'Misses', 'LastMissed']): # type: ignore
+                if entity['PartitionKey'] == MEDICATIONS_PARTITION:
+                    medications.add(entity['RowKey'])
+                elif entity.get('Misses') is None or entity.get('LastMissed') is None or entity['LastMissed'].timestamp() < expiredBefore:
+                    expired.append(entity['RowKey'])
+                else:
+                    misses[entity['RowKey']] = (int(entity['Misses']), entity['LastMissed'].timestamp())
+            with self.lock:
+                self.medications.update(medications)
+                self.misses = self._merged(self.misses, misses)
+            self._prune(table, expired)
+        except HttpResponseError as e:
+            logging.warning(f"Could not refresh the medication lexicon {e}")
+        finally:
+            self.refreshLock.release()
+
+    @staticmethod
+    def _prune(table, words: list[str]) -> None:
+        # Expired misses are deleted so the table stays the size of the recent vocabulary, a word missed again
+        # meanwhile just starts counting over
+        for chunk in chunked(words, MAX_BATCH_OPERATIONS):
+            try:
+                table.submit_transaction([("delete", {'PartitionKey': WORDS_PARTITION, 'RowKey': word}) for word in chunk]) # type: ignore
+            except TableTransactionError as e:
+                logging.info(f"Could not prune expired lexicon words {e}")
+
+    @staticmethod
+    def _merged(local: dict[str, tuple[int, float]], shared: dict[str, tuple[int, float]]) -> dict[str, tuple[int, float]]:
+        # Expired misses are dropped, for the others the higher count and the later miss win
+        expiredBefore = time.time() - getNegativeTtlSeconds()
+        merged: dict[str, tuple[int, float]] = {}
+        for word in local.keys() | shared.keys():
+            localMisses, localAt = local.get(word, (0, 0.0))
+            sharedMisses, sharedAt = shared.get(word, (0, 0.0))
+            if max(localAt, sharedAt) >= expiredBefore:
+                merged[word] = (max(localMisses, sharedMisses), max(localAt, sharedAt))
+        return merged
+
+    def _mergeSnapshot(self) -> None:
+        # The medications in stock come with every snapshot the availability view loads, no storage call needed
+        availability = getAvailabilityView()
+        snapshot = availability.state[0]
+        if snapshot is None or snapshot is self.mergedSnapshot:
+            return
+        self.mergedSnapshot = snapshot
+        medications = availability.medicationNames()
+        with self.lock:
+            self.medications.update(medications)
+
+    def _isKnownNonMedication(self, word: str, now: float) -> bool:
+        misses, lastMissed = self.misses.get(word, (0, 0.0))
+        return misses >= getNegativeHits() and now - lastMissed < getNegativeTtlSeconds()
+
+    def resolve(self, words: Iterable[str]) -> tuple[set[str], set[str]]:
+        # The medications the words resolve to, and the words left for text analytics
+        medications: set[str] = set()
+        unresolved: set[str] = set()
+        if not isLexiconEnabled():
+            return medications, set(words)
+        self._mergeSnapshot()
+        now = time.time()
+        with self.lock:
+            for word in words:
+                if word in self.medications:
+                    medications.add(word)
+                elif not self._isKnownNonMedication(word, now):
+                    unresolved.add(word)
+        return medications, unresolved
+
+    def learn(self, words: Iterable[str], medicationEntities: list[str]) -> None:
+        # What text analytics said about the words it was sent
+        entityWords = {part for text in medicationEntities for part in text.lower().split()}
+        medications = {text.lower().split(" ")[0] for text in medicationEntities}
+        medications = {medication for medication in medications if re.match('^[a-z]+$', medication)}
+        now = time.time()
+        with self.lock:
+            newMedications = medications - self.medications
+            self.medications.update(newMedications)
+            missed = {}
+            for word in set(words) - entityWords:
+                missed[word] = (self.misses.get(word, (0, 0.0))[0] + 1, now)
+            self.misses.update(missed)
+        if not newMedications and not missed:
+            return
+        try:
+            _, table = createTableIfNotExists(getMedicationLexiconTableName())
+            for chunk in chunked(sorted(newMedications), MAX_BATCH_OPERATIONS):
+                table.submit_transaction([("upsert", {'PartitionKey': MEDICATIONS_PARTITION, 'RowKey': medication}, {"mode": UpdateMode.MERGE}) for medication in chunk]) # type: ignore
+            # Concurrent workers may lose each other's increments, that only delays trusting a word
+            lastMissed = datetime.fromtimestamp(now, timezone.utc)
+            for chunk in chunked(sorted(missed.items()), MAX_BATCH_OPERATIONS):
+                table.submit_transaction([("upsert", {'PartitionKey': WORDS_PARTITION, 'RowKey': word, 'Misses': misses, 'LastMissed': lastMissed}, {"mode": UpdateMode.MERGE})
+                                          for word, (misses, _) in chunk]) # type: ignore
+        except HttpResponseError as e:
+            logging.warning(f"Could not save learned lexicon terms {e}")
+
+_lexicon = MedicationLexicon()
+
+def getMedicationLexicon() -> MedicationLexicon:
+    return _lexicon
@@ -1,8 +1,32 @@
-from typing import Optional
+from __future__ import annotations
+import asyncio
+import base64
+import binascii
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, Optional
 import azure.functions as func
-from dataclasses import dataclass
-from schemaUtils import BaseEntity, writeEntityToTable
-from azure.data.tables import TableClient,TableEntity,UpdateMode
+from dataclasses import dataclass, replace
+from CacheUtils import VersionCounters
+from Store import Store
+from schemaUtils import MAX_BATCH_OPERATIONS, MAX_FILTER_COMPARISONS, BaseEntity, buildOrFilter, chunked, createTableIfNotExists, escapeFilterValue, getAvailabilityChangesTableName, getMedicineIndexTableName, getStorageSemaphore, toTableEntity, writeEntityToTable
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import TableClient,TableEntity,TableTransactionError,UpdateMode
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from azure.data.tables.aio import TableClient as AsyncTableClient
+
+MAX_UPDATE_ATTEMPTS = 5
+RETRY_BASE_DELAY_SECONDS = 0.05
+MAX_PARALLEL_TRANSACTIONS = 8
 
 @dataclass
 class Medicine(BaseEntity):
@@ -15,18 +39,106 @@ class Medicine(BaseEntity):
     StoreName: str
     Quantity: int = 1
     def uid(self):
-        return f"{self.StoreName}_{self.MedicineName}_{self.BatchNumber}".lower()
+        # All batches of a store share the store's partition so its inventory is one scan and one transaction
+        return Store.uidFromName(self.StoreName)
+    def rowKey(self) -> str:
+        return medicineKey(self.StoreName, self.MedicineName, self.BatchNumber)[1]
+    def key(self) -> tuple[str, str]:
+        return medicineKey(self.StoreName, self.MedicineName, self.BatchNumber)
+    def legacyUid(self) -> str:
+        return legacyMedicineUid(self.StoreName, self.MedicineName, self.BatchNumber)
+    def asdict(self) -> Dict[str, Any]:
+        # ExpiryDate is kept as YYYY-MM-DD on the dataclass and stored as a DateTime so it can be compared in filters
+        return {**super().asdict(), 'ExpiryDate': toExpiryDatetime(self.ExpiryDate)}
+    @staticmethod
+    def indexKeyFromEntity(entity: TableEntity) -> str:
+        return f"{entity['StoreName']}_{entity['BatchNumber']}".lower()
     
+# Availability is filtered by the query, the set cover only needs which store has which medicine
+AVAILABILITY_PROPERTIES = ['MedicineName', 'StoreName']
+EXPIRY_DATE_FORMAT = "%Y-%m-%d"
+
+def toExpiryDatetime(value) -> datetime:
+    # Midnight UTC of the expiry day, rows written before typed properties hold the date as a string
+    if isinstance(value, datetime):
+        return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    try:
+        return datetime.strptime(str(value)[:10], EXPIRY_DATE_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise ValueError("Invalid expiry date, expected YYYY-MM-DD")
+
+def formatExpiryDate(value) -> str:
+    return toExpiryDatetime(value).strftime(EXPIRY_DATE_FORMAT)
+
+def availabilityCutoff() -> datetime:
+    # Batches expiring before midnight UTC today are no longer available
+    return datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def availabilityFilter() -> str:
+    # Index rows that are in stock and not expired, evaluated by the service instead of per row after download
+    return f"InStock eq true and ExpiryDate ge datetime'{availabilityCutoff().strftime('%Y-%m-%dT%H:%M:%SZ')}'"
+# The two comparisons of availabilityFilter count against the filter limit
+AVAILABILITY_FILTER_COMPARISONS = 2
+# Every availability change is appended to one partition, ordered by the time it was written
+AVAILABILITY_CHANGES_PARTITION = 'changes'
+# Bumped whenever a medication's availability changes, results derived from it are stale once its version moves
+inventoryVersions: VersionCounters[str] = VersionCounters()
+
+def availabilityChangeRowKey(timestampSeconds: float) -> str:
+    return f"{int(timestampSeconds * 1000):013d}"
+
+def medicineKey(storeName: str, medicineName: str, batchNumber: str) -> tuple[str, str]:
+    # PartitionKey and RowKey of a batch in the Medicine table
+    return Store.uidFromName(storeName), f"{medicineName}_{batchNumber}".lower()
+
+def legacyMedicineUid(storeName: str, medicineName: str, batchNumber: str) -> str:
+    # Before inventory was partitioned by store every batch was a partition of its own, keyed by this in both keys
+    return f"{storeName}_{medicineName}_{batchNumber}".lower()
+
+def isLegacyMedicineEntity(entity) -> bool:
+    return entity['PartitionKey'] == entity['RowKey'] == legacyMedicineUid(entity.get('StoreName'), entity.get('MedicineName'), entity.get('BatchNumber'))
+
+def isLegacyKeyFallbackEnabled() -> bool:
+    # Batches missing from their store partition are looked up under their old key and moved, every miss costs an
+    # extra query. Off by default, only turned on while migrateMedicinePartitions.py moves an older deployment's rows
+    return os.getenv('MedicineLegacyKeysEnabled', 'false').lower() == 'true'
+
 class MedicineRequestParser:
     @staticmethod
     def parse(req: func.HttpRequest,storeName: str) -> Medicine:
-        json = req.get_json()
+        return MedicineRequestParser.parseJson(req.get_json(),storeName)
+    @staticmethod
+    def parseItems(req: func.HttpRequest,storeName: str) -> Optional[list[tuple[Medicine,int]]]:
+        # A cart of {..medicine fields.., "quantity": n} items, None when the body is a single medicine
+        items = req.get_json().get('items')
+        if items is None:
+            return None
+        if not isinstance(items, list) or not items:
+            raise ValueError("items must be a non empty list")
+        return [(MedicineRequestParser.parseJson(item,storeName), MedicineRequestParser.parseQuantity(item)) for item in items]
+    @staticmethod
+    def parseQuantity(json: dict) -> int:
+        try:
+            quantity = int(json.get('quantity', 1))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid quantity")
+        if quantity <= 0:
+            raise ValueError("Quantity must be positive")
+        return quantity
+    @staticmethod
+    def parseJson(json: dict,storeName: str) -> Medicine:
         medicine_name : str = json.get('medicineName')
+        if not medicine_name:
+            raise ValueError("Missing medicine name")
         manufacturer : str= json.get('manufacturer')
-        expiry_date : str= json.get('expiryDate')
+        expiry_date = json.get('expiryDate')
+        if expiry_date is not None:
+            expiry_date = formatExpiryDate(expiry_date)
         batch_number : str = json.get('batchNumber')
         price = json.get('price')
-        price = float(price) if price else 0
+        price = float(price) if price else 0.0
         storeName = storeName
         return Medicine(
             MedicineNamePretty=medicine_name,
@@ -44,58 +156,335 @@ class MedicineEntityParser:
             MedicineNamePretty=entity.get('MedicineNamePretty'), # type: ignore
             MedicineName=entity.get('MedicineName'), # type: ignore
             Manufacturer=entity.get('Manufacturer'),# type: ignore
-            ExpiryDate=entity.get('ExpiryDate'),# type: ignore
+            ExpiryDate=formatExpiryDate(entity.get('ExpiryDate')),
             BatchNumber=entity.get('BatchNumber'),# type: ignore
             Price=float(entity.get('Price')),# type: ignore
             StoreName=entity.get('StoreName'),# type: ignore
-            Quantity=entity.get('Quantity')# type: ignore
+            Quantity=int(entity.get('Quantity'))# type: ignore
         )
 
 def insertMedicineToInventory(medicine : Medicine, table : TableClient, storeName : str) -> None:
     medicine_entity = findMedicineEntities(medicine,table,storeName)
-    if medicine_entity:
-        incrementMedicineQuantity(table,medicine_entity)
-    else:
-        writeEntityToTable(medicine, table)
+    if not medicine_entity:
+        try:
+            writeEntityToTable(medicine, table, rowKey=medicine.rowKey())
+            updateMedicineIndex(medicine.asdict())
+            return
+        except ResourceExistsError:
+            # Another request created this batch first, add to it instead
+            medicine_entity = findMedicineEntities(medicine,table,storeName)
+            if not medicine_entity:
+                raise
+    medicine_entity = incrementMedicineQuantity(table,medicine_entity)
+    if medicine_entity['Quantity'] == 1:
+        updateMedicineIndex(medicine_entity)
         
 def removeMedicineFromInventory(medicine : Medicine, table : TableClient, storeName : str) -> None:
     medicine_entity = findMedicineEntities(medicine,table,storeName)
     if medicine_entity:
-        decrementMedicineQuantity(table,medicine_entity)
+        medicine_entity = decrementMedicineQuantity(table,medicine_entity)
+        if medicine_entity['Quantity'] == 0:
+            updateMedicineIndex(medicine_entity)
     else:
         raise ValueError("Cannot checkout non existant medication")
 
-def _offsetMedicineQuantity(table : TableClient, medicine : TableEntity,offset : int) -> None:
-    quantity = medicine['Quantity']
-    if quantity is None:
-        raise ValueError("Quantity not found in matching entity")
-    new_quantity = int(quantity) + offset
-    if new_quantity < 0:
-        raise ValueError("There are no more avalible medicine of this type in the system")
-    medicine['Quantity'] = new_quantity
-    table.update_entity(entity=medicine, mode=UpdateMode.MERGE) # type: ignore 
+def _retryDelay(attempt: int) -> float:
+    # Full jitter so competing writers don't retry in lockstep
+    return random.uniform(0, RETRY_BASE_DELAY_SECONDS * 2 ** attempt)
+
+def _offsetMedicineQuantity(table : TableClient, medicine : TableEntity,offset : int) -> TableEntity:
+    # Returns the entity as committed, after a conflict that is the re-read row and not the caller's copy
+    for attempt in range(MAX_UPDATE_ATTEMPTS):
+        quantity = medicine['Quantity']
+        if quantity is None:
+            raise ValueError("Quantity not found in matching entity")
+        new_quantity = int(quantity) + offset
+        if new_quantity < 0:
+            raise ValueError("There are no more avalible medicine of this type in the system")
+        medicine['Quantity'] = new_quantity
+        try:
+            table.update_entity(entity=medicine, mode=UpdateMode.MERGE, etag=medicine.metadata['etag'], match_condition=MatchConditions.IfNotModified) # type: ignore 
+            return medicine
+        except ResourceModifiedError:
+            if attempt == MAX_UPDATE_ATTEMPTS - 1:
+                raise
+            time.sleep(_retryDelay(attempt))
+            medicine = table.get_entity(partition_key=medicine['PartitionKey'], row_key=medicine['RowKey']) # type: ignore
+    raise ValueError("Could not update medicine quantity")
     
-def decrementMedicineQuantity(table : TableClient, medicine : TableEntity) -> None:
-    _offsetMedicineQuantity(table,medicine,-1)
+def decrementMedicineQuantity(table : TableClient, medicine : TableEntity) -> TableEntity:
+    return _offsetMedicineQuantity(table,medicine,-1)
     
-def incrementMedicineQuantity(table : TableClient, medicine :TableEntity) -> None:
-    _offsetMedicineQuantity(table,medicine,1)
+def incrementMedicineQuantity(table : TableClient, medicine :TableEntity) -> TableEntity:
+    return _offsetMedicineQuantity(table,medicine,1)
+
+def applyInventoryChanges(table : TableClient, changes : list[tuple[Medicine,int]]) -> None:
+    # Applies a whole cart of signed quantity deltas, every partition is committed as one conditional transaction
+    failures = commitInventoryChanges(table, changes)
+    for error in failures.values():
+        raise error
+
+def commitInventoryChanges(table : TableClient, changes : list[tuple[Medicine,int]]) -> dict[tuple[str, str], Exception]:
+    # Like applyInventoryChanges but reports the error of every failed partition by medicine key instead of raising
+    deltas: dict[tuple[str, str], tuple[Medicine,int]] = {}
+    for medicine, delta in changes:
+        previous = deltas.get(medicine.key())
+        deltas[medicine.key()] = (medicine, delta + (previous[1] if previous else 0))
+    entities = _findMedicineEntitiesByKeys(table, {key: medicine.legacyUid() for key, (medicine, _) in deltas.items()})
+    operations = _buildInventoryOperations(deltas, entities)
+
+    failures: dict[tuple[str, str], Exception] = {}
+    partitions = list(operations.keys())
+    if not partitions:
+        return failures
+    committed: dict[str, list[tuple[tuple[str, str], tuple]]] = {partition: [] for partition in partitions}
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_TRANSACTIONS, len(partitions))) as executor:
+        # Each partition runs in the request's context so its storage calls are traced with the request
+        futures = {partition: executor.submit(contextvars.copy_context().run, _commitPartition, table, deltas, partition, operations[partition], committed[partition])
+                   for partition in partitions}
+        for partition, future in futures.items():
+            error = future.exception()
+            if error is not None:
+                # Chunks committed before the failure stay applied and are not reported
+                done = {key for key, _ in committed[partition]}
+                failures.update({key: error for key, _ in operations[partition] if key not in done})
+    return failures
+
+def _findMedicineEntitiesByKeys(table : TableClient, keys : dict[tuple[str, str], str]) -> dict[tuple[str, str], TableEntity]:
+    # keys maps the (PartitionKey, RowKey) of every batch to its legacy uid, one query per store and chunk of batches
+    entities: dict[tuple[str, str], TableEntity] = {}
+    partitions: dict[str, list[str]] = {}
+    for partition, rowKey in keys:
+        partitions.setdefault(partition, []).append(rowKey)
+    for partition, rowKeys in partitions.items():
+        for chunk in chunked(rowKeys, MAX_FILTER_COMPARISONS - 1):
+            query = f"PartitionKey eq '{escapeFilterValue(partition)}' and ({buildOrFilter('RowKey', chunk)})"
+            for entity in table.query_entities(query): # type: ignore
+                entities[(entity['PartitionKey'], entity['RowKey'])] = entity
+    missing = {key: legacyUid for key, legacyUid in keys.items() if key not in entities}
+    if missing and isLegacyKeyFallbackEnabled():
+        entities.update(_adoptLegacyEntities(table, missing))
+    return entities
+
+def _adoptLegacyEntities(table : TableClient, legacyUids : dict[tuple[str, str], str]) -> dict[tuple[str, str], TableEntity]:
+    entities: dict[tuple[str, str], TableEntity] = {}
+    for chunk in chunked(legacyUids.values(), MAX_FILTER_COMPARISONS):
+        for legacy in table.query_entities(buildOrFilter('PartitionKey', chunk)): # type: ignore
+            if isLegacyMedicineEntity(legacy):
+                entity = moveLegacyEntity(table, legacy)
+                entities[(entity['PartitionKey'], entity['RowKey'])] = entity
+    return entities
+
+def toStoreMedicineEntity(entity) -> dict:
+    # A legacy row with the keys of its store partition
+    partition, rowKey = medicineKey(entity['StoreName'], entity['MedicineName'], entity['BatchNumber'])
+    return {**entity, 'PartitionKey': partition, 'RowKey': rowKey}
+
+def moveLegacyEntity(table : TableClient, legacy : TableEntity) -> TableEntity:
+    # Copies a legacy row into its store partition and deletes it. Whoever copies it first wins, a later copy
+    # finds the row already there and keeps it since it may have been updated since.
+    moved = toStoreMedicineEntity(legacy)
+    try:
+        table.create_entity(entity=moved) # type: ignore
+    except ResourceExistsError:
+        pass
+    try:
+        table.delete_entity(partition_key=legacy['PartitionKey'], row_key=legacy['RowKey'], etag=legacy.metadata['etag'], match_condition=MatchConditions.IfNotModified) # type: ignore
+    except ResourceModifiedError:
+        logging.warning(f"Legacy medicine row {legacy['PartitionKey']} changed while it was moved, it is kept")
+    return table.get_entity(partition_key=moved['PartitionKey'], row_key=moved['RowKey']) # type: ignore
+
+def _buildInventoryOperations(deltas: dict[tuple[str, str], tuple[Medicine,int]], entities: dict[tuple[str, str], TableEntity]) -> dict[str, list[tuple[tuple[str, str], tuple]]]:
+    # Everything is validated before anything is written so an invalid item doesn't leave half a cart applied
+    operations: dict[str, list[tuple[tuple[str, str], tuple]]] = {}
+    for key, (medicine, delta) in deltas.items():
+        entity = entities.get(key)
+        if entity is None:
+            if delta < 0:
+                raise ValueError("Cannot checkout non existant medication")
+            new_entity = toTableEntity(replace(medicine, Quantity=delta), rowKey=medicine.rowKey())
+            operations.setdefault(new_entity['PartitionKey'], []).append((key, ("create", new_entity)))
+            continue
+        new_quantity = int(entity['Quantity']) + delta
+        if new_quantity < 0:
+            raise ValueError("There are no more avalible medicine of this type in the system")
+        if delta == 0:
+            continue
+        entity['Quantity'] = new_quantity
+        operations.setdefault(entity['PartitionKey'], []).append(
+            (key, ("update", entity, {"mode": UpdateMode.MERGE, "etag": entity.metadata['etag'], "match_condition": MatchConditions.IfNotModified})))
+    return operations
+
+def _commitPartition(table : TableClient, deltas: dict[tuple[str, str], tuple[Medicine,int]], partition : str, operations : list[tuple[tuple[str, str], tuple]],
+                     committed : list[tuple[tuple[str, str], tuple]]) -> None:
+    # committed collects every operation whose chunk went through, also when a later chunk fails
+    pending = operations
+    try:
+        for attempt in range(MAX_UPDATE_ATTEMPTS):
+            try:
+                for chunk in chunked(pending, MAX_BATCH_OPERATIONS):
+                    table.submit_transaction([operation for _, operation in chunk]) # type: ignore
+                    committed.extend(chunk)
+                break
+            except TableTransactionError as e:
+                if e.status_code not in (409, 412) or attempt == MAX_UPDATE_ATTEMPTS - 1:
+                    raise
+                time.sleep(_retryDelay(attempt))
+                # Somebody else changed the partition, recompute what is left from fresh rows
+                done = {key for key, _ in committed}
+                remaining = {key: deltas[key] for key, _ in pending if key not in done}
+                entities = _findMedicineEntitiesByKeys(table, {key: medicine.legacyUid() for key, (medicine, _) in remaining.items()})
+                pending = _buildInventoryOperations(remaining, entities).get(partition, [])
+    finally:
+        # Only batches that were created, ran out or came back in stock change the index
+        flipped = [entity for key, (action, entity, *_) in committed
+                   if action == "create" or int(entity['Quantity']) == 0 or int(entity['Quantity']) == deltas[key][1]]
+        if flipped:
+            updateMedicineIndexEntries(flipped)
 
 def findMedicineEntities(medicine: Medicine, table : TableClient, storeName : str) -> Optional[TableEntity]:
-    entities = table.query_entities(f"PartitionKey eq '{medicine.uid()}'") # type: ignore
-    entity_list = list(entities)
-    if not entity_list:
-        return None
-    if len(entity_list) > 1:
-        raise ValueError("Duplicate entry for unique key found")
-    return entity_list[0] # type: ignore
+    try:
+        return table.get_entity(partition_key=medicine.uid(), row_key=medicine.rowKey()) # type: ignore
+    except ResourceNotFoundError:
+        if not isLegacyKeyFallbackEnabled():
+            return None
+    return _adoptLegacyEntities(table, {medicine.key(): medicine.legacyUid()}).get(medicine.key())
 
+def toMedicineIndexEntity(entity) -> dict:
+    # The index only changes when a batch is created or its stock runs out / is replenished,
+    # plain quantity changes never touch it
+    return {
+        'PartitionKey': entity['MedicineName'],
+        'RowKey': Medicine.indexKeyFromEntity(entity),
+        'MedicineName': entity['MedicineName'],
+        'StoreName': entity['StoreName'],
+        'BatchNumber': entity['BatchNumber'],
+        'ExpiryDate': toExpiryDatetime(entity['ExpiryDate']),
+        'InStock': int(entity['Quantity']) > 0
+    }
 
-def findMedicineEntitiesByName(table: TableClient, medicineName: str) -> list[TableEntity]:
-    entities = table.query_entities(f"MedicineName eq '{medicineName}'") # type: ignore
+def updateMedicineIndex(entity) -> None:
+    updateMedicineIndexEntries([entity])
+
+def updateMedicineIndexEntries(entities: Iterable) -> None:
+    _, index_table = createTableIfNotExists(getMedicineIndexTableName())
+    partitions: dict[str, dict[str, dict]] = {}
+    for entity in entities:
+        index_entity = toMedicineIndexEntity(entity)
+        # A transaction can't touch a row twice, the last write of a batch wins
+        partitions.setdefault(index_entity['PartitionKey'], {})[index_entity['RowKey']] = index_entity
+    for index_entities in partitions.values():
+        for chunk in chunked(index_entities.values(), MAX_BATCH_OPERATIONS):
+            index_table.submit_transaction([("upsert", index_entity, {"mode": UpdateMode.REPLACE}) for index_entity in chunk]) # type: ignore
+    inventoryVersions.bump(set(partitions))
+    try:
+        recordAvailabilityChanges(index_table, [index_entity for index_entities in partitions.values() for index_entity in index_entities.values()])
+    except HttpResponseError as e:
+        # The inventory change is committed, the availability snapshot catches up on its next rebuild
+        logging.warning(f"Could not record availability changes {e}")
+
+def _availabilityChange(medicineName: str, storeName: str, latestExpiry: Optional[datetime], extends: bool = False) -> dict:
+    change = {
+        'PartitionKey': AVAILABILITY_CHANGES_PARTITION,
+        'RowKey': f"{availabilityChangeRowKey(time.time())}_{uuid.uuid4().hex[:12]}",
+        'MedicineName': medicineName,
+        'StoreName': storeName,
+        'Available': latestExpiry is not None
+    }
+    if latestExpiry is not None:
+        change['LatestExpiry'] = latestExpiry
+    if extends:
+        change['Extends'] = True
+    return change
+
+def recordAvailabilityChanges(index_table: TableClient, index_entities: Iterable[dict]) -> None:
+    # Appends the resulting availability of every (medicine, store) pair of the written index rows, the availability
+    # snapshot is patched from this log. A pair that only gained available batches is available at least until the
+    # latest of them expires (an Extends change, merged with what the snapshot knows), only pairs where a batch ran
+    # out or expired are queried for the batches that still cover them.
+    cutoff = availabilityCutoff()
+    gained: dict[tuple[str, str], datetime] = {}
+    lost: set[tuple[str, str]] = set()
+    for index_entity in index_entities:
+        pair = (index_entity['MedicineName'], index_entity['StoreName'])
+        expiry = toExpiryDatetime(index_entity['ExpiryDate'])
+        if index_entity['InStock'] and expiry >= cutoff:
+            gained[pair] = max(gained.get(pair, expiry), expiry)
+        else:
+            lost.add(pair)
+    changes = [_availabilityChange(medicineName, storeName, expiry, extends=True)
+               for (medicineName, storeName), expiry in sorted(gained.items()) if (medicineName, storeName) not in lost]
+    for medicineName, storeName in sorted(lost):
+        entries = index_table.query_entities(
+            f"PartitionKey eq '{escapeFilterValue(medicineName)}' and StoreName eq '{escapeFilterValue(storeName)}' and {availabilityFilter()}",
+            select=['ExpiryDate']) # type: ignore
+        changes.append(_availabilityChange(medicineName, storeName, max((toExpiryDatetime(entry['ExpiryDate']) for entry in entries), default=None)))
+    if not changes:
+        return
+    _, changes_table = createTableIfNotExists(getAvailabilityChangesTableName())
+    for chunk in chunked(changes, MAX_BATCH_OPERATIONS):
+        changes_table.submit_transaction([("create", change) for change in chunk]) # type: ignore
+
+def findMedicineIndexEntitiesByName(index_table: TableClient, medicineName: str) -> list[TableEntity]:
+    entities = index_table.query_entities(buildOrFilter('PartitionKey', [medicineName])) # type: ignore
     return list(entities)
 
+def findMedicineIndexEntitiesByNames(index_table: TableClient, medicineNames: Iterable[str]) -> list[TableEntity]:
+    # One OR-filtered query over the index partitions per chunk instead of one query per medicine,
+    # only available batches are returned
+    entity_list : list[TableEntity] = []
+    for names in chunked(sorted(set(medicineNames)), MAX_FILTER_COMPARISONS - AVAILABILITY_FILTER_COMPARISONS):
+        entities = index_table.query_entities(f"({buildOrFilter('PartitionKey', names)}) and {availabilityFilter()}", select=AVAILABILITY_PROPERTIES) # type: ignore
+        entity_list.extend(entities)
+    return entity_list
+
+async def findMedicineIndexEntitiesByNamesAsync(index_table: AsyncTableClient, medicineNames: Iterable[str]) -> list[TableEntity]:
+    # Every medicine is a single partition query, they all run concurrently within the worker's storage limit
+    async def findByName(medicineName: str) -> list[TableEntity]:
+        async with getStorageSemaphore():
+            entities = index_table.query_entities(f"{buildOrFilter('PartitionKey', [medicineName])} and {availabilityFilter()}", select=AVAILABILITY_PROPERTIES)
+            return [entity async for entity in entities]
+    results = await asyncio.gather(*(findByName(name) for name in sorted(set(medicineNames))))
+    return [entity for entities in results for entity in entities]
+
+def findMedicineEntitiesByName(table: TableClient, medicineName: str) -> list[TableEntity]:
+    _, index_table = createTableIfNotExists(getMedicineIndexTableName())
+    keys = {medicineKey(entry['StoreName'], medicineName, entry['BatchNumber']): legacyMedicineUid(entry['StoreName'], medicineName, entry['BatchNumber'])
+            for entry in findMedicineIndexEntitiesByName(index_table, medicineName)}
+    return list(_findMedicineEntitiesByKeys(table, keys).values())
+
 def findMedicine(table: TableClient, medicineName: str) -> list[Medicine]:
     entities = findMedicineEntitiesByName(table, medicineName)
     medicine = [MedicineEntityParser.parse(entity) for entity in entities]
-    return medicine
\ No newline at end of file
+    return medicine
+
+DEFAULT_INVENTORY_PAGE_SIZE = 100
+MAX_INVENTORY_PAGE_SIZE = 1000
+
+def encodeContinuationToken(token) -> Optional[str]:
+    # The storage continuation token (where the next page starts) is handed to clients as an opaque string
+    if token is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(token).encode()).decode()
+
+def decodeContinuationToken(value: Optional[str]):
+    if not value:
+        return None
+    try:
+        token = json.loads(base64.urlsafe_b64decode(value.encode()))
+    except (binascii.Error, ValueError):
+        raise ValueError("Invalid continuation token")
+    if not isinstance(token, (dict, str)):
+        raise ValueError("Invalid continuation token")
+    return token
+
+def listStoreInventory(table: TableClient, storeName: str, pageSize: int, continuationToken: Optional[str]) -> tuple[list[Medicine], Optional[str]]:
+    # One page of a store's batches in RowKey order read from its partition, and the token of the next page if any
+    query = f"PartitionKey eq '{escapeFilterValue(Store.uidFromName(storeName))}'"
+    pages = table.query_entities(query, results_per_page=pageSize).by_page(continuation_token=decodeContinuationToken(continuationToken)) # type: ignore
+    try:
+        page = next(pages)
+    except StopIteration:
+        return [], None
+    medicines = [MedicineEntityParser.parse(entity) for entity in page]
+    return medicines, encodeContinuationToken(pages.continuation_token)
\ No newline at end of file
@@ -0,0 +1,284 @@
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+import zlib
+from io import BytesIO
+from typing import Any, Optional
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+from azure.data.tables import TableTransactionError
+from Image import getPillow
+from schemaUtils import MAX_BATCH_OPERATIONS, chunked, createTableIfNotExists, getContainerClient, getStorageConnectionString
+from Tracing import increment
+
+# Finds earlier uploads of the same prescription photo sent again with different bytes (re-encoded, resized or with
+# its metadata stripped by the uploading app), so their OCR result is reused instead of calling the service. Off by
+# default (NearDuplicateDetectionEnabled). Every OCR'd image is recorded with its difference hash (dHash: a 17x16
+# contrast stretched grayscale thumbnail, one bit per pair of adjacent pixels, 256 bits) and the OCR cache blob it
+# produced. A new image within ImageHashMaxDistance bits of a recorded one is only a candidate: a prescription on the
+# same printed form as another differs in few bits, so the match is confirmed region by region on a 256x256 thumbnail
+# stored with it, every 16x16 region has to agree within ImageRegionMaxDifference grey levels. Text that differs
+# anywhere, another patient or dose, fails the region check; so does a retake of the same paper from another angle,
+# which is sent to OCR. The hashes of all workers are shared through a table, appended to in time order like the
+# availability change log, loaded in the background and pruned after ImageHashRetentionDays.
+
+HASH_SIZE = 16
+REGION_THUMBNAIL_SIZE = 256
+REGION_SIZE = 16
+HASH_PARTITION = 'dhash'
+
+def isNearDuplicateDetectionEnabled() -> bool:
+    return os.getenv('NearDuplicateDetectionEnabled', 'false').lower() == 'true'
+
+def getImageHashTableName() -> str:
+    return os.getenv('ImageHashTableName', 'ImageHashes')
+
+def getImageRegionsContainerName() -> str:
+    return os.getenv('ImageRegionsContainer', 'image-regions')
+
+def getMaxDistance() -> int:
+    # Only a pre-filter, the region check decides, re-encodes of one photo land within a few bits
+    return int(os.getenv('ImageHashMaxDistance', '6'))
+
+def getMaxRegionDifference() -> float:
+    return float(os.getenv('ImageRegionMaxDifference', '6'))
+
+def getRefreshSeconds() -> float:
+    return float(os.getenv('ImageHashRefreshSeconds', '60'))
+
+def getPruneSeconds() -> float:
+    return float(os.getenv('ImageHashPruneSeconds', '3600'))
+
+def getRetentionSeconds() -> float:
+    return float(os.getenv('ImageHashRetentionDays', '7')) * 24 * 3600
+
+def getMaxEntries() -> int:
+    return int(os.getenv('ImageHashMaxEntries', '100000'))
+
+def hashRowKey(timestampSeconds: float) -> str:
+    return f"{int(timestampSeconds * 1000):013d}"
+
+class ImageFingerprint:
+    def __init__(self, hash: int, regions: bytes) -> None:
+        self.hash = hash
+        # REGION_THUMBNAIL_SIZE x REGION_THUMBNAIL_SIZE grayscale pixels
+        self.regions = regions
+
+def fingerprintImage(data: bytes) -> Optional[ImageFingerprint]:
+    # None when Pillow is missing or can't read the image
+    pillow = getPillow()
+    if pillow is None:
+        return None
+    PILImage, ImageOps = pillow
+    try:
+        with PILImage.open(BytesIO(data)) as image:
+            image.draft('L', (REGION_THUMBNAIL_SIZE * 2, REGION_THUMBNAIL_SIZE * 2))
+            grayscale = ImageOps.autocontrast(ImageOps.exif_transpose(image).convert('L'), cutoff=1)
+            pixels = grayscale.resize((HASH_SIZE + 1, HASH_SIZE), PILImage.LANCZOS).tobytes()
+            regions = grayscale.resize((REGION_THUMBNAIL_SIZE, REGION_THUMBNAIL_SIZE), PILImage.LANCZOS).tobytes()
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        return None
+    value = 0
+    for row in range(HASH_SIZE):
+        for column in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + column]
+            right = pixels[row * (HASH_SIZE + 1) + column + 1]
+            value = (value << 1) | (left > right)
+    return ImageFingerprint(value, regions)
+
+def differenceHash(data: bytes) -> Optional[int]:
+    fingerprint = fingerprintImage(data)
+    return fingerprint.hash if fingerprint is not None else None
+
+def maxRegionDifference(first: bytes, second: bytes) -> float:
+    # The largest mean absolute difference of any region of two region thumbnails
+    PILImage, _ = getPillow()
+    from PIL import ImageChops
+    size = (REGION_THUMBNAIL_SIZE, REGION_THUMBNAIL_SIZE)
+    difference = ImageChops.difference(PILImage.frombytes('L', size, first), PILImage.frombytes('L', size, second))
+    # A box filter down to one pixel per region averages each region exactly
+    regions = difference.resize((REGION_THUMBNAIL_SIZE // REGION_SIZE,) * 2, PILImage.BOX)
+    return max(regions.tobytes())
+
+def hammingDistance(first: int, second: int) -> int:
+    return bin(first ^ second).count("1")
+
+class BKTree:
+    # Every child hangs under its parent by their distance, a search within radius r of a node at distance d
+    # only descends into children between d - r and d + r
+    def __init__(self) -> None:
+        self.root: Optional[list] = None
+        self.size = 0
+
+    def add(self, value: int, item: str) -> bool:
+        # False when the value is already in the tree
+        node = [value, item, {}]
+        if self.root is None:
+            self.root = node
+            self.size = 1
+            return True
+        current = self.root
+        while True:
+            distance = hammingDistance(value, current[0])
+            if distance == 0:
+                return False
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                self.size += 1
+                return True
+            current = child
+
+    def nearest(self, value: int, maxDistance: int) -> Optional[tuple[int, str]]:
+        best: Optional[tuple[int, str]] = None
+        pending = [self.root] if self.root is not None else []
+        while pending:
+            node = pending.pop()
+            distance = hammingDistance(value, node[0])
+            if distance <= maxDistance and (best is None or distance < best[0]):
+                best = (distance, node[1])
+                maxDistance = distance
+            pending.extend(child for childDistance, child in node[2].items() if distance - maxDistance <= childDistance <= distance + maxDistance)
+        return best
+
+def _regionsContainer() -> Any:
+    return getContainerClient(getStorageConnectionString(), getImageRegionsContainerName())
+
+class NearDuplicateIndex:
+    def __init__(self) -> None:
+        self.tree = BKTree()
+        # Every hash in the tree with its OCR blob and when it was last recorded, oldest first
+        self.entries: dict[int, tuple[str, float]] = {}
+        self.lock = threading.Lock()
+        self.loadedSince: Optional[float] = None
+        self.nextRefreshAt = 0.0
+        self.nextPruneAt = 0.0
+        self.refreshLock = threading.Lock()
+
+    def isRefreshDue(self) -> bool:
+        return isNearDuplicateDetectionEnabled() and time.monotonic() >= self.nextRefreshAt
+
+    def refreshIfDue(self) -> None:
+        # Never blocks the caller, a cold worker finds no near duplicates until its first load is done
+        if not self.isRefreshDue() or not self.refreshLock.acquire(blocking=False):
+            return
+        self.nextRefreshAt = time.monotonic() + getRefreshSeconds()
+        threading.Thread(target=self._refresh, name="near-duplicate-refresh", daemon=True).start()
+
+    def _refresh(self) -> None:
+        try:
+            since = self.loadedSince if self.loadedSince is not None else time.time() - getRetentionSeconds()
+            _, table = createTableIfNotExists(getImageHashTableName())
+            rows = table.query_entities(f"PartitionKey eq '{HASH_PARTITION}' and RowKey ge '{hashRowKey(since)}'", select=['RowKey', 'Hash', 'OcrBlob']) # type: ignore
+            latest = since
+            for row in rows:
+                recordedAt = int(row['RowKey'].split('_')[0]) / 1000
+                self._add(int(row['Hash'], 16), row['OcrBlob'], recordedAt)
+                latest = max(latest, recordedAt)
+            # Rows written by other workers may land slightly out of order, the last minute is read again
+            self.loadedSince = latest - 60
+            before = time.time() - getRetentionSeconds()
+            self._evictExpired(before)
+            if time.monotonic() >= self.nextPruneAt:
+                self.nextPruneAt = time.monotonic() + getPruneSeconds()
+                # Only regions of images recorded again inside the window outlive their expired rows
+                with self.lock:
+                    retained = {ocrBlob for ocrBlob, _ in self.entries.values()}
+                pruneImageHashes(table, before, retained)
+        except HttpResponseError as e:
+            logging.warning(f"Could not refresh the near duplicate image index {e}")
+        finally:
+            self.refreshLock.release()
+
+    def _add(self, value: int, ocrBlob: str, recordedAt: float) -> None:
+        with self.lock:
+            known = self.entries.pop(value, None)
+            if known is not None:
+                # Recorded again, the tree keeps the first OCR blob and the entry moves to the end
+                self.entries[value] = (known[0], max(known[1], recordedAt))
+                return
+            self.tree.add(value, ocrBlob)
+            self.entries[value] = (ocrBlob, recordedAt)
+            # Over the cap the tree is rebuilt from the most recent entries
+            if len(self.entries) > getMaxEntries() * 1.1:
+                for oldest in list(self.entries)[:len(self.entries) - getMaxEntries()]:
+                    del self.entries[oldest]
+                self._rebuildTree()
+
+    def _evictExpired(self, before: float) -> None:
+        # Hashes last recorded before the retention window stop matching
+        with self.lock:
+            if all(recordedAt >= before for _, recordedAt in self.entries.values()):
+                return
+            self.entries = {value: entry for value, entry in self.entries.items() if entry[1] >= before}
+            self._rebuildTree()
+
+    def _rebuildTree(self) -> None:
+        # A BK-tree can't drop nodes
+        self.tree = BKTree()
+        for value, (ocrBlob, _) in self.entries.items():
+            self.tree.add(value, ocrBlob)
+
+    def hashOf(self, data: bytes) -> Optional[ImageFingerprint]:
+        return fingerprintImage(data) if isNearDuplicateDetectionEnabled() else None
+
+    def find(self, fingerprint: ImageFingerprint) -> Optional[str]:
+        # The OCR cache blob of the closest recorded image within the threshold whose regions all agree
+        if not isNearDuplicateDetectionEnabled():
+            return None
+        with self.lock:
+            match = self.tree.nearest(fingerprint.hash, getMaxDistance())
+        if match is None:
+            return None
+        increment("ocrNearDuplicate.distance", match[0])
+        try:
+            recorded = zlib.decompress(_regionsContainer().get_blob_client(match[1]).download_blob().readall())
+        except (ResourceNotFoundError, zlib.error):
+            return None
+        except HttpResponseError as e:
+            logging.warning(f"Could not read the regions of a near duplicate image {e}")
+            return None
+        if maxRegionDifference(fingerprint.regions, recorded) > getMaxRegionDifference():
+            increment("ocrNearDuplicate.rejected")
+            return None
+        return match[1]
+
+    def record(self, fingerprint: ImageFingerprint, ocrBlob: str) -> None:
+        if not isNearDuplicateDetectionEnabled():
+            return
+        try:
+            # The regions go first, a hash is only shared once its match can be confirmed
+            try:
+                _regionsContainer().get_blob_client(ocrBlob).upload_blob(zlib.compress(fingerprint.regions), overwrite=False)
+            except ResourceExistsError:
+                pass
+            self._add(fingerprint.hash, ocrBlob, time.time())
+            _, table = createTableIfNotExists(getImageHashTableName())
+            table.upsert_entity({'PartitionKey': HASH_PARTITION, 'RowKey': f"{hashRowKey(time.time())}_{fingerprint.hash:064x}",
+                                 'Hash': f"{fingerprint.hash:064x}", 'OcrBlob': ocrBlob}) # type: ignore
+        except HttpResponseError as e:
+            logging.warning(f"Could not record the image hash {e}")
+
+def pruneImageHashes(table: Any, before: float, retained: set[str]) -> int:
+    # Deletes the hash rows older than before with their region thumbnails, except thumbnails of OCR blobs in
+    # retained, which were recorded again more recently
+    rows = list(table.query_entities(f"PartitionKey eq '{HASH_PARTITION}' and RowKey lt '{hashRowKey(before)}'", select=['PartitionKey', 'RowKey', 'OcrBlob']))
+    container = _regionsContainer()
+    for blobName in {row['OcrBlob'] for row in rows} - retained:
+        try:
+            container.get_blob_client(blobName).delete_blob()
+        except ResourceNotFoundError:
+            pass
+    for chunk in chunked(rows, MAX_BATCH_OPERATIONS):
+        try:
+            table.submit_transaction([("delete", {'PartitionKey': row['PartitionKey'], 'RowKey': row['RowKey']}) for row in chunk])
+        except TableTransactionError as e:
+            if e.status_code != 404:
+                raise
+    return len(rows)
+
+_index = NearDuplicateIndex()
+
+def getNearDuplicateIndex() -> NearDuplicateIndex:
+    return _index
@@ -0,0 +1,14 @@
+import logging
+import azure.functions as func
+from azure.core.exceptions import HttpResponseError
+from AvailabilitySnapshot import rebuildAvailabilitySnapshot
+
+def main(timer: func.TimerRequest) -> None:
+    if timer.past_due:
+        logging.warning("Availability snapshot rebuild is running late")
+    try:
+        report = rebuildAvailabilitySnapshot()
+    except HttpResponseError as e:
+        logging.error(f"Availability snapshot rebuild failed: {e}")
+        raise
+    logging.info(f"Availability snapshot {report}")
@@ -0,0 +1,532 @@
+from __future__ import annotations
+import base64
+import json
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Iterator, Optional
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.core.paging import ItemPaged
+from azure.data.tables import EdmType, TableEntity, TableTransactionError
+
+# Local implementation of the table and blob operations in StorageBackend, one SQLite database holds every table
+# and container. Entities are keyed by (table, PartitionKey, RowKey) which is the clustered primary key, so point
+# reads, partition scans and continuation all run on the index. Other properties live in a JSON column and are not
+# indexed, a filter on them is evaluated on every row its key comparisons select, like in table storage.
+
+DEFAULT_PAGE_SIZE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    TableName TEXT NOT NULL,
+    PartitionKey TEXT NOT NULL,
+    RowKey TEXT NOT NULL,
+    ETag TEXT NOT NULL,
+    Timestamp TEXT NOT NULL,
+    Data TEXT NOT NULL,
+    Types TEXT NOT NULL,
+    PRIMARY KEY (TableName, PartitionKey, RowKey)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blobs (
+    Container TEXT NOT NULL,
+    Name TEXT NOT NULL,
+    ETag TEXT NOT NULL,
+    Content BLOB NOT NULL,
+    PRIMARY KEY (Container, Name)
+) WITHOUT ROWID;
+"""
+
+def _formatDatetime(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def _parseDatetime(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def _newETag(timestamp: str) -> str:
+    return f'W/"datetime\'{timestamp}\'-{uuid.uuid4().hex[:8]}"'
+
+def _withStatus(error: Exception, status: int) -> Exception:
+    # The Azure exceptions take their status from the HTTP response, there is none here
+    error.status_code = status  # type: ignore
+    return error
+
+_EDM_TYPES = {
+    EdmType.DATETIME: 'datetime',
+    EdmType.BINARY: 'binary',
+    EdmType.GUID: 'guid',
+    EdmType.INT64: 'int64',
+}
+
+def _serializeValue(value: Any) -> tuple[Any, Optional[str]]:
+    if isinstance(value, tuple) and len(value) == 2 and isinstance(value[1], EdmType):
+        value, edmType = value
+        kind = _EDM_TYPES.get(edmType)
+        if kind == 'datetime' and isinstance(value, str):
+            value = _parseDatetime(value)
+        elif kind == 'int64':
+            return int(value), None
+        elif kind is None:
+            return value, None
+    if isinstance(value, datetime):
+        return _formatDatetime(value), 'datetime'
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode(), 'binary'
+    if isinstance(value, uuid.UUID):
+        return str(value), 'guid'
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value, None
+    return str(value), None
+
+def _deserializeValue(value: Any, kind: Optional[str]) -> Any:
+    if kind == 'datetime':
+        return _parseDatetime(value)
+    if kind == 'binary':
+        return base64.b64decode(value)
+    if kind == 'guid':
+        return uuid.UUID(value)
+    return value
+
+def _serializeEntity(entity: dict) -> tuple[str, str, str, str]:
+    data: dict[str, Any] = {}
+    types: dict[str, str] = {}
+    for key, value in entity.items():
+        if key in ('PartitionKey', 'RowKey', 'Timestamp', 'etag'):
+            continue
+        data[key], kind = _serializeValue(value)
+        if kind is not None:
+            types[key] = kind
+    return str(entity['PartitionKey']), str(entity['RowKey']), json.dumps(data), json.dumps(types)
+
+class ODataFilterTranslator:
+    # Translates the table storage filter subset the project writes (comparisons joined by and/or/not) to SQL.
+    # Like table storage, a comparison only matches properties of the literal's type. Only PartitionKey and RowKey
+    # comparisons narrow the primary key range, every other property is read with json_extract row by row.
+    _TOKEN = re.compile(r"""
+        \s*(?:
+            (?P<open>\() | (?P<close>\)) |
+            (?P<typed>(?:datetime|guid|X|binary)'(?:[^']|'')*') |
+            (?P<string>'(?:[^']|'')*') |
+            (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)[LlDdMm]? |
+            (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+        )""", re.VERBOSE)
+    _OPERATORS = {'eq': '=', 'ne': '!=', 'gt': '>', 'ge': '>=', 'lt': '<', 'le': '<='}
+    _COLUMNS = ('PartitionKey', 'RowKey', 'Timestamp')
+
+    def __init__(self, query_filter: str) -> None:
+        self.tokens = self._tokenize(query_filter)
+        self.position = 0
+        self.parameters: list[Any] = []
+
+    @staticmethod
+    def translate(query_filter: str) -> tuple[str, list[Any]]:
+        translator = ODataFilterTranslator(query_filter)
+        sql = translator._parseOr()
+        if translator.position != len(translator.tokens):
+            raise ValueError(f"Unexpected token in filter: {translator.tokens[translator.position][1]}")
+        return sql, translator.parameters
+
+    def _tokenize(self, query_filter: str) -> list[tuple[str, str]]:
+        tokens: list[tuple[str, str]] = []
+        position = 0
+        query_filter = query_filter.rstrip()
+        while position < len(query_filter):
+            match = self._TOKEN.match(query_filter, position)
+            if match is None or match.end() == position:
+                raise ValueError(f"Invalid filter at {query_filter[position:]!r}")
+            kind = match.lastgroup
+            tokens.append((kind, match.group(kind)))  # type: ignore
+            position = match.end()
+        return tokens
+
+    def _peek(self) -> Optional[tuple[str, str]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self) -> tuple[str, str]:
+        token = self._peek()
+        if token is None:
+            raise ValueError("Unexpected end of filter")
+        self.position += 1
+        return token
+
+    def _isKeyword(self, keyword: str) -> bool:
+        token = self._peek()
+        return token is not None and token[0] == 'word' and token[1].lower() == keyword
+
+    def _parseOr(self) -> str:
+        clauses = [self._parseAnd()]
+        while self._isKeyword('or'):
+            self.position += 1
+            clauses.append(self._parseAnd())
+        return clauses[0] if len(clauses) == 1 else '(' + ' OR '.join(clauses) + ')'
+
+    def _parseAnd(self) -> str:
+        clauses = [self._parseNot()]
+        while self._isKeyword('and'):
+            self.position += 1
+            clauses.append(self._parseNot())
+        return clauses[0] if len(clauses) == 1 else '(' + ' AND '.join(clauses) + ')'
+
+    def _parseNot(self) -> str:
+        if self._isKeyword('not'):
+            self.position += 1
+            return f"NOT {self._parseNot()}"
+        return self._parsePrimary()
+
+    def _parsePrimary(self) -> str:
+        kind, value = self._next()
+        if kind == 'open':
+            clause = self._parseOr()
+            if self._next()[0] != 'close':
+                raise ValueError("Unbalanced parentheses in filter")
+            return f"({clause})"
+        if kind != 'word':
+            raise ValueError(f"Expected a property name, found {value}")
+        operatorKind, operator = self._next()
+        if operatorKind != 'word' or operator.lower() not in self._OPERATORS:
+            raise ValueError(f"Unsupported operator {operator}")
+        return self._comparison(value, self._OPERATORS[operator.lower()], self._literal())
+
+    def _literal(self) -> tuple[Any, str]:
+        kind, value = self._next()
+        if kind == 'string':
+            return value[1:-1].replace("''", "'"), 'string'
+        if kind == 'number':
+            return (float(value) if any(c in value for c in '.eE') else int(value)), 'number'
+        if kind == 'typed':
+            prefix, _, quoted = value.partition("'")
+            text = quoted[:-1].replace("''", "'")
+            if prefix == 'datetime':
+                return _formatDatetime(_parseDatetime(text)), 'datetime'
+            if prefix == 'guid':
+                return text.lower(), 'guid'
+            raise ValueError(f"Unsupported literal {value}")
+        if kind == 'word' and value.lower() in ('true', 'false'):
+            return int(value.lower() == 'true'), 'bool'
+        raise ValueError(f"Expected a literal, found {value}")
+
+    def _comparison(self, propertyName: str, operator: str, literal: tuple[Any, str]) -> str:
+        value, kind = literal
+        if propertyName == 'Timestamp' and kind != 'datetime':
+            return "0"
+        self.parameters.append(value)
+        if propertyName in self._COLUMNS:
+            return f"{propertyName} {operator} ?"
+        path = '$."' + propertyName.replace('"', '""') + '"'
+        column = f"json_extract(Data, '{path}')"
+        jsonType = f"json_type(Data, '{path}')"
+        edmType = f"json_extract(Types, '{path}')"
+        if kind == 'string':
+            guard = f"{jsonType} = 'text' AND {edmType} IS NULL"
+        elif kind == 'number':
+            guard = f"{jsonType} IN ('integer', 'real')"
+        elif kind == 'bool':
+            guard = f"{jsonType} IN ('true', 'false')"
+        elif kind == 'guid':
+            guard = f"{edmType} = 'guid'"
+            column = f"lower({column})"
+        else:
+            guard = f"{edmType} = 'datetime'"
+        return f"({guard} AND {column} {operator} ?)"
+
+class SqliteDatabase:
+    # A single connection shared by every thread, SQLite serializes writers anyway
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+
+    def createTableIfNotExists(self, table_name: str) -> 'SqliteTableClient':
+        return SqliteTableClient(self, table_name)
+
+    def getContainerClient(self, container_name: str) -> 'SqliteContainerClient':
+        return SqliteContainerClient(self, container_name)
+
+    def execute(self, sql: str, parameters: Iterable[Any] = ()) -> list[tuple]:
+        with self.lock:
+            return self.connection.execute(sql, tuple(parameters)).fetchall()
+
+    def transaction(self, work: Callable[[], Any]) -> Any:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+            return result
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+class SqliteTableClient:
+    # Mirrors the subset of azure.data.tables.TableClient the project calls, errors are the same azure.core exceptions
+    def __init__(self, database: SqliteDatabase, table_name: str) -> None:
+        self.database = database
+        self.table_name = table_name
+
+    def __enter__(self) -> 'SqliteTableClient':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def query_entities(self, query_filter: str, *, select: Optional[list[str]] = None,
+                       results_per_page: Optional[int] = None, **kwargs: Any) -> ItemPaged[TableEntity]:
+        where, parameters = ODataFilterTranslator.translate(query_filter) if query_filter.strip() else ("", [])
+        return self._query(where, parameters, select, results_per_page)
+
+    def list_entities(self, *, select: Optional[list[str]] = None,
+                      results_per_page: Optional[int] = None, **kwargs: Any) -> ItemPaged[TableEntity]:
+        return self._query("", [], select, results_per_page)
+
+    def get_entity(self, partition_key: str, row_key: str, *, select: Optional[list[str]] = None, **kwargs: Any) -> TableEntity:
+        row = self._getRow(partition_key, row_key)
+        if row is None:
+            raise _withStatus(ResourceNotFoundError(message=f"Entity {partition_key}/{row_key} not found"), 404)
+        return self._toEntity(row, select)
+
+    def create_entity(self, entity: dict, **kwargs: Any) -> dict[str, Any]:
+        return self.database.transaction(lambda: self._create(entity))
+
+    def update_entity(self, entity: dict, mode: Any = 'merge', **kwargs: Any) -> dict[str, Any]:
+        return self.database.transaction(lambda: self._update(entity, mode, kwargs.get('etag'), kwargs.get('match_condition')))
+
+    def upsert_entity(self, entity: dict, mode: Any = 'merge', **kwargs: Any) -> dict[str, Any]:
+        return self.database.transaction(lambda: self._upsert(entity, mode))
+
+    def delete_entity(self, *args: Any, **kwargs: Any) -> None:
+        partition_key, row_key = self._deleteKeys(args, kwargs)
+        self.database.transaction(lambda: self._delete(partition_key, row_key, kwargs.get('etag'), kwargs.get('match_condition')))
+
+    def submit_transaction(self, operations: Iterable[tuple], **kwargs: Any) -> list[dict[str, Any]]:
+        operations = list(operations)
+        partitions = {operation[1]['PartitionKey'] for operation in operations}
+        if len(partitions) > 1:
+            raise ValueError("Partition Keys in the batch must all be the same.")
+        return self.database.transaction(lambda: [self._apply(index, operation) for index, operation in enumerate(operations)])
+
+    def bulkInsert(self, entities: Iterable[dict]) -> int:
+        # Loads many entities in one SQLite transaction regardless of partition, used to seed benchmarks and migrations
+        def insert() -> int:
+            count = 0
+            for entity in entities:
+                self._write(*_serializeEntity(entity))
+                count += 1
+            return count
+        return self.database.transaction(insert)
+
+    def _apply(self, index: int, operation: tuple) -> dict[str, Any]:
+        action, entity = str(operation[0]).lower().split('.')[-1], operation[1]
+        options = operation[2] if len(operation) > 2 else {}
+        try:
+            if action == 'create':
+                return self._create(entity)
+            if action == 'update':
+                return self._update(entity, options.get('mode', 'merge'), options.get('etag'), options.get('match_condition'))
+            if action == 'upsert':
+                return self._upsert(entity, options.get('mode', 'merge'))
+            if action == 'delete':
+                self._delete(entity['PartitionKey'], entity['RowKey'], options.get('etag'), options.get('match_condition'), missingOk=False)
+                return {}
+        except (ResourceExistsError, ResourceNotFoundError, ResourceModifiedError) as e:
+            error = TableTransactionError(message=f"{index}:{e.message}")
+            error.status_code = e.status_code  # type: ignore
+            error.error_code = type(e).__name__  # type: ignore
+            raise error
+        raise ValueError(f"Unsupported transaction operation {operation[0]}")
+
+    def _query(self, where: str, parameters: list[Any], select: Optional[list[str]], results_per_page: Optional[int]) -> ItemPaged[TableEntity]:
+        pageSize = results_per_page or DEFAULT_PAGE_SIZE
+
+        def getNext(continuation_token: Optional[str]) -> list[tuple]:
+            sql = "SELECT PartitionKey, RowKey, ETag, Timestamp, Data, Types FROM entities WHERE TableName = ?"
+            arguments: list[Any] = [self.table_name]
+            if where:
+                sql += f" AND {where}"
+                arguments += parameters
+            if continuation_token:
+                lastPartition, lastRow = json.loads(continuation_token)
+                sql += " AND (PartitionKey > ? OR (PartitionKey = ? AND RowKey > ?))"
+                arguments += [lastPartition, lastPartition, lastRow]
+            sql += " ORDER BY PartitionKey, RowKey LIMIT ?"
+            return self.database.execute(sql, arguments + [pageSize])
+
+        def extractData(rows: list[tuple]) -> tuple[Optional[str], Iterator[TableEntity]]:
+            token = json.dumps([rows[-1][0], rows[-1][1]]) if len(rows) == pageSize else None
+            return token, iter([self._toEntity(row, select) for row in rows])
+
+        return ItemPaged(getNext, extractData)
+
+    def _getRow(self, partition_key: str, row_key: str) -> Optional[tuple]:
+        rows = self.database.execute(
+            "SELECT PartitionKey, RowKey, ETag, Timestamp, Data, Types FROM entities WHERE TableName = ? AND PartitionKey = ? AND RowKey = ?",
+            (self.table_name, partition_key, row_key))
+        return rows[0] if rows else None
+
+    def _toEntity(self, row: tuple, select: Optional[list[str]]) -> TableEntity:
+        partition_key, row_key, etag, timestamp, data, types = row
+        kinds = json.loads(types)
+        entity = TableEntity()
+        if select is None or 'PartitionKey' in select:
+            entity['PartitionKey'] = partition_key
+        if select is None or 'RowKey' in select:
+            entity['RowKey'] = row_key
+        for key, value in json.loads(data).items():
+            if select is None or key in select:
+                entity[key] = _deserializeValue(value, kinds.get(key))
+        entity._metadata = {'etag': etag, 'timestamp': _parseDatetime(timestamp)}  # type: ignore
+        return entity
+
+    def _write(self, partition_key: str, row_key: str, data: str, types: str) -> dict[str, Any]:
+        timestamp = _formatDatetime(datetime.now(timezone.utc))
+        etag = _newETag(timestamp)
+        self.database.connection.execute(
+            "INSERT OR REPLACE INTO entities (TableName, PartitionKey, RowKey, ETag, Timestamp, Data, Types) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.table_name, partition_key, row_key, etag, timestamp, data, types))
+        return {'etag': etag, 'date': _parseDatetime(timestamp)}
+
+    def _create(self, entity: dict) -> dict[str, Any]:
+        partition_key, row_key, data, types = _serializeEntity(entity)
+        if self._getRow(partition_key, row_key) is not None:
+            raise _withStatus(ResourceExistsError(message=f"Entity {partition_key}/{row_key} already exists"), 409)
+        return self._write(partition_key, row_key, data, types)
+
+    def _update(self, entity: dict, mode: Any, etag: Optional[str], match_condition: Any) -> dict[str, Any]:
+        partition_key, row_key, data, types = _serializeEntity(entity)
+        row = self._getRow(partition_key, row_key)
+        if row is None:
+            raise _withStatus(ResourceNotFoundError(message=f"Entity {partition_key}/{row_key} not found"), 404)
+        self._checkETag(row, etag, match_condition)
+        return self._write(partition_key, row_key, *self._merged(row, data, types, mode))
+
+    def _upsert(self, entity: dict, mode: Any) -> dict[str, Any]:
+        partition_key, row_key, data, types = _serializeEntity(entity)
+        row = self._getRow(partition_key, row_key)
+        if row is not None:
+            data, types = self._merged(row, data, types, mode)
+        return self._write(partition_key, row_key, data, types)
+
+    def _delete(self, partition_key: str, row_key: str, etag: Optional[str], match_condition: Any, missingOk: bool = True) -> None:
+        row = self._getRow(partition_key, row_key)
+        if row is None:
+            if missingOk:
+                return  # TableClient.delete_entity ignores missing entities too
+            raise _withStatus(ResourceNotFoundError(message=f"Entity {partition_key}/{row_key} not found"), 404)
+        self._checkETag(row, etag, match_condition)
+        self.database.connection.execute(
+            "DELETE FROM entities WHERE TableName = ? AND PartitionKey = ? AND RowKey = ?",
+            (self.table_name, partition_key, row_key))
+
+    @staticmethod
+    def _merged(row: tuple, data: str, types: str, mode: Any) -> tuple[str, str]:
+        if str(getattr(mode, 'value', mode)).lower() != 'merge':
+            return data, types
+        newData, newTypes = json.loads(data), json.loads(types)
+        mergedTypes = {key: kind for key, kind in json.loads(row[5]).items() if key not in newData}
+        mergedTypes.update(newTypes)
+        return json.dumps({**json.loads(row[4]), **newData}), json.dumps(mergedTypes)
+
+    @staticmethod
+    def _checkETag(row: tuple, etag: Optional[str], match_condition: Any) -> None:
+        if etag is None or match_condition is None or getattr(match_condition, 'name', '') != 'IfNotModified':
+            return
+        if row[2] != etag:
+            raise _withStatus(ResourceModifiedError(message="The update condition specified in the request was not satisfied"), 412)
+
+    @staticmethod
+    def _deleteKeys(args: tuple, kwargs: dict[str, Any]) -> tuple[str, str]:
+        if args and isinstance(args[0], dict):
+            return args[0]['PartitionKey'], args[0]['RowKey']
+        entity = kwargs.get('entity')
+        if entity is not None:
+            return entity['PartitionKey'], entity['RowKey']
+        if len(args) >= 2:
+            return args[0], args[1]
+        return kwargs['partition_key'], kwargs['row_key']
+
+class SqliteBlobProperties:
+    def __init__(self, name: str, etag: str, size: int) -> None:
+        self.name = name
+        self.etag = etag
+        self.size = size
+
+class _SqliteDownload:
+    def __init__(self, content: bytes, properties: SqliteBlobProperties) -> None:
+        self.content = content
+        self.properties = properties
+
+    def readall(self) -> bytes:
+        return self.content
+
+    def readinto(self, stream: Any) -> int:
+        stream.write(self.content)
+        return len(self.content)
+
+class SqliteBlobClient:
+    def __init__(self, database: SqliteDatabase, container_name: str, blob_name: str) -> None:
+        self.database = database
+        self.container_name = container_name
+        self.blob_name = blob_name
+
+    def download_blob(self, **kwargs: Any) -> _SqliteDownload:
+        rows = self.database.execute("SELECT Content, ETag FROM blobs WHERE Container = ? AND Name = ?",
+                                     (self.container_name, self.blob_name))
+        if not rows:
+            raise _withStatus(ResourceNotFoundError(message=f"Blob {self.container_name}/{self.blob_name} not found"), 404)
+        content = bytes(rows[0][0])
+        return _SqliteDownload(content, SqliteBlobProperties(self.blob_name, rows[0][1], len(content)))
+
+    def get_blob_properties(self, **kwargs: Any) -> SqliteBlobProperties:
+        rows = self.database.execute("SELECT ETag, length(Content) FROM blobs WHERE Container = ? AND Name = ?",
+                                     (self.container_name, self.blob_name))
+        if not rows:
+            raise _withStatus(ResourceNotFoundError(message=f"Blob {self.container_name}/{self.blob_name} not found"), 404)
+        return SqliteBlobProperties(self.blob_name, rows[0][0], rows[0][1])
+
+    def upload_blob(self, data: bytes, overwrite: bool = False, **kwargs: Any) -> dict[str, Any]:
+        content = data.encode() if isinstance(data, str) else bytes(data)
+        timestamp = _formatDatetime(datetime.now(timezone.utc))
+        etag = _newETag(timestamp)
+
+        def write() -> None:
+            exists = self.database.connection.execute("SELECT 1 FROM blobs WHERE Container = ? AND Name = ?",
+                                                      (self.container_name, self.blob_name)).fetchone()
+            if exists and not overwrite:
+                raise _withStatus(ResourceExistsError(message=f"Blob {self.container_name}/{self.blob_name} already exists"), 409)
+            self.database.connection.execute("INSERT OR REPLACE INTO blobs (Container, Name, ETag, Content) VALUES (?, ?, ?, ?)",
+                                             (self.container_name, self.blob_name, etag, content))
+        self.database.transaction(write)
+        return {'etag': etag}
+
+    def delete_blob(self, **kwargs: Any) -> None:
+        deleted = self.database.transaction(lambda: self.database.connection.execute(
+            "DELETE FROM blobs WHERE Container = ? AND Name = ?", (self.container_name, self.blob_name)).rowcount)
+        if not deleted:
+            raise _withStatus(ResourceNotFoundError(message=f"Blob {self.container_name}/{self.blob_name} not found"), 404)
+
+class SqliteContainerClient:
+    def __init__(self, database: SqliteDatabase, container_name: str) -> None:
+        self.database = database
+        self.container_name = container_name
+
+    def exists(self) -> bool:
+        return True
+
+    def create_container(self) -> None:
+        pass
+
+    def get_blob_client(self, blob: str) -> SqliteBlobClient:
+        return SqliteBlobClient(self.database, self.container_name, blob)
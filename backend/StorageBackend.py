@@ -0,0 +1,90 @@
+from __future__ import annotations
+import asyncio
+import os
+from typing import Any, AsyncIterator, Iterable, Optional, Protocol
+
+# The storage operations the project uses. The Azure SDK's TableClient and ContainerClient are the Azure
+# implementation, SqliteStorage provides a local one for load tests, benchmarks and single node deployments.
+# Pick the backend with the StorageBackend setting ("azure" by default or "sqlite").
+
+class TableRepository(Protocol):
+    def query_entities(self, query_filter: str, *, select: Optional[list[str]] = None, results_per_page: Optional[int] = None) -> Any: ...
+    def list_entities(self, *, select: Optional[list[str]] = None, results_per_page: Optional[int] = None) -> Any: ...
+    def get_entity(self, partition_key: str, row_key: str, **kwargs: Any) -> Any: ...
+    def create_entity(self, entity: dict, **kwargs: Any) -> Any: ...
+    def update_entity(self, entity: dict, mode: Any = ..., **kwargs: Any) -> Any: ...
+    def upsert_entity(self, entity: dict, mode: Any = ..., **kwargs: Any) -> Any: ...
+    def delete_entity(self, *args: Any, **kwargs: Any) -> None: ...
+    def submit_transaction(self, operations: Iterable[tuple], **kwargs: Any) -> Any: ...
+
+class BlobRepository(Protocol):
+    def download_blob(self, **kwargs: Any) -> Any: ...
+    def upload_blob(self, data: bytes, **kwargs: Any) -> Any: ...
+    def delete_blob(self, **kwargs: Any) -> None: ...
+    def get_blob_properties(self, **kwargs: Any) -> Any: ...
+
+class ContainerRepository(Protocol):
+    container_name: str
+    def get_blob_client(self, blob: str) -> BlobRepository: ...
+
+def getStorageBackend() -> str:
+    return os.getenv('StorageBackend', 'azure').lower()
+
+def isSqliteBackend() -> bool:
+    return getStorageBackend() == 'sqlite'
+
+def getSqliteDatabasePath() -> str:
+    return os.getenv('SqliteDatabasePath', ':memory:')
+
+class AsyncTableAdapter:
+    # Gives a synchronous table repository the aio TableClient interface by running its calls in threads
+    def __init__(self, table: TableRepository) -> None:
+        self.table = table
+
+    def query_entities(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        return self._iterate(lambda: list(self.table.query_entities(*args, **kwargs)))
+
+    def list_entities(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        return self._iterate(lambda: list(self.table.list_entities(*args, **kwargs)))
+
+    async def _iterate(self, load) -> AsyncIterator[Any]:
+        for entity in await asyncio.to_thread(load):
+            yield entity
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.table, name)
+        if not callable(method):
+            return method
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+class _AsyncDownload:
+    def __init__(self, download: Any) -> None:
+        self.download = download
+
+    async def readall(self) -> bytes:
+        return self.download.readall()
+
+class AsyncBlobAdapter:
+    def __init__(self, blob: BlobRepository) -> None:
+        self.blob = blob
+
+    async def download_blob(self, **kwargs: Any) -> _AsyncDownload:
+        return _AsyncDownload(await asyncio.to_thread(self.blob.download_blob, **kwargs))
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.blob, name)
+        if not callable(method):
+            return method
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+class AsyncContainerAdapter:
+    def __init__(self, container: ContainerRepository) -> None:
+        self.container = container
+        self.container_name = container.container_name
+
+    def get_blob_client(self, blob: str) -> AsyncBlobAdapter:
+        return AsyncBlobAdapter(self.container.get_blob_client(blob))
@@ -1,10 +1,18 @@
+from __future__ import annotations
+import asyncio
 import hashlib
+import os
 import re
-from typing import Optional
+from typing import Iterable, Optional
 import azure.functions as func
 from dataclasses import dataclass
-from schemaUtils import BaseEntity, createTableIfNotExists, getStoresTableName, writeEntityToTable
-from azure.data.tables import TableEntity
+from CacheUtils import LRUCache
+from schemaUtils import MAX_FILTER_COMPARISONS, BaseEntity, buildOrFilter, chunked, createTableIfNotExists, createTableIfNotExistsAsync, getStorageSemaphore, getStoreEmailsTableName, getStoresTableName, writeEntityToTable
+from azure.core.exceptions import ResourceNotFoundError
+from Tracing import recordCacheLookup
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from azure.data.tables import TableEntity
 
 @dataclass
 class Store(BaseEntity):
@@ -19,6 +27,20 @@ class Store(BaseEntity):
     @staticmethod
     def uidFromName(name : str):
         return name.replace(" ","").lower()
+STORE_EMAIL_ROW_KEY = ''
+
+@dataclass
+class StoreEmailEntity(BaseEntity):
+    # Alternate key of a store: one entity per email, holding what login needs so it is a single point read
+    Email: str
+    StoreName: str
+    Password: str
+    def uid(self):
+        return normalizeEmail(self.Email)
+
+def normalizeEmail(email: str) -> str:
+    return email.strip().lower()
+
 class StoreRequestParser:
     @staticmethod
     def parse(req: func.HttpRequest) -> Store:
@@ -57,19 +79,94 @@ class StoreEntityParser:
 
 def getStoreEntity(storeName: str) -> Optional[TableEntity]:
     _,table_client = createTableIfNotExists(getStoresTableName())
-    with table_client as table:
-        storeUid = Store.uidFromName(storeName)
-        entities = table.query_entities(f"PartitionKey eq '{storeUid}'") # type: ignore
-        entity_list = list(entities)
-        if not entity_list:
-            return None
+    storeUid = Store.uidFromName(storeName)
+    entities = table_client.query_entities(f"PartitionKey eq '{storeUid}'") # type: ignore
+    entity_list = list(entities)
+    if not entity_list:
+        return None
     if len(entity_list) > 1:
         raise ValueError("Multiple stores found")
     
     return entity_list[0]
 
+# Store profiles practically never change, they are cached by uid for StoreCacheTtlSeconds
+_storeCache: LRUCache[str, Store] = LRUCache(int(os.getenv('StoreCacheMaxEntries', '4096')),
+                                             ttlSeconds=float(os.getenv('StoreCacheTtlSeconds', '300')))
+
 def getStore(storeName: str) -> Optional[Store]:
-    entity = getStoreEntity(storeName)
-    if not entity:
+    return getStores([storeName]).get(storeName)
+
+def getStores(storeNames: Iterable[str]) -> dict[str, Store]:
+    # Returns the stores that exist keyed by the requested name, all cache misses are fetched with OR-filtered queries
+    stores, missing = _getCachedStores(storeNames)
+    if not missing:
+        return stores
+
+    _,table_client = createTableIfNotExists(getStoresTableName())
+    found: dict[str, Store] = {}
+    for chunk in chunked(missing.keys(), MAX_FILTER_COMPARISONS):
+        for entity in table_client.query_entities(buildOrFilter('PartitionKey', chunk)): # type: ignore
+            if entity['PartitionKey'] in found:
+                raise ValueError("Multiple stores found")
+            found[entity['PartitionKey']] = StoreEntityParser.parse(entity)
+    _cacheFoundStores(found, missing, stores)
+    return stores
+
+async def getStoresAsync(storeNames: Iterable[str]) -> dict[str, Store]:
+    # Async getStores, the OR-filtered queries of the cache misses run concurrently
+    stores, missing = _getCachedStores(storeNames)
+    if not missing:
+        return stores
+
+    table_client = await createTableIfNotExistsAsync(getStoresTableName())
+    async def findStores(chunk: list[str]) -> list[TableEntity]:
+        async with getStorageSemaphore():
+            return [entity async for entity in table_client.query_entities(buildOrFilter('PartitionKey', chunk))]
+    results = await asyncio.gather(*(findStores(chunk) for chunk in chunked(missing.keys(), MAX_FILTER_COMPARISONS)))
+    found: dict[str, Store] = {}
+    for entity_list in results:
+        for entity in entity_list:
+            if entity['PartitionKey'] in found:
+                raise ValueError("Multiple stores found")
+            found[entity['PartitionKey']] = StoreEntityParser.parse(entity)
+    _cacheFoundStores(found, missing, stores)
+    return stores
+
+def _getCachedStores(storeNames: Iterable[str]) -> tuple[dict[str, Store], dict[str, list[str]]]:
+    stores: dict[str, Store] = {}
+    missing: dict[str, list[str]] = {}
+    for name in storeNames:
+        storeUid = Store.uidFromName(name)
+        cached = _storeCache.get(storeUid)
+        recordCacheLookup("storeCache", cached is not None)
+        if cached is not None:
+            stores[name] = cached
+        else:
+            missing.setdefault(storeUid, []).append(name)
+    return stores, missing
+
+def _cacheFoundStores(found: dict[str, Store], missing: dict[str, list[str]], stores: dict[str, Store]) -> None:
+    for storeUid, store in found.items():
+        _storeCache.put(storeUid, store)
+        for name in missing[storeUid]:
+            stores[name] = store
+
+def invalidateStore(storeName: str) -> None:
+    _storeCache.invalidate(Store.uidFromName(storeName))
+
+def getStoreLoginByEmail(email: str) -> Optional[TableEntity]:
+    _,table_client = createTableIfNotExists(getStoreEmailsTableName())
+    try:
+        return table_client.get_entity(partition_key=normalizeEmail(email), row_key=STORE_EMAIL_ROW_KEY) # type: ignore
+    except ResourceNotFoundError:
         return None
-    return StoreEntityParser.parse(entity)
+
+def claimStoreEmail(store: Store) -> None:
+    # Raises ResourceExistsError when another store already owns the email
+    _,table_client = createTableIfNotExists(getStoreEmailsTableName())
+    email = StoreEmailEntity(Email=store.Email, StoreName=store.StoreName, Password=store.Password)
+    writeEntityToTable(email, table_client, rowKey=STORE_EMAIL_ROW_KEY)
+
+def releaseStoreEmail(email: str) -> None:
+    _,table_client = createTableIfNotExists(getStoreEmailsTableName())
+    table_client.delete_entity(partition_key=normalizeEmail(email), row_key=STORE_EMAIL_ROW_KEY) # type: ignore
@@ -0,0 +1,188 @@
+import logging
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+import azure.functions as func
+from azure.core.exceptions import HttpResponseError
+from Image import isBinaryUpload
+from schemaUtils import createTableIfNotExists, getStoresTableName
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+CELL_SIZE_DEGREES = 0.1
+# Longitude cells wrap around, the cell at 180 is the cell at -180
+LONGITUDE_CELLS = round(360 / CELL_SIZE_DEGREES)
+# Stores with no usable coordinates are only picked when nothing closer can cover a medication
+UNKNOWN_DISTANCE_KM = 20000.0
+
+@dataclass
+class Location:
+    Latitude: float
+    Longitude: float
+    RadiusKm: Optional[float] = None
+
+    def cell(self, sizeDegrees: float = CELL_SIZE_DEGREES) -> tuple[int, int]:
+        return math.floor(self.Latitude / sizeDegrees), math.floor(self.Longitude / sizeDegrees)
+
+class LocationParser:
+    @staticmethod
+    def parse(req: func.HttpRequest) -> Optional[Location]:
+        # With a binary image upload the body is the image, the location is in the query string
+        json = req.params if isBinaryUpload(req) else req.get_json()
+        latitude = json.get('latitude')
+        longitude = json.get('longitude')
+        radius = json.get('radiusKm')
+        if latitude is None or longitude is None:
+            return None
+        try:
+            location = Location(
+                Latitude=float(latitude),
+                Longitude=float(longitude),
+                RadiusKm=float(radius) if radius is not None else None
+            )
+        except (TypeError, ValueError):
+            raise ValueError("Invalid location")
+        if not -90 <= location.Latitude <= 90 or not -180 <= location.Longitude <= 180:
+            raise ValueError("Invalid location")
+        if location.RadiusKm is not None and location.RadiusKm <= 0:
+            raise ValueError("Search radius must be positive")
+        return location
+
+def haversineKm(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    dLat = math.radians(lat2 - lat1)
+    dLon = math.radians(lon2 - lon1)
+    a = math.sin(dLat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dLon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def _wrapLongitudeCell(cell: int) -> int:
+    return (cell + LONGITUDE_CELLS // 2) % LONGITUDE_CELLS - LONGITUDE_CELLS // 2
+
+def _cellOf(latitude: float, longitude: float) -> tuple[int, int]:
+    return math.floor(latitude / CELL_SIZE_DEGREES), _wrapLongitudeCell(math.floor(longitude / CELL_SIZE_DEGREES))
+
+class StoreGrid:
+    # Fixed-size lat/lon grid, a radius query only visits the cells overlapping the search box
+    def __init__(self) -> None:
+        self.cells: dict[tuple[int, int], dict[str, tuple[float, float]]] = {}
+        self.positions: dict[str, tuple[float, float]] = {}
+
+    def add(self, storeName: str, latitude: float, longitude: float) -> None:
+        self.remove(storeName)
+        self.positions[storeName] = (latitude, longitude)
+        self.cells.setdefault(_cellOf(latitude, longitude), {})[storeName] = (latitude, longitude)
+
+    def remove(self, storeName: str) -> None:
+        position = self.positions.pop(storeName, None)
+        if position is not None:
+            self.cells.get(_cellOf(*position), {}).pop(storeName, None)
+
+    def distances(self, location: Location, storeNames: Optional[set[str]] = None) -> dict[str, float]:
+        if location.RadiusKm is None:
+            names = storeNames if storeNames is not None else self.positions.keys()
+            return {name: self._distanceTo(location, name) for name in names}
+        result: dict[str, float] = {}
+        for cell in self._cellsWithin(location):
+            for name, (latitude, longitude) in self.cells.get(cell, {}).items():
+                if storeNames is not None and name not in storeNames:
+                    continue
+                distance = haversineKm(location.Latitude, location.Longitude, latitude, longitude)
+                if distance <= location.RadiusKm:
+                    result[name] = distance
+        return result
+
+    def _distanceTo(self, location: Location, storeName: str) -> float:
+        position = self.positions.get(storeName)
+        if position is None:
+            return UNKNOWN_DISTANCE_KM
+        return haversineKm(location.Latitude, location.Longitude, *position)
+
+    def _cellsWithin(self, location: Location) -> list[tuple[int, int]]:
+        radius = location.RadiusKm or 0
+        latDelta = radius / KM_PER_DEGREE
+        cosLat = max(math.cos(math.radians(location.Latitude)), 1e-6)
+        lonDelta = min(radius / (KM_PER_DEGREE * cosLat), 180.0)
+        minLat = math.floor((location.Latitude - latDelta) / CELL_SIZE_DEGREES)
+        maxLat = math.floor((location.Latitude + latDelta) / CELL_SIZE_DEGREES)
+        minLon = math.floor((location.Longitude - lonDelta) / CELL_SIZE_DEGREES)
+        maxLon = math.floor((location.Longitude + lonDelta) / CELL_SIZE_DEGREES)
+        if (maxLat - minLat + 1) * (maxLon - minLon + 1) > len(self.cells):
+            return list(self.cells.keys())
+        # A box crossing the antimeridian continues on the other side
+        longitudes = sorted({_wrapLongitudeCell(lon) for lon in range(minLon, maxLon + 1)})
+        return [(lat, lon) for lat in range(minLat, maxLat + 1) for lon in longitudes]
+
+_grid: Optional[StoreGrid] = None
+_gridLoadedAt = 0.0
+# Guards swapping the grid and adding to it, the Stores table is never scanned while holding it after the first load
+_gridLock = threading.Lock()
+_refreshLock = threading.Lock()
+# Stores registered while a refresh is scanning the table, replayed on the new grid before it replaces the old one
+_addedDuringRefresh: Optional[list[tuple[str, float, float]]] = None
+
+def _getRefreshSeconds() -> float:
+    return float(os.getenv('StoreLocationsRefreshSeconds', '300'))
+
+def _parseCoordinates(latitude, longitude) -> Optional[tuple[float, float]]:
+    try:
+        return float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+
+def _loadStoreGrid() -> StoreGrid:
+    _, table_client = createTableIfNotExists(getStoresTableName())
+    grid = StoreGrid()
+    entities = table_client.list_entities(select=['StoreName', 'Latitude', 'Longitude']) # type: ignore
+    for entity in entities:
+        coordinates = _parseCoordinates(entity.get('Latitude'), entity.get('Longitude'))
+        if coordinates is None:
+            logging.warning(f"Store {entity.get('StoreName')} has no valid location")
+            continue
+        grid.add(entity['StoreName'], *coordinates)
+    return grid
+
+def _refreshStoreGrid() -> None:
+    global _grid, _gridLoadedAt, _addedDuringRefresh
+    try:
+        with _gridLock:
+            _addedDuringRefresh = []
+        grid = _loadStoreGrid()
+        with _gridLock:
+            for added in _addedDuringRefresh:
+                grid.add(*added)
+            _grid = grid
+            _gridLoadedAt = time.monotonic()
+    except (HttpResponseError, ValueError) as e:
+        logging.warning(f"Could not refresh store locations {e}")
+    finally:
+        with _gridLock:
+            _addedDuringRefresh = None
+        _refreshLock.release()
+
+def getStoreGrid() -> StoreGrid:
+    # Only the first load blocks, a stale grid keeps serving while a background thread loads the next one
+    global _grid, _gridLoadedAt
+    grid = _grid
+    if grid is None:
+        with _gridLock:
+            if _grid is None:
+                _grid = _loadStoreGrid()
+                _gridLoadedAt = time.monotonic()
+            return _grid
+    if time.monotonic() - _gridLoadedAt > _getRefreshSeconds() and _refreshLock.acquire(blocking=False):
+        threading.Thread(target=_refreshStoreGrid, name="store-grid-refresh", daemon=True).start()
+    return grid
+
+def addStoreLocation(storeName: str, latitude, longitude) -> None:
+    coordinates = _parseCoordinates(latitude, longitude)
+    with _gridLock:
+        if _grid is None or coordinates is None:
+            return
+        _grid.add(storeName, *coordinates)
+        if _addedDuringRefresh is not None:
+            _addedDuringRefresh.append((storeName, *coordinates))
+
+def getStoreDistances(location: Location, storeNames: Optional[set[str]] = None) -> dict[str, float]:
+    return getStoreGrid().distances(location, storeNames)
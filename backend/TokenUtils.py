@@ -1,64 +1,157 @@
 import logging
+import os
+import threading
+import time
+import uuid
 import jwt
 from dataclasses import dataclass
 import secrets
 from datetime import datetime, timedelta, timezone
+from typing import Optional
+from azure.core.exceptions import HttpResponseError, ResourceExistsError
 from schemaUtils import BaseEntity, createTableIfNotExists, getStoresTableName, writeEntityToTable, getTokensTableName
-from Store import Store
+from Store import Store, claimStoreEmail, getStoreEntity, invalidateStore, releaseStoreEmail
+from StoreLocator import addStoreLocation
 import azure.functions as func
 
 
-SECRET_KEY = secrets.token_hex(32)
 ALGORITHM = 'HS256'
+REVOKED_TOKENS_PARTITION = 'revoked'
 class TokenExpiredError(Exception):
     def __init__(self, message="Token has expired"):
         self.message = message
         super().__init__(self.message)
 
+class SigningKeyRing:
+    # Keys come from JwtSigningKeys as "kid:secret,kid:secret", JwtActiveKeyId picks the one that signs new tokens.
+    # Rotating is adding a new key, making it active, and dropping the old one once its tokens have expired.
+    def __init__(self, keys: dict[str, str], activeKeyId: str) -> None:
+        if activeKeyId not in keys:
+            raise ValueError(f"Active signing key {activeKeyId} is not in the key ring")
+        self.keys = keys
+        self.activeKeyId = activeKeyId
+
+    @staticmethod
+    def fromEnvironment() -> 'SigningKeyRing':
+        configured = os.getenv('JwtSigningKeys')
+        if not configured:
+            logging.warning("JwtSigningKeys is not set, tokens will only be valid on this instance")
+            return SigningKeyRing({'local': secrets.token_hex(32)}, 'local')
+        keys: dict[str, str] = {}
+        for entry in configured.split(','):
+            keyId, _, secret = entry.strip().partition(':')
+            if not keyId or not secret:
+                raise ValueError("JwtSigningKeys entries must look like kid:secret")
+            keys[keyId] = secret
+        return SigningKeyRing(keys, os.getenv('JwtActiveKeyId', next(iter(keys))))
+
+    def getKey(self, keyId: Optional[str]) -> str:
+        if keyId is None or keyId not in self.keys:
+            raise jwt.InvalidTokenError("Token signed with an unknown key")
+        return self.keys[keyId]
+
 @dataclass
-class TokenEntity(BaseEntity):
+class RevokedTokenEntity(BaseEntity):
+    TokenId: str
     StoreName: str
-    Token: str
+    Expiry: datetime
     def uid(self):
-        return self.StoreName
+        return REVOKED_TOKENS_PARTITION
+
+class RevocationList:
+    # In-memory denylist of revoked token ids, reloaded from the tokens table every TokenRevocationRefreshSeconds.
+    # Only the first load is waited for, later ones run in the background and a failed one keeps the last list
+    def __init__(self) -> None:
+        self.tokenIds: set[str] = set()
+        # Revoked by this worker while a load was running, the loaded list may not have them yet
+        self.addedDuringLoad: set[str] = set()
+        self.loadedAt: Optional[float] = None
+        self._lock = threading.Lock()
+        self._loadLock = threading.Lock()
+
+    def isRevoked(self, tokenId: str) -> bool:
+        refresh = float(os.getenv('TokenRevocationRefreshSeconds', '60'))
+        if self.loadedAt is None:
+            with self._loadLock:
+                if self.loadedAt is None:
+                    self._refresh()
+        elif time.monotonic() - self.loadedAt > refresh and self._loadLock.acquire(blocking=False):
+            threading.Thread(target=self._refreshInBackground, name="token-revocations", daemon=True).start()
+        with self._lock:
+            return tokenId in self.tokenIds
+
+    def add(self, tokenId: str) -> None:
+        with self._lock:
+            self.tokenIds.add(tokenId)
+            self.addedDuringLoad.add(tokenId)
+
+    def _refreshInBackground(self) -> None:
+        try:
+            self._refresh()
+        finally:
+            self._loadLock.release()
+
+    def _refresh(self) -> None:
+        with self._lock:
+            self.addedDuringLoad = set()
+        try:
+            tokenIds = self._load()
+            with self._lock:
+                self.tokenIds = tokenIds | self.addedDuringLoad
+        except HttpResponseError as e:
+            logging.warning(f"Could not reload revoked tokens, keeping the last list {e}")
+        finally:
+            # A failed load is retried after the refresh interval too, not by every request
+            self.loadedAt = time.monotonic()
+
+    def _load(self) -> set[str]:
+        _, table_client = createTableIfNotExists(getTokensTableName())
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        entities = table_client.query_entities(f"PartitionKey eq '{REVOKED_TOKENS_PARTITION}' and Expiry ge datetime'{now}'", select=['RowKey']) # type: ignore
+        return {entity['RowKey'] for entity in entities}
+
+_keyRing: Optional[SigningKeyRing] = None
+_revocationList = RevocationList()
+
+def getKeyRing() -> SigningKeyRing:
+    global _keyRing
+    if _keyRing is None:
+        _keyRing = SigningKeyRing.fromEnvironment()
+    return _keyRing
 
 class TokenCredentials():
     @staticmethod
     def create(storeName : str) -> str:
-        expiration = datetime.now(timezone.utc) + timedelta(days=1)
+        # Tokens are self contained, creating one needs no storage round trip
+        keyRing = getKeyRing()
+        now = datetime.now(timezone.utc)
+        expiration = now + timedelta(days=1)
         payload = {
             'store_name': storeName,
+            'jti': uuid.uuid4().hex,
+            'iat': int(now.timestamp()),
             'exp': expiration.timestamp()
         }
-        token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
-        TokenCredentials._storeToken(token,storeName)
+        token = jwt.encode(payload, keyRing.getKey(keyRing.activeKeyId), algorithm=ALGORITHM, headers={'kid': keyRing.activeKeyId})
         return token
     @staticmethod
     def _decode(token: str) -> dict:
-        decoded = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        keyId = jwt.get_unverified_header(token).get('kid')
+        decoded = jwt.decode(token, getKeyRing().getKey(keyId), algorithms=[ALGORITHM])
+        if _revocationList.isRevoked(decoded.get('jti', '')):
+            raise jwt.InvalidTokenError("Token has been revoked")
         return decoded
-     
+
     @staticmethod
-    def _storeToken(store_name: str, token: str):
-        storeUid = Store.uidFromName(store_name)
+    def revoke(decoded: dict) -> None:
         _, table_client = createTableIfNotExists(getTokensTableName())
-
-        existing_entities = table_client.query_entities(f"PartitionKey eq '{storeUid}'")
-        entity_list = list(existing_entities)
-
-        if entity_list:
-            logging.info(f"Updating the token for store {storeUid}.")
-            token_entity = entity_list[0]
-            token_entity['Token'] = token
-            table_client.update_entity(entity=token_entity, mode="replace")  
-            return
-
-        logging.info(f"Creating a new token for store {storeUid}.")
-        token_entity = TokenEntity(
-            StoreName=storeUid,
-            Token=token
+        revoked = RevokedTokenEntity(
+            TokenId=decoded['jti'],
+            StoreName=decoded['store_name'],
+            Expiry=datetime.fromtimestamp(decoded['exp'], timezone.utc)
         )
-        writeEntityToTable(token_entity, table_client)
+        table_client.upsert_entity(entity={**revoked.asdict(), 'PartitionKey': revoked.uid(), 'RowKey': revoked.TokenId}) # type: ignore
+        _revocationList.add(revoked.TokenId)
 
     @staticmethod
     def decodeRequestToken(req: func.HttpRequest) -> dict:
@@ -71,22 +164,31 @@ class TokenCredentials():
         return token
     
 def registerStore(store : Store) -> dict:
+    # Uniqueness comes from the keys: the email entity and the store entity both use deterministic keys,
+    # a concurrent registration of the same email or name fails on create instead of slipping past a query
     _,table_client = createTableIfNotExists(getStoresTableName())
-    with table_client as table:
-        existing_stores_by_name = table.query_entities(f"PartitionKey eq '{store.uid()}'")
-        existing_stores_by_email = table.query_entities(f"Email eq '{store.Email}'")
+    if getStoreEntity(store.StoreName):
+        raise ValueError("A store with this name already exists")  # Stores registered before names were keys
 
-        if list(existing_stores_by_name):
+    try:
+        claimStoreEmail(store)
+    except ResourceExistsError:
+        raise ValueError("A store with this email already exists")
+    try:
+        writeEntityToTable(store, table_client, rowKey=store.uid())
+    except Exception as e:
+        # The claim holds the password hash, left behind it would let login issue tokens for a store that doesn't exist
+        releaseStoreEmail(store.Email)
+        if isinstance(e, ResourceExistsError):
             raise ValueError("A store with this name already exists")
-
-        if list(existing_stores_by_email):
-            raise ValueError("A store with this email already exists")
-        writeEntityToTable(store, table)
-        token = TokenCredentials().create(store.StoreName)
-        return {
-            'message': f"Store {store.StoreName} registered successfully",
-            'token': token
-        }
+        raise
+    invalidateStore(store.StoreName)
+    addStoreLocation(store.StoreName, store.Latitude, store.Longitude)
+    token = TokenCredentials().create(store.StoreName)
+    return {
+        'message': f"Store {store.StoreName} registered successfully",
+        'token': token
+    }
         
                  
 
@@ -0,0 +1,260 @@
+from __future__ import annotations
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+# Lightweight request tracing: spans are aggregated per stage name and counters per key on the trace of the current
+# invocation, which follows the request through awaits and asyncio.to_thread via a context variable.
+# TracingExporters selects where finished traces go: "log" (default), "opentelemetry" or both comma separated, "none" to
+# disable. With opentelemetry every span is also an OpenTelemetry span when the package is installed.
+# ServerTimingEnabled=true adds the stages to the response as a Server-Timing header.
+
+class Trace:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.startedAt = time.perf_counter()
+        self.durationMs: Optional[float] = None
+        self.stages: dict[str, list[float]] = {}
+        self.counters: Counter[str] = Counter()
+        self.lock = threading.Lock()
+
+    def addSpan(self, name: str, durationMs: float) -> None:
+        with self.lock:
+            stage = self.stages.setdefault(name, [0, 0.0])
+            stage[0] += 1
+            stage[1] += durationMs
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self.lock:
+            self.counters[name] += value
+
+    def finish(self) -> None:
+        self.durationMs = (time.perf_counter() - self.startedAt) * 1000
+
+    def summary(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                "name": self.name,
+                "durationMs": round(self.durationMs or 0.0, 3),
+                # Concurrent spans of one stage overlap, their total can exceed the request's duration
+                "stages": {name: {"count": int(count), "durationMs": round(total, 3)} for name, (count, total) in sorted(self.stages.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def serverTiming(self) -> str:
+        with self.lock:
+            entries = [f'{name};dur={total:.1f};desc="{int(count)}x"' for name, (count, total) in sorted(self.stages.items())]
+        entries.append(f"total;dur={self.durationMs or 0.0:.1f}")
+        return ", ".join(entries)
+
+_currentTrace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("currentTrace", default=None)
+_tracer: Any = None
+_tracerLoaded = False
+_tracerLock = threading.Lock()
+
+def _getExporters() -> set[str]:
+    return {exporter.strip().lower() for exporter in os.getenv('TracingExporters', 'log').split(',') if exporter.strip()}
+
+def isServerTimingEnabled() -> bool:
+    return os.getenv('ServerTimingEnabled', 'false').lower() == 'true'
+
+def _getTracer() -> Any:
+    # Optional dependency, only imported when the opentelemetry exporter is configured
+    global _tracer, _tracerLoaded
+    if not _tracerLoaded:
+        with _tracerLock:
+            if not _tracerLoaded and 'opentelemetry' in _getExporters():
+                try:
+                    from opentelemetry import trace as otelTrace
+                    _tracer = otelTrace.get_tracer("medicine-locator")
+                except ImportError:
+                    logging.warning("TracingExporters includes opentelemetry but the opentelemetry package is not installed")
+            _tracerLoaded = True
+    return _tracer
+
+def currentTrace() -> Optional[Trace]:
+    return _currentTrace.get()
+
+@contextmanager
+def startTrace(name: str) -> Iterator[Trace]:
+    trace = Trace(name)
+    token = _currentTrace.set(trace)
+    tracer = _getTracer()
+    try:
+        if tracer is None:
+            yield trace
+        else:
+            with tracer.start_as_current_span(name) as rootSpan:
+                yield trace
+                for counter, value in trace.counters.items():
+                    rootSpan.set_attribute(counter, value)
+    finally:
+        trace.finish()
+        _currentTrace.reset(token)
+        if 'log' in _getExporters():
+            logging.info(f"Trace {json.dumps(trace.summary())}")
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[dict[str, Any]]:
+    # Times a stage of the current trace, the yielded attributes can be filled in and go to the OpenTelemetry span
+    trace = _currentTrace.get()
+    tracer = _getTracer()
+    if trace is None and tracer is None:
+        yield attributes
+        return
+    start = time.perf_counter()
+    try:
+        if tracer is None:
+            yield attributes
+        else:
+            with tracer.start_as_current_span(name) as otelSpan:
+                yield attributes
+                for key, value in attributes.items():
+                    otelSpan.set_attribute(key, value)
+    finally:
+        if trace is not None:
+            trace.addSpan(name, (time.perf_counter() - start) * 1000)
+
+def recordSpan(name: str, startedAt: float, **attributes: Any) -> None:
+    # For stages timed by the caller, startedAt is a time.perf_counter() reading
+    durationMs = (time.perf_counter() - startedAt) * 1000
+    trace = _currentTrace.get()
+    if trace is not None:
+        trace.addSpan(name, durationMs)
+    tracer = _getTracer()
+    if tracer is not None:
+        end = time.time_ns()
+        otelSpan = tracer.start_span(name, start_time=end - int(durationMs * 1_000_000), attributes=attributes)
+        otelSpan.end(end_time=end)
+
+def increment(name: str, value: float = 1) -> None:
+    trace = _currentTrace.get()
+    if trace is not None:
+        trace.increment(name, value)
+
+def recordCacheLookup(cache: str, hit: bool, size: int = 0) -> None:
+    increment(f"{cache}.{'hit' if hit else 'miss'}")
+    if size:
+        increment(f"{cache}.bytes", size)
+
+def addServerTiming(response: Any, trace: Trace) -> Any:
+    if isServerTimingEnabled():
+        response.headers['Server-Timing'] = trace.serverTiming()
+    return response
+
+# Table clients handed out by schemaUtils are wrapped so every storage round trip is a span and counted
+
+def _recordStorageCall(operation: str, table: str, startedAt: float, entities: int = 0) -> None:
+    recordSpan(f"storage.{operation}", startedAt, table=table, entities=entities)
+    increment("storage.roundTrips")
+    if entities:
+        increment("storage.entities", entities)
+
+class _TracedPages:
+    def __init__(self, pages: Any, table: str) -> None:
+        self.pages = pages
+        self.table = table
+
+    @property
+    def continuation_token(self) -> Any:
+        return self.pages.continuation_token
+
+    def __iter__(self) -> '_TracedPages':
+        return self
+
+    def __next__(self) -> Iterator[Any]:
+        startedAt = time.perf_counter()
+        page = list(next(self.pages))  # Running out of pages is not a round trip
+        _recordStorageCall("query", self.table, startedAt, len(page))
+        return iter(page)
+
+class _TracedPaged:
+    def __init__(self, paged: Any, table: str) -> None:
+        self.paged = paged
+        self.table = table
+
+    def by_page(self, continuation_token: Optional[str] = None) -> _TracedPages:
+        return _TracedPages(self.paged.by_page(continuation_token=continuation_token), self.table)
+
+    def __iter__(self) -> Iterator[Any]:
+        for page in self.by_page():
+            yield from page
+
+class TracedTableClient:
+    def __init__(self, table: Any) -> None:
+        self.table = table
+        self.tableName = getattr(table, 'table_name', '')
+
+    def query_entities(self, *args: Any, **kwargs: Any) -> _TracedPaged:
+        return _TracedPaged(self.table.query_entities(*args, **kwargs), self.tableName)
+
+    def list_entities(self, *args: Any, **kwargs: Any) -> _TracedPaged:
+        return _TracedPaged(self.table.list_entities(*args, **kwargs), self.tableName)
+
+    def __enter__(self) -> 'TracedTableClient':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.table, name)
+        if not callable(method):
+            return method
+        def traced(*args: Any, **kwargs: Any) -> Any:
+            startedAt = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                _recordStorageCall(name, self.tableName, startedAt)
+        return traced
+
+class TracedAsyncTableClient:
+    def __init__(self, table: Any) -> None:
+        self.table = table
+        self.tableName = getattr(table, 'table_name', '')
+
+    def query_entities(self, *args: Any, **kwargs: Any) -> Any:
+        return self._iterate(self.table.query_entities(*args, **kwargs))
+
+    def list_entities(self, *args: Any, **kwargs: Any) -> Any:
+        return self._iterate(self.table.list_entities(*args, **kwargs))
+
+    async def _iterate(self, paged: Any) -> Any:
+        # The aio pager fetches lazily, each page is timed as it arrives
+        pages = paged.by_page() if hasattr(paged, 'by_page') else None
+        if pages is None:
+            startedAt = time.perf_counter()
+            entities = [entity async for entity in paged]
+            _recordStorageCall("query", self.tableName, startedAt, len(entities))
+            for entity in entities:
+                yield entity
+            return
+        while True:
+            startedAt = time.perf_counter()
+            try:
+                page = await pages.__anext__()
+            except StopAsyncIteration:
+                return
+            entities = [entity async for entity in page]
+            _recordStorageCall("query", self.tableName, startedAt, len(entities))
+            for entity in entities:
+                yield entity
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.table, name)
+        if not callable(method):
+            return method
+        async def traced(*args: Any, **kwargs: Any) -> Any:
+            startedAt = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                _recordStorageCall(name, self.tableName, startedAt)
+        return traced
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Iterable
+
+# Local stand-ins for the Form Recognizer and Text Analytics clients, shaped like the parts of the SDK results the
+# pipeline reads. A synthetic "image" is the prescription text itself, every whitespace separated token is a word.
+# latencySeconds emulates the service round trip so the benchmark keeps the real proportions between stages.
+
+@dataclass
+class FakeWord:
+    content: str
+    confidence: float = 0.99
+
+@dataclass
+class FakeLine:
+    words: list[FakeWord]
+
+    def get_words(self) -> list[FakeWord]:
+        return self.words
+
+@dataclass
+class FakePage:
+    lines: list[FakeLine]
+
+@dataclass
+class FakeAnalyzeResult:
+    pages: list[FakePage]
+
+@dataclass
+class FakeHealthcareEntity:
+    text: str
+    category: str
+
+@dataclass
+class FakeHealthcareDocument:
+    entities: list[FakeHealthcareEntity]
+    is_error: bool = False
+
+@dataclass
+class ServiceCalls:
+    calls: int = 0
+    documents: int = 0
+
+    def record(self, documents: int) -> None:
+        self.calls += 1
+        self.documents += documents
+
+class _Poller:
+    def __init__(self, result: Any) -> None:
+        self._result = result
+
+    def result(self) -> Any:
+        return self._result
+
+class _AsyncPoller:
+    def __init__(self, result: Any) -> None:
+        self._result = result
+
+    async def result(self) -> Any:
+        return self._result
+
+class _AsyncResults:
+    def __init__(self, documents: list) -> None:
+        self.documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+def _readDocument(document: Any) -> FakeAnalyzeResult:
+    data = document.read() if hasattr(document, "read") else document
+    lines = [FakeLine([FakeWord(word) for word in line.split()]) for line in data.decode(errors="ignore").splitlines()]
+    return FakeAnalyzeResult(pages=[FakePage(lines=lines)])
+
+class FakeDocumentAnalysisClient:
+    def __init__(self, latencySeconds: float = 0.0) -> None:
+        self.latencySeconds = latencySeconds
+        self.usage = ServiceCalls()
+
+    def begin_analyze_document(self, model_id: str, document: Any, **kwargs: Any) -> _Poller:
+        self.usage.record(1)
+        time.sleep(self.latencySeconds)
+        return _Poller(_readDocument(document))
+
+class FakeAsyncDocumentAnalysisClient(FakeDocumentAnalysisClient):
+    async def begin_analyze_document(self, model_id: str, document: Any, **kwargs: Any) -> _AsyncPoller:  # type: ignore
+        self.usage.record(1)
+        await asyncio.sleep(self.latencySeconds)
+        return _AsyncPoller(_readDocument(document))
+
+class FakeTextAnalyticsClient:
+    # Recognizes exactly the words of the synthetic medication catalog as MedicationName entities
+    def __init__(self, medications: Iterable[str], latencySeconds: float = 0.0) -> None:
+        self.medications = {medication.lower() for medication in medications}
+        self.latencySeconds = latencySeconds
+        self.usage = ServiceCalls()
+
+    def _analyze(self, documents: list[Any]) -> list[FakeHealthcareDocument]:
+        self.usage.record(len(documents))
+        results = []
+        for document in documents:
+            text = document if isinstance(document, str) else document.get("text", "")
+            entities = [FakeHealthcareEntity(word, "MedicationName") for word in text.split() if word.lower() in self.medications]
+            results.append(FakeHealthcareDocument(entities=entities))
+        return results
+
+    def begin_analyze_healthcare_entities(self, documents: list[Any], **kwargs: Any) -> _Poller:
+        results = self._analyze(documents)
+        time.sleep(self.latencySeconds)
+        return _Poller(results)
+
+class FakeAsyncTextAnalyticsClient(FakeTextAnalyticsClient):
+    async def begin_analyze_healthcare_entities(self, documents: list[Any], **kwargs: Any) -> _AsyncPoller:  # type: ignore
+        results = self._analyze(documents)
+        await asyncio.sleep(self.latencySeconds)
+        return _AsyncPoller(_AsyncResults(results))
+
+@dataclass
+class FakeServices:
+    documentAnalysis: FakeDocumentAnalysisClient
+    asyncDocumentAnalysis: FakeAsyncDocumentAnalysisClient
+    textAnalytics: FakeTextAnalyticsClient
+    asyncTextAnalytics: FakeAsyncTextAnalyticsClient
+    registered: list[str] = field(default_factory=list)
+
+    def usage(self) -> dict[str, dict[str, int]]:
+        return {
+            "formRecognizer": {"calls": self.documentAnalysis.usage.calls + self.asyncDocumentAnalysis.usage.calls},
+            "textAnalytics": {
+                "calls": self.textAnalytics.usage.calls + self.asyncTextAnalytics.usage.calls,
+                "documents": self.textAnalytics.usage.documents + self.asyncTextAnalytics.usage.documents,
+            },
+        }
+
+    def reset(self) -> None:
+        for client in (self.documentAnalysis, self.asyncDocumentAnalysis, self.textAnalytics, self.asyncTextAnalytics):
+            client.usage = ServiceCalls()
+
+def installFakeServices(medications: Iterable[str], ocrLatencySeconds: float = 0.0, nerLatencySeconds: float = 0.0) -> FakeServices:
+    # Registers the fakes in the worker's client pool, the factories in schemaUtils then hand them out instead of the SDK clients
+    from schemaUtils import _putClientIfAbsent
+    medications = list(medications)
+    services = FakeServices(
+        documentAnalysis=FakeDocumentAnalysisClient(ocrLatencySeconds),
+        asyncDocumentAnalysis=FakeAsyncDocumentAnalysisClient(ocrLatencySeconds),
+        textAnalytics=FakeTextAnalyticsClient(medications, nerLatencySeconds),
+        asyncTextAnalytics=FakeAsyncTextAnalyticsClient(medications, nerLatencySeconds),
+    )
+    for key, client in (("formRecognizer", services.documentAnalysis), ("aio:formRecognizer", services.asyncDocumentAnalysis),
+                        ("textAnalytics", services.textAnalytics), ("aio:textAnalytics", services.asyncTextAnalytics)):
+        _putClientIfAbsent(key, client)
+        services.registered.append(key)
+    return services
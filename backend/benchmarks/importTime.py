@@ -0,0 +1,64 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures how long importing each function's entry module takes in a fresh interpreter, which is what a cold start pays.
+# Usage: python benchmarks/importTime.py [--runs 5] [--output results.json] [--baseline previous.json --tolerance 0.2]
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_MEASURE = """
+import importlib, sys, time
+sys.path.insert(0, {backend!r})
+start = time.perf_counter()
+importlib.import_module({function!r})
+print((time.perf_counter() - start) * 1000)
+"""
+
+def findFunctions() -> list[str]:
+    return sorted(name for name in os.listdir(BACKEND_DIR) if os.path.isfile(os.path.join(BACKEND_DIR, name, "function.json")))
+
+def measureImport(function: str) -> float:
+    result = subprocess.run([sys.executable, "-c", _MEASURE.format(backend=BACKEND_DIR, function=function)],
+                            cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def measureAll(functions: list[str], runs: int) -> dict[str, dict[str, float]]:
+    results: dict[str, dict[str, float]] = {}
+    for function in functions:
+        samples = [measureImport(function) for _ in range(runs)]
+        results[function] = {"medianMs": round(statistics.median(samples), 2), "minMs": round(min(samples), 2), "maxMs": round(max(samples), 2)}
+    return results
+
+def findRegressions(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]], tolerance: float) -> list[str]:
+    regressions = []
+    for function, result in results.items():
+        previous = baseline.get(function)
+        if previous and result["medianMs"] > previous["medianMs"] * (1 + tolerance):
+            regressions.append(f"{function}: {previous['medianMs']}ms -> {result['medianMs']}ms")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold import time of every function")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown against the baseline")
+    parser.add_argument("functions", nargs="*", help="functions to measure, all of them by default")
+    args = parser.parse_args()
+
+    results = measureAll(args.functions or findFunctions(), args.runs)
+    for function, result in results.items():
+        print(f"{function:<20} median {result['medianMs']:>8.1f}ms  min {result['minMs']:>8.1f}ms  max {result['maxMs']:>8.1f}ms")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            regressions = findRegressions(results, json.load(baselineFile), args.tolerance)
+        for regression in regressions:
+            print(f"Import time regression {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,374 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import importlib
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Callable, Optional
+
+# Drives the HTTP functions through their main entry points against the SQLite storage backend and local stand-ins
+# for Form Recognizer and Text Analytics, on synthetic pharmacies, inventories and prescriptions.
+# Usage: python benchmarks/loadTest.py [--stores 10000 --batches 1000000] [--requests 500 --concurrency 8]
+#        [--output results.json] [--baseline previous.json --tolerance 0.2] [AddMedicine LocateMedicine ...]
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ENDPOINTS = ["RegisterStore", "login", "AddMedicine", "CheckoutMedicine", "LocateMedicine"]
+PASSWORD = "benchmark-password"
+FILLER_WORDS = ["take", "tablet", "daily", "twice", "morning", "evening", "after", "meals", "refill", "doctor"]
+SEED_CHUNK = 20000
+
+def configureEnvironment(databasePath: str) -> None:
+    os.environ.update({
+        "StorageBackend": "sqlite",
+        "SqliteDatabasePath": databasePath,
+        "StoresTableName": "BenchStores",
+        "MedicineTableName": "BenchMedicine",
+        "TokensTableName": "BenchTokens",
+        "JwtSigningKeys": "bench:" + "b" * 64,
+        "JwtActiveKeyId": "bench",
+        "FormRecogniserEndpoint": "https://formrecognizer.invalid/",
+        "FormRecogniserKey": "benchmark",
+        "TextAnalyticsEndpoint": "https://textanalytics.invalid/",
+        "TextAnalyticsKey": "benchmark",
+    })
+    for path in (BACKEND_DIR, BENCHMARK_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+def medicationCatalog(count: int, rng: random.Random) -> list[str]:
+    # Alphabetic names, the analyzer drops any word with digits or punctuation before it reaches text analytics
+    syllables = ["ab", "ac", "al", "am", "ar", "ba", "ce", "da", "do", "fe", "gi", "la", "lo", "ma", "mi", "na",
+                 "ne", "ol", "pa", "pro", "ra", "ri", "sa", "ta", "ti", "to", "va", "xa", "ze", "zo"]
+    names: set[str] = set()
+    while len(names) < count:
+        names.add("".join(rng.choice(syllables) for _ in range(rng.randint(3, 5))) + rng.choice(["ol", "in", "ex", "ide", "ax"]))
+    return sorted(names)
+
+@dataclass
+class Dataset:
+    stores: list[dict[str, Any]]
+    medications: list[str]
+    weights: list[float]
+    batches: list[dict[str, Any]]
+    # Remaining stock of every batch as the generated checkouts see it, so checkouts stay valid
+    stock: dict[tuple[str, str, str], int] = field(default_factory=dict)
+
+def generateDataset(stores: int, batches: int, medications: int, rng: random.Random) -> Dataset:
+    catalog = medicationCatalog(medications, rng)
+    # Prescriptions and inventories both favour common medications, like real ones
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(len(catalog))]
+    storeList = [{
+        "StoreName": f"bench-store-{index}",
+        "Email": f"store{index}@bench.example",
+        "ContactNumber": f"05{index:08d}",
+        "Latitude": str(round(rng.uniform(29.5, 33.3), 5)),
+        "Longitude": str(round(rng.uniform(34.3, 35.9), 5)),
+    } for index in range(stores)]
+    today = date.today()
+    batchList = []
+    stock: dict[tuple[str, str, str], int] = {}
+    for index in range(batches):
+        store = rng.choice(storeList)["StoreName"]
+        medication = rng.choices(catalog, weights)[0]
+        quantity = rng.choice([0] + [rng.randint(1, 50)] * 9)
+        expiry = today + timedelta(days=rng.randint(-60, 720))
+        batch = {"StoreName": store, "MedicineName": medication, "BatchNumber": f"b{index}", "ExpiryDate": expiry.isoformat(), "Quantity": quantity}
+        batchList.append(batch)
+        stock[(store, medication, batch["BatchNumber"])] = quantity
+    return Dataset(stores=storeList, medications=catalog, weights=weights, batches=batchList, stock=stock)
+
+def seedStorage(dataset: Dataset) -> None:
+    from schemaUtils import createTableIfNotExists, getMedicineIndexTableName, getMedicineTableName, getStoreEmailsTableName, getStoresTableName, toTableEntity
+    from Medicine import Medicine, toMedicineIndexEntity
+    from Store import STORE_EMAIL_ROW_KEY, Store, StoreEmailEntity
+    passwordHash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    _, storesTable = createTableIfNotExists(getStoresTableName())
+    _, emailsTable = createTableIfNotExists(getStoreEmailsTableName())
+    _, medicineTable = createTableIfNotExists(getMedicineTableName())
+    _, indexTable = createTableIfNotExists(getMedicineIndexTableName())
+    stores = [Store(Password=passwordHash, **store) for store in dataset.stores]
+    storesTable.bulkInsert(toTableEntity(store, rowKey=store.uid()) for store in stores)  # type: ignore
+    emailsTable.bulkInsert(toTableEntity(StoreEmailEntity(Email=store.Email, StoreName=store.StoreName, Password=passwordHash), rowKey=STORE_EMAIL_ROW_KEY)  # type: ignore
+                           for store in stores)
+    for start in range(0, len(dataset.batches), SEED_CHUNK):
+        medicines = [Medicine(MedicineNamePretty=batch["MedicineName"].capitalize(), Manufacturer="Bench Pharma", Price=9.9, **batch)
+                     for batch in dataset.batches[start:start + SEED_CHUNK]]
+        entities = [toTableEntity(medicine, rowKey=medicine.rowKey()) for medicine in medicines]
+        medicineTable.bulkInsert(entities)  # type: ignore
+        indexTable.bulkInsert(toMedicineIndexEntity(entity) for entity in entities)  # type: ignore
+
+class StorageCallCounter:
+    # Counts every table and blob operation by table/container and operation name
+    def __init__(self) -> None:
+        self.counts: Counter[str] = Counter()
+        self.lock = threading.Lock()
+
+    def install(self) -> None:
+        from SqliteStorage import SqliteBlobClient, SqliteTableClient
+        for name in ("query_entities", "list_entities", "get_entity", "create_entity", "update_entity",
+                     "upsert_entity", "delete_entity", "submit_transaction"):
+            self._wrap(SqliteTableClient, name, lambda client: client.table_name)
+        for name in ("download_blob", "upload_blob", "delete_blob"):
+            self._wrap(SqliteBlobClient, name, lambda client: client.container_name)
+
+    def _wrap(self, cls: type, name: str, target: Callable[[Any], str]) -> None:
+        original = getattr(cls, name)
+        counter = self
+
+        def counted(client: Any, *args: Any, **kwargs: Any) -> Any:
+            with counter.lock:
+                counter.counts[f"{target(client)}.{name}"] += 1
+            return original(client, *args, **kwargs)
+        setattr(cls, name, counted)
+
+    def take(self) -> Counter[str]:
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+def makeRequest(function: str, body: dict[str, Any], token: Optional[str] = None):
+    import azure.functions as func
+    headers = {"Content-Type": "application/json"}
+    if token is not None:
+        headers["Authorization"] = f"Bearer {token}"
+    return func.HttpRequest(method="POST", url=f"/api/{function}", headers=headers, params={}, body=json.dumps(body).encode())
+
+class RequestFactory:
+    def __init__(self, dataset: Dataset, rng: random.Random, args: argparse.Namespace) -> None:
+        from TokenUtils import TokenCredentials
+        self.dataset = dataset
+        self.rng = rng
+        self.args = args
+        self.tokens: dict[str, str] = {}
+        self.createToken = TokenCredentials.create
+        self.prescriptions = [self._prescription() for _ in range(max(1, math.ceil(args.requests * args.unique_prescriptions)))]
+
+    def token(self, storeName: str) -> str:
+        if storeName not in self.tokens:
+            self.tokens[storeName] = self.createToken(storeName)
+        return self.tokens[storeName]
+
+    def build(self, endpoint: str, index: int):
+        return getattr(self, f"_{endpoint}")(index)
+
+    def _RegisterStore(self, index: int):
+        return makeRequest("RegisterStore", {
+            "storeName": f"bench-new-store-{index}", "email": f"new{index}@bench.example", "contactNumber": "0500000000",
+            "latitude": str(round(self.rng.uniform(29.5, 33.3), 5)), "longitude": str(round(self.rng.uniform(34.3, 35.9), 5)),
+            "password": PASSWORD,
+        })
+
+    def _login(self, index: int):
+        store = self.rng.choice(self.dataset.stores)
+        return makeRequest("login", {"email": store["Email"], "password": PASSWORD})
+
+    def _AddMedicine(self, index: int):
+        store = self.rng.choice(self.dataset.stores)["StoreName"]
+        items = []
+        for _ in range(self.args.cart_size):
+            medication = self.rng.choices(self.dataset.medications, self.dataset.weights)[0]
+            # Mostly restocks of a handful of batch numbers per medication, sometimes a new batch
+            batch = f"r{self.rng.randint(0, 3)}" if self.rng.random() < 0.8 else f"n{index}-{len(items)}"
+            items.append(self._item(medication, batch, self.rng.randint(1, 10)))
+        return makeRequest("AddMedicine", {"items": items}, self.token(store))
+
+    def _CheckoutMedicine(self, index: int):
+        # A cart of in stock batches of one store, the generated stock is decremented so later carts stay valid
+        for _ in range(100):
+            batch = self.rng.choice(self.dataset.batches)
+            if self.dataset.stock[(batch["StoreName"], batch["MedicineName"], batch["BatchNumber"])] > 0:
+                break
+        store = batch["StoreName"]
+        candidates = [batch] + [other for other in self.rng.sample(self.dataset.batches, min(len(self.dataset.batches), 200))
+                                if other["StoreName"] == store and other is not batch]
+        items = []
+        for candidate in candidates[:self.args.cart_size]:
+            key = (candidate["StoreName"], candidate["MedicineName"], candidate["BatchNumber"])
+            if self.dataset.stock[key] > 0:
+                self.dataset.stock[key] -= 1
+                items.append(self._item(candidate["MedicineName"], candidate["BatchNumber"], 1, candidate["ExpiryDate"]))
+        return makeRequest("CheckoutMedicine", {"items": items or [self._item(batch["MedicineName"], batch["BatchNumber"], 1)]}, self.token(store))
+
+    def _LocateMedicine(self, index: int):
+        text = self.rng.choice(self.prescriptions)
+        store = self.rng.choice(self.dataset.stores)
+        body = {
+            "imageData": base64.b64encode(text.encode()).decode(), "imageName": f"prescription-{index}.jpg",
+            "latitude": float(store["Latitude"]) + self.rng.uniform(-self.args.user_spread, self.args.user_spread),
+            "longitude": float(store["Longitude"]) + self.rng.uniform(-self.args.user_spread, self.args.user_spread),
+        }
+        if self.args.radius_km:
+            body["radiusKm"] = self.args.radius_km
+        if self.args.upload == "json":
+            return makeRequest("LocateMedicine", body)
+        import azure.functions as func
+        params = {key: str(value) for key, value in body.items() if key not in ("imageData", "imageName")}
+        params["imageName"] = body["imageName"]
+        if self.args.upload == "binary":
+            return func.HttpRequest(method="POST", url="/api/LocateMedicine", headers={"Content-Type": "application/octet-stream"},
+                                    params=params, body=text.encode())
+        boundary = f"bench{index}"
+        form = (f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{body["imageName"]}"\r\n'
+                f'Content-Type: image/jpeg\r\n\r\n{text}\r\n--{boundary}--\r\n')
+        return func.HttpRequest(method="POST", url="/api/LocateMedicine", headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+                                params=params, body=form.encode())
+
+    def _prescription(self) -> str:
+        count = self.rng.randint(1, self.args.prescription_size)
+        medications = {self.rng.choices(self.dataset.medications, self.dataset.weights)[0] for _ in range(count)}
+        lines = [f"{medication.capitalize()} {' '.join(self.rng.sample(FILLER_WORDS, 3))}" for medication in medications]
+        return "\n".join(["Prescription", *lines])
+
+    def _item(self, medication: str, batch: str, quantity: int, expiry: Optional[str] = None) -> dict[str, Any]:
+        return {"medicineName": medication, "manufacturer": "Bench Pharma", "batchNumber": batch, "price": 9.9,
+                "expiryDate": expiry or (date.today() + timedelta(days=365)).isoformat(), "quantity": quantity}
+
+def percentile(samples: list[float], percent: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+def summarize(latencies: list[float], statuses: Counter, elapsed: float, storageCalls: Counter, services: dict) -> dict[str, Any]:
+    requests = len(latencies)
+    return {
+        "requests": requests,
+        "statusCodes": {str(status): count for status, count in sorted(statuses.items())},
+        "throughputPerSecond": round(requests / elapsed, 2) if elapsed else 0.0,
+        "latencyMs": {
+            "p50": round(percentile(latencies, 50), 3), "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3), "mean": round(sum(latencies) / requests, 3), "max": round(max(latencies), 3),
+        },
+        "storageCalls": {"total": sum(storageCalls.values()), "perRequest": round(sum(storageCalls.values()) / requests, 2),
+                         "byOperation": dict(sorted(storageCalls.items()))},
+        "services": services,
+    }
+
+def runSync(main: Callable, requests: list, concurrency: int) -> tuple[list[float], Counter, float]:
+    def call(req) -> tuple[float, int]:
+        start = time.perf_counter()
+        response = main(req)
+        return (time.perf_counter() - start) * 1000, response.status_code
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, requests))
+    return [latency for latency, _ in results], Counter(status for _, status in results), time.perf_counter() - start
+
+def runAsync(main: Callable, requests: list, concurrency: int) -> tuple[list[float], Counter, float]:
+    async def runAll() -> list[tuple[float, int]]:
+        limit = asyncio.Semaphore(concurrency)
+
+        async def call(req) -> tuple[float, int]:
+            async with limit:
+                start = time.perf_counter()
+                response = await main(req)
+                return (time.perf_counter() - start) * 1000, response.status_code
+        return await asyncio.gather(*(call(req) for req in requests))
+    start = time.perf_counter()
+    results = asyncio.run(runAll())
+    return [latency for latency, _ in results], Counter(status for _, status in results), time.perf_counter() - start
+
+def runEndpoint(endpoint: str, factory: RequestFactory, counter: StorageCallCounter, services: Any, args: argparse.Namespace) -> dict[str, Any]:
+    main = importlib.import_module(endpoint).main
+    run = runAsync if asyncio.iscoroutinefunction(main) else runSync
+    warmup = [factory.build(endpoint, index) for index in range(args.warmup)]
+    requests = [factory.build(endpoint, args.warmup + index) for index in range(args.requests)]
+    if warmup:
+        run(main, warmup, args.concurrency)
+    counter.take()
+    services.reset()
+    latencies, statuses, elapsed = run(main, requests, args.concurrency)
+    return summarize(latencies, statuses, elapsed, counter.take(), services.usage())
+
+def currentCommit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def findRegressions(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    regressions = []
+    for endpoint, result in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if previous and result["latencyMs"]["p95"] > previous["latencyMs"]["p95"] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {previous['latencyMs']['p95']}ms -> {result['latencyMs']['p95']}ms")
+    return regressions
+
+def runBenchmark(args: argparse.Namespace) -> dict[str, Any]:
+    databasePath = args.database or os.path.join(tempfile.mkdtemp(prefix="medicine-bench-"), "storage.db")
+    configureEnvironment(databasePath)
+    from fakes import installFakeServices
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    dataset = generateDataset(args.stores, args.batches, args.medications, rng)
+    seedStorage(dataset)
+    os.environ["AvailabilitySnapshotEnabled"] = "true" if args.snapshot else "false"
+    if args.snapshot:
+        from AvailabilitySnapshot import rebuildAvailabilitySnapshot
+        rebuildAvailabilitySnapshot()
+    seedSeconds = time.perf_counter() - started
+    services = installFakeServices(dataset.medications, args.ocr_latency_ms / 1000, args.ner_latency_ms / 1000)
+    counter = StorageCallCounter()
+    counter.install()
+    factory = RequestFactory(dataset, rng, args)
+    endpoints = {endpoint: runEndpoint(endpoint, factory, counter, services, args) for endpoint in args.endpoints or ENDPOINTS}
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "endpoints")}
+    return {"commit": currentCommit(), "config": {**config, "database": databasePath}, "seedSeconds": round(seedSeconds, 2), "endpoints": endpoints}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the HTTP functions against local storage and service stand-ins")
+    parser.add_argument("--stores", type=int, default=500)
+    parser.add_argument("--batches", type=int, default=50000)
+    parser.add_argument("--medications", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per endpoint sent first")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--cart-size", type=int, default=3)
+    parser.add_argument("--prescription-size", type=int, default=4, help="most medications on one prescription")
+    parser.add_argument("--unique-prescriptions", type=float, default=0.5, help="distinct prescriptions as a fraction of LocateMedicine requests")
+    parser.add_argument("--radius-km", type=float, default=None)
+    parser.add_argument("--upload", choices=["json", "binary", "multipart"], default="json", help="how LocateMedicine sends the image")
+    parser.add_argument("--user-spread", type=float, default=0.05, help="degrees users are scattered around a store, 0 puts them at the store")
+    parser.add_argument("--ocr-latency-ms", type=float, default=0.0)
+    parser.add_argument("--ner-latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--snapshot", action="store_true", help="build the availability snapshot after seeding and locate through it")
+    parser.add_argument("--database", help="SQLite file to use, a fresh temporary one by default")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative p95 slowdown against the baseline")
+    parser.add_argument("--verbose", action="store_true", help="keep the functions' own logging")
+    parser.add_argument("endpoints", nargs="*", help=f"endpoints to run out of {', '.join(ENDPOINTS)}, all of them by default")
+    args = parser.parse_args()
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints {', '.join(sorted(unknown))}")
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    results = runBenchmark(args)
+    for endpoint, result in results["endpoints"].items():
+        latency = result["latencyMs"]
+        print(f"{endpoint:<18} {result['throughputPerSecond']:>9.1f} req/s  p50 {latency['p50']:>8.2f}ms  p95 {latency['p95']:>8.2f}ms  "
+              f"p99 {latency['p99']:>8.2f}ms  storage calls/req {result['storageCalls']['perRequest']:>6.2f}  {result['statusCodes']}")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            regressions = findRegressions(results, json.load(baselineFile), args.tolerance)
+        for regression in regressions:
+            print(f"Latency regression {regression}")
+        sys.exit(1 if regressions else 0)
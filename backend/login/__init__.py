@@ -2,7 +2,7 @@ import json
 import logging
 import hashlib
 import azure.functions as func
-from schemaUtils import createTableIfNotExists, getStoresTableName
+from Store import getStoreLoginByEmail
 from TokenUtils import TokenCredentials
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
@@ -18,14 +18,11 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype='application/json'
             )
         password_hash = hashlib.sha256(password.encode()).hexdigest()
-        _, table_client = createTableIfNotExists(getStoresTableName())
-        stores = table_client.query_entities(f"Email eq '{email}'")
-        store_list = list(stores)
+        store_entity = getStoreLoginByEmail(email)
 
-        if not store_list:
+        if not store_entity:
             return func.HttpResponse(json.dumps({'error': 'Invalid email. Please try again.'}), status_code=401, mimetype='application/json')
 
-        store_entity = store_list[0]
         if store_entity['Password'] != password_hash:
            return func.HttpResponse('{"error": "Incorrect Password. Please try again."}',
                                      status_code=401,
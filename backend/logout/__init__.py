@@ -0,0 +1,26 @@
+import logging
+import azure.functions as func
+from azure.core.exceptions import HttpResponseError
+import jwt
+from TokenUtils import TokenCredentials
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    # Revokes the request's token on every worker, it is rejected from now on even though it hasn't expired
+    try:
+        token = TokenCredentials.decodeRequestToken(req)
+        TokenCredentials.revoke(token)
+        return func.HttpResponse("Logged out", status_code=200)
+    except ValueError as e:
+        logging.error(f"ValueError: {e}")
+        return func.HttpResponse(str(e), status_code=400)
+    except HttpResponseError as e:
+        logging.error(f"Could not revoke token {e}")
+        return func.HttpResponse(f"Server communication went wrong", status_code=500)
+    except jwt.ExpiredSignatureError as e:
+        return func.HttpResponse(f"Expired Token", status_code=401)
+    except jwt.InvalidTokenError as e:
+        logging.error(f"Bad Token {e}")
+        return func.HttpResponse(f"Invalid Token", status_code=401)
+    except Exception as e:
+        logging.error(f"Exception: {e}")
+        return func.HttpResponse(f"Something went wrong", status_code=500)
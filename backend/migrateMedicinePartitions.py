@@ -0,0 +1,117 @@
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+from azure.data.tables import TableClient, TableTransactionError
+from Medicine import MAX_PARALLEL_TRANSACTIONS, isLegacyMedicineEntity, toStoreMedicineEntity
+from schemaUtils import MAX_BATCH_OPERATIONS, chunked, createTableIfNotExists, getMedicineTableName
+
+# Moves Medicine rows written before inventory was partitioned by store, one partition per batch keyed
+# store_medicine_batch, into their store's partition keyed medicine_batch. The table is streamed a page at a time, the
+# rows of a page are copied in one transaction per store and chunk, then the old rows are deleted if unchanged. The
+# function app keeps serving meanwhile if MedicineLegacyKeysEnabled is turned on for the migration, it then moves a
+# batch itself when it finds it only under its old key; turn it off again once a run finds nothing left to move. The
+# continuation token is saved after every page so --resume picks up where an interrupted run stopped, starting over
+# is safe as well.
+# Usage (with the same settings as the function app): python migrateMedicinePartitions.py [--dry-run] [--resume]
+
+PAGE_SIZE = 1000
+DEFAULT_CHECKPOINT = 'medicine-partitions.checkpoint.json'
+
+class PartitionMigrationReport:
+    def __init__(self) -> None:
+        self.scanned = 0
+        self.moved = 0
+        self.alreadyMoved = 0
+        self.conflicts = 0
+
+    def asdict(self) -> dict:
+        return {'scanned': self.scanned, 'moved': self.moved, 'alreadyMoved': self.alreadyMoved, 'conflicts': self.conflicts}
+
+    def __str__(self) -> str:
+        return f"scanned {self.scanned}, moved {self.moved}, already moved {self.alreadyMoved}, conflicts {self.conflicts}"
+
+def loadCheckpoint(path: str) -> tuple[Any, PartitionMigrationReport]:
+    report = PartitionMigrationReport()
+    if not os.path.exists(path):
+        return None, report
+    with open(path) as checkpoint:
+        state = json.load(checkpoint)
+    for name, value in state['report'].items():
+        setattr(report, name, value)
+    return state['continuationToken'], report
+
+def saveCheckpoint(path: str, continuationToken: Any, report: PartitionMigrationReport) -> None:
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as checkpoint:
+        json.dump({'continuationToken': continuationToken, 'report': report.asdict()}, checkpoint)
+    os.replace(temporary, path)
+
+def _copyPartition(table: TableClient, entities: list[dict], report: PartitionMigrationReport) -> None:
+    for chunk in chunked(entities, MAX_BATCH_OPERATIONS):
+        try:
+            table.submit_transaction([("create", entity) for entity in chunk]) # type: ignore
+            report.moved += len(chunk)
+            continue
+        except TableTransactionError as e:
+            if e.status_code != 409:
+                raise
+        # The app already moved some of these, its copies are kept as they may have changed since
+        for entity in chunk:
+            try:
+                table.create_entity(entity=entity) # type: ignore
+                report.moved += 1
+            except ResourceExistsError:
+                report.alreadyMoved += 1
+
+def _deleteLegacy(table: TableClient, legacy) -> bool:
+    try:
+        table.delete_entity(partition_key=legacy['PartitionKey'], row_key=legacy['RowKey'], etag=legacy.metadata['etag'], match_condition=MatchConditions.IfNotModified) # type: ignore
+        return True
+    except ResourceModifiedError:
+        logging.warning(f"Legacy medicine row {legacy['PartitionKey']} changed after it was copied, it is kept")
+        return False
+
+def migratePage(table: TableClient, entities: list, report: PartitionMigrationReport, dryRun: bool) -> None:
+    report.scanned += len(entities)
+    legacy = [entity for entity in entities if isLegacyMedicineEntity(entity)]
+    if dryRun:
+        report.moved += len(legacy)
+        return
+    partitions: dict[str, list[dict]] = {}
+    for entity in legacy:
+        moved = toStoreMedicineEntity(entity)
+        partitions.setdefault(moved['PartitionKey'], []).append(moved)
+    for entities in partitions.values():
+        _copyPartition(table, entities, report)
+    # Every legacy row is a partition of its own, they can only be deleted one call each
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_TRANSACTIONS) as executor:
+        report.conflicts += sum(not deleted for deleted in executor.map(lambda entity: _deleteLegacy(table, entity), legacy))
+
+def migrateMedicinePartitions(table: TableClient, checkpoint: Optional[str] = None, resume: bool = False, dryRun: bool = False) -> PartitionMigrationReport:
+    continuationToken, report = loadCheckpoint(checkpoint) if checkpoint and resume else (None, PartitionMigrationReport())
+    pages = table.list_entities(results_per_page=PAGE_SIZE).by_page(continuation_token=continuationToken) # type: ignore
+    for page in pages:
+        migratePage(table, list(page), report, dryRun)
+        if checkpoint and not dryRun:
+            saveCheckpoint(checkpoint, pages.continuation_token, report)
+        logging.info(f"Medicine partitions: {report}")
+    if checkpoint and not dryRun and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    if report.moved == 0 and report.conflicts == 0:
+        logging.info("No legacy medicine rows are left, MedicineLegacyKeysEnabled can be turned off")
+    return report
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Move Medicine rows from one partition per batch to one partition per store")
+    parser.add_argument("--dry-run", action="store_true", help="only count the rows that would be moved")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoint of an interrupted run")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="file the progress is saved to after every page")
+    args = parser.parse_args()
+    _, table = createTableIfNotExists(getMedicineTableName())
+    logging.info(f"Medicine partitions migrated: {migrateMedicinePartitions(table, args.checkpoint, args.resume, args.dry_run)}")
@@ -0,0 +1,85 @@
+import argparse
+import logging
+from typing import Any, Callable, Optional
+from azure.core import MatchConditions
+from azure.data.tables import TableClient, TableTransactionError, UpdateMode
+from Medicine import toExpiryDatetime
+from schemaUtils import MAX_BATCH_OPERATIONS, createTableIfNotExists, getMedicineIndexTableName, getMedicineTableName
+
+# Converts Quantity, Price and ExpiryDate written as strings by earlier versions to typed Int32, Double and DateTime
+# properties, so availability filters see every row. Rows already typed are skipped, an interrupted run can simply be
+# repeated, rows changed concurrently are reported as conflicts and picked up by the next run.
+# Usage (with the same settings as the function app): python migrateTypedProperties.py [--dry-run]
+
+def _toInt(value: Any) -> int:
+    return int(float(value))
+
+CONVERSIONS: dict[str, Callable[[Any], Any]] = {
+    'Quantity': _toInt,
+    'Price': float,
+    'ExpiryDate': toExpiryDatetime,
+}
+
+def typedChanges(entity: dict) -> Optional[dict]:
+    # The converted properties of an entity, None when there is nothing to convert
+    changes = {}
+    for name, convert in CONVERSIONS.items():
+        value = entity.get(name)
+        if isinstance(value, str):
+            changes[name] = convert(value)
+    return changes or None
+
+class MigrationReport:
+    def __init__(self) -> None:
+        self.scanned = 0
+        self.converted = 0
+        self.conflicts = 0
+        self.invalid = 0
+
+    def __str__(self) -> str:
+        return f"scanned {self.scanned}, converted {self.converted}, conflicts {self.conflicts}, invalid {self.invalid}"
+
+def _flush(table: TableClient, operations: list, report: MigrationReport, dryRun: bool) -> None:
+    if not operations:
+        return
+    if dryRun:
+        report.converted += len(operations)
+        return
+    try:
+        table.submit_transaction(operations) # type: ignore
+        report.converted += len(operations)
+    except TableTransactionError as e:
+        if e.status_code not in (409, 412):
+            raise
+        report.conflicts += len(operations)
+
+def migrateTable(table: TableClient, dryRun: bool = False) -> MigrationReport:
+    report = MigrationReport()
+    pending: dict[str, list] = {}
+    for entity in table.list_entities():
+        report.scanned += 1
+        try:
+            changes = typedChanges(entity)
+        except ValueError as e:
+            logging.warning(f"Skipping {entity['PartitionKey']}/{entity['RowKey']}: {e}")
+            report.invalid += 1
+            continue
+        if changes is None:
+            continue
+        update = {'PartitionKey': entity['PartitionKey'], 'RowKey': entity['RowKey'], **changes}
+        partition = pending.setdefault(entity['PartitionKey'], [])
+        partition.append(("update", update, {"mode": UpdateMode.MERGE, "etag": entity.metadata['etag'], "match_condition": MatchConditions.IfNotModified}))
+        if len(partition) == MAX_BATCH_OPERATIONS:
+            _flush(table, pending.pop(entity['PartitionKey']), report, dryRun)
+    for operations in pending.values():
+        _flush(table, operations, report, dryRun)
+    return report
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Convert string Quantity, Price and ExpiryDate properties to typed values")
+    parser.add_argument("--dry-run", action="store_true", help="only count the rows that would be converted")
+    args = parser.parse_args()
+    for tableName in (getMedicineTableName(), getMedicineIndexTableName()):
+        _, table = createTableIfNotExists(tableName)
+        logging.info(f"{tableName}: {migrateTable(table, args.dry_run)}")
@@ -0,0 +1,51 @@
+import argparse
+import logging
+from azure.data.tables import TableClient, UpdateMode
+from Medicine import toMedicineIndexEntity
+from schemaUtils import MAX_BATCH_OPERATIONS, createTableIfNotExists, getMedicineIndexTableName, getMedicineTableName
+
+# Backfills the MedicineName index from the Medicine table, e.g. for inventory written before the index existed.
+# Usage (with the same settings as the function app): python rebuildMedicineIndex.py [--prune]
+
+def _flush(index_table: TableClient, operations: list) -> int:
+    if operations:
+        index_table.submit_transaction(operations) # type: ignore
+    return len(operations)
+
+def rebuildMedicineIndex(prune: bool = False) -> tuple[int, int]:
+    _, medicine_table = createTableIfNotExists(getMedicineTableName())
+    _, index_table = createTableIfNotExists(getMedicineIndexTableName())
+    pending: dict[str, list] = {}
+    indexedKeys: set[tuple[str, str]] = set()
+    written = 0
+    for entity in medicine_table.list_entities():
+        index_entity = toMedicineIndexEntity(entity)
+        partition = pending.setdefault(index_entity['PartitionKey'], [])
+        partition.append(("upsert", index_entity, {"mode": UpdateMode.REPLACE}))
+        indexedKeys.add((index_entity['PartitionKey'], index_entity['RowKey']))
+        if len(partition) == MAX_BATCH_OPERATIONS:
+            written += _flush(index_table, pending.pop(index_entity['PartitionKey']))
+    for operations in pending.values():
+        written += _flush(index_table, operations)
+
+    removed = 0
+    if prune:
+        stale: dict[str, list] = {}
+        for entry in index_table.list_entities(select=['PartitionKey', 'RowKey']):
+            if (entry['PartitionKey'], entry['RowKey']) in indexedKeys:
+                continue
+            partition = stale.setdefault(entry['PartitionKey'], [])
+            partition.append(("delete", entry))
+            if len(partition) == MAX_BATCH_OPERATIONS:
+                removed += _flush(index_table, stale.pop(entry['PartitionKey']))
+        for operations in stale.values():
+            removed += _flush(index_table, operations)
+    return written, removed
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Rebuild the MedicineName index table from the Medicine table")
+    parser.add_argument("--prune", action="store_true", help="delete index rows that no longer match a medicine batch")
+    args = parser.parse_args()
+    written, removed = rebuildMedicineIndex(args.prune)
+    logging.info(f"Indexed {written} medicine batches, removed {removed} stale index rows")
@@ -0,0 +1,30 @@
+import logging
+from azure.data.tables import UpdateMode
+from Store import STORE_EMAIL_ROW_KEY, StoreEmailEntity, StoreEntityParser
+from schemaUtils import createTableIfNotExists, getStoreEmailsTableName, getStoresTableName, toTableEntity
+
+# Backfills the email lookup table used by login and registration from the Stores table.
+# Usage (with the same settings as the function app): python rebuildStoreEmailIndex.py
+
+def rebuildStoreEmailIndex() -> tuple[int, int]:
+    _, stores_table = createTableIfNotExists(getStoresTableName())
+    _, emails_table = createTableIfNotExists(getStoreEmailsTableName())
+    owners: dict[str, str] = {}
+    written = 0
+    conflicts = 0
+    for entity in stores_table.list_entities():
+        store = StoreEntityParser.parse(entity)
+        email = StoreEmailEntity(Email=store.Email, StoreName=store.StoreName, Password=store.Password)
+        owner = owners.setdefault(email.uid(), store.StoreName)
+        if owner != store.StoreName:
+            logging.warning(f"Email {store.Email} of {store.StoreName} is already used by {owner}, skipping")
+            conflicts += 1
+            continue
+        emails_table.upsert_entity(entity=toTableEntity(email, rowKey=STORE_EMAIL_ROW_KEY), mode=UpdateMode.REPLACE) # type: ignore
+        written += 1
+    return written, conflicts
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    written, conflicts = rebuildStoreEmailIndex()
+    logging.info(f"Indexed {written} store emails, {conflicts} conflicting emails skipped")
@@ -1,14 +1,55 @@
+from __future__ import annotations
 from dataclasses import dataclass, asdict
+import asyncio
 import os
-from typing import Any, Dict
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, Optional, TypeVar
 import uuid
-from azure.data.tables import TableClient, TableServiceClient
-from azure.core.credentials import AzureKeyCredential
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
-from azure.ai.textanalytics import TextAnalyticsClient
+import weakref
+from StorageBackend import AsyncContainerAdapter, AsyncTableAdapter, getSqliteDatabasePath, isSqliteBackend
+from Tracing import TracedAsyncTableClient, TracedTableClient
 
+# Every function imports this module, the SDKs are only imported by the factory that needs them
+# so functions that never touch OCR, text analytics or blobs don't pay for loading them on cold start
+if TYPE_CHECKING:
+    from azure.data.tables import TableClient, TableServiceClient
+    from azure.ai.formrecognizer import DocumentAnalysisClient
+    from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
+    from azure.ai.textanalytics import TextAnalyticsClient
+    from azure.data.tables.aio import TableClient as AsyncTableClient, TableServiceClient as AsyncTableServiceClient
+    from azure.ai.formrecognizer.aio import DocumentAnalysisClient as AsyncDocumentAnalysisClient
+    from azure.storage.blob.aio import ContainerClient as AsyncContainerClient
+    from azure.ai.textanalytics.aio import TextAnalyticsClient as AsyncTextAnalyticsClient
+    from SqliteStorage import SqliteDatabase
 
+T = TypeVar("T")
+
+# Clients are kept for the lifetime of the worker process so warm invocations
+# reuse the same HTTP sessions instead of opening new connections every call.
+_clients: Dict[str, Any] = {}
+_clientsLock = threading.RLock()
+
+
+def _getOrCreateClient(key: str, factory: Callable[[], T]) -> T:
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _clientsLock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+    return client
+
+
+def _putClientIfAbsent(key: str, client: T) -> T:
+    with _clientsLock:
+        return _clients.setdefault(key, client)
+
+
+def resetClients() -> None:
+    with _clientsLock:
+        _clients.clear()
 
 
 @dataclass
@@ -20,18 +61,58 @@ class BaseEntity:
             raise ValueError(f"Missing one or more parameters {items}")
 
     def asdict(self) -> Dict[str, Any]:
-        return {key: str(value) if isinstance(value, (float, int)) else value for key, value in asdict(self).items()}
+        # Values keep their Python types so they are stored as typed properties (Int32, Double, DateTime) the service can filter on
+        return asdict(self)
     def uid(self):
         raise NotImplementedError()
 
+def getTableServiceClient() -> TableServiceClient:
+    from azure.data.tables import TableServiceClient
+    return _getOrCreateClient("tables", lambda: TableServiceClient.from_connection_string(
+        conn_str=getStorageConnectionString()))
+
+
+def getSqliteDatabase() -> SqliteDatabase:
+    from SqliteStorage import SqliteDatabase
+    return _getOrCreateClient("sqlite", lambda: SqliteDatabase(getSqliteDatabasePath()))
+
+
 def createTableIfNotExists(table_name: str) -> tuple[TableServiceClient, TableClient]:
-    service_client = TableServiceClient.from_connection_string(
-        conn_str=getStorageConnectionString())
-    table_client = service_client.create_table_if_not_exists(
-        table_name)  # type: ignore
+    if isSqliteBackend():
+        database = getSqliteDatabase()
+        return database, TracedTableClient(database.createTableIfNotExists(table_name))  # type: ignore
+    service_client = getTableServiceClient()
+    # Table clients share the service client's transport, the table itself is only created once per process
+    table_client = _getOrCreateClient(f"table:{table_name}", lambda: TracedTableClient(service_client.create_table_if_not_exists(
+        table_name)))  # type: ignore
     return service_client, table_client
 
 
+# Table storage rejects filters with more than 15 discrete comparisons
+MAX_FILTER_COMPARISONS = 15
+# and entity group transactions with more than 100 operations
+MAX_BATCH_OPERATIONS = 100
+
+
+def escapeFilterValue(value: str) -> str:
+    return value.replace("'", "''")
+
+
+def buildOrFilter(propertyName: str, values: Iterable[str]) -> str:
+    return " or ".join(f"{propertyName} eq '{escapeFilterValue(value)}'" for value in values)
+
+
+def chunked(values: Iterable[T], size: int) -> Iterator[list[T]]:
+    chunk: list[T] = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def isEntryExists(table: TableClient, cond: str) -> bool:
     entities = table.query_entities(cond)  # type: ignore
     entity_list = list(entities)
@@ -40,6 +121,8 @@ def isEntryExists(table: TableClient, cond: str) -> bool:
 
 def getStorageConnectionString() -> str:
     connectionString = os.getenv('TableStorageAccountConnectionString')
+    if connectionString is None and isSqliteBackend():
+        return f"sqlite:{getSqliteDatabasePath()}"
     if connectionString is None:
         raise ValueError("No connection string for table storage account")
     return connectionString
@@ -65,6 +148,9 @@ def getStoresTableName() -> str:
         raise ValueError("No table name for medicine")
     return tableName
 
+def getStoreEmailsTableName() -> str:
+    return os.getenv('StoreEmailsTableName', f"{getStoresTableName()}Emails")
+
 def getTokensTableName()-> str:
     tableName = os.getenv('TokensTableName')
     if tableName is None:
@@ -72,11 +158,16 @@ def getTokensTableName()-> str:
     return tableName
 
 
-def writeEntityToTable(entity: BaseEntity, table: TableClient) -> None:
+def toTableEntity(entity: BaseEntity, rowKey: Optional[str] = None) -> Dict[str, Any]:
     entity_dict = entity.asdict()
     entity_dict['PartitionKey'] = entity.uid()
-    entity_dict['RowKey'] = str(uuid.uuid4())
-    table.create_entity(entity=entity_dict)  # type: ignore
+    entity_dict['RowKey'] = rowKey if rowKey is not None else str(uuid.uuid4())
+    return entity_dict
+
+
+def writeEntityToTable(entity: BaseEntity, table: TableClient, rowKey: Optional[str] = None) -> None:
+    # A deterministic rowKey makes concurrent writers of the same entity collide instead of duplicating it
+    table.create_entity(entity=toTableEntity(entity, rowKey))  # type: ignore
 
 
 def getMedicineTableName() -> str:
@@ -86,21 +177,39 @@ def getMedicineTableName() -> str:
     return tableName
 
 
+def getMedicineIndexTableName() -> str:
+    return os.getenv('MedicineIndexTableName', f"{getMedicineTableName()}ByName")
+
+
+def getAvailabilityChangesTableName() -> str:
+    return os.getenv('AvailabilityChangesTableName', f"{getMedicineTableName()}Changes")
+
+
+def getMedicationLexiconTableName() -> str:
+    return os.getenv('MedicationLexiconTableName', f"{getMedicineTableName()}Lexicon")
+
+
 def getDocumentAnalysisClient() -> DocumentAnalysisClient:
     endpoint = os.getenv('FormRecogniserEndpoint')
     key = os.getenv('FormRecogniserKey')
     if endpoint is None or key is None:
         raise ValueError("No endpoint or key for form recognizer")
-    document_analysis_client = DocumentAnalysisClient(
+    from azure.core.credentials import AzureKeyCredential
+    from azure.ai.formrecognizer import DocumentAnalysisClient
+    return _getOrCreateClient("formRecognizer", lambda: DocumentAnalysisClient(
         endpoint=endpoint, credential=AzureKeyCredential(key)
-    )
-    return document_analysis_client
+    ))
+
+
+def getBlobServiceClient(connection_string: str) -> BlobServiceClient:
+    from azure.storage.blob import BlobServiceClient
+    return _getOrCreateClient(f"blobs:{connection_string}", lambda: BlobServiceClient.from_connection_string(
+        connection_string))
 
 
 def getBlobClient(connection_string: str, container_name: str, blob_name: str) -> BlobClient:
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(
-            connection_string)
+        blob_service_client = getBlobServiceClient(connection_string)
         blob_client = blob_service_client.get_blob_client(
             container=container_name, blob=blob_name)
     except Exception as e:
@@ -108,19 +217,98 @@ def getBlobClient(connection_string: str, container_name: str, blob_name: str) -
     return blob_client
 
 
-def getContainerClient(connection_string: str, container_name: str) -> ContainerClient:
-    blob_service_client = BlobServiceClient.from_connection_string(
-        connection_string)
-    container_client = blob_service_client.get_container_client(container_name)
+def _createContainerIfNotExists(connection_string: str, container_name: str) -> ContainerClient:
+    container_client = getBlobServiceClient(connection_string).get_container_client(container_name)
     if not container_client.exists():
         container_client.create_container()
     return container_client
 
 
+def getContainerClient(connection_string: str, container_name: str) -> ContainerClient:
+    if isSqliteBackend():
+        return getSqliteDatabase().getContainerClient(container_name)  # type: ignore
+    return _getOrCreateClient(f"container:{connection_string}:{container_name}",
+                              lambda: _createContainerIfNotExists(connection_string, container_name))
+
+
 def getTextAnalyticsClient() -> TextAnalyticsClient:
-    text_analytics_client = TextAnalyticsClient(
+    from azure.core.credentials import AzureKeyCredential
+    from azure.ai.textanalytics import TextAnalyticsClient
+    return _getOrCreateClient("textAnalytics", lambda: TextAnalyticsClient(
         endpoint=getTextAnalyticsEndpoint(),
         credential=AzureKeyCredential(getTextAnalyticsKey()),
-    )
-    return text_analytics_client
+    ))
+
+
+# The aio clients below are used by async functions, they share the worker's event loop and are pooled the same way
+
+# One per event loop, a semaphore can only be awaited on the loop it was first used on
+_storageSemaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+
+
+def getStorageSemaphore() -> asyncio.Semaphore:
+    # Bounds the storage requests all concurrent async invocations in the worker have in flight
+    loop = asyncio.get_running_loop()
+    semaphore = _storageSemaphores.get(loop)
+    if semaphore is None:
+        semaphore = _storageSemaphores.setdefault(loop, asyncio.Semaphore(int(os.getenv('MaxConcurrentStorageRequests', '16'))))
+    return semaphore
+
+
+def getAsyncTableServiceClient() -> AsyncTableServiceClient:
+    from azure.data.tables.aio import TableServiceClient as AsyncTableServiceClient
+    return _getOrCreateClient("aio:tables", lambda: AsyncTableServiceClient.from_connection_string(
+        conn_str=getStorageConnectionString()))
+
 
+async def createTableIfNotExistsAsync(table_name: str) -> AsyncTableClient:
+    key = f"aio:table:{table_name}"
+    table_client = _clients.get(key)
+    if table_client is None and isSqliteBackend():
+        table_client = getSqliteDatabase().createTableIfNotExists(table_name)
+        table_client = _putClientIfAbsent(key, TracedAsyncTableClient(AsyncTableAdapter(table_client)))
+    if table_client is None:
+        table_client = await getAsyncTableServiceClient().create_table_if_not_exists(table_name)  # type: ignore
+        table_client = _putClientIfAbsent(key, TracedAsyncTableClient(table_client))
+    return table_client
+
+
+def getAsyncDocumentAnalysisClient() -> AsyncDocumentAnalysisClient:
+    endpoint = os.getenv('FormRecogniserEndpoint')
+    key = os.getenv('FormRecogniserKey')
+    if endpoint is None or key is None:
+        raise ValueError("No endpoint or key for form recognizer")
+    from azure.core.credentials import AzureKeyCredential
+    from azure.ai.formrecognizer.aio import DocumentAnalysisClient as AsyncDocumentAnalysisClient
+    return _getOrCreateClient("aio:formRecognizer", lambda: AsyncDocumentAnalysisClient(
+        endpoint=endpoint, credential=AzureKeyCredential(key)
+    ))
+
+
+async def getAsyncContainerClient(connection_string: str, container_name: str) -> AsyncContainerClient:
+    key = f"aio:container:{connection_string}:{container_name}"
+    container_client = _clients.get(key)
+    if container_client is None and isSqliteBackend():
+        container_client = _putClientIfAbsent(key, AsyncContainerAdapter(getContainerClient(connection_string, container_name)))
+    if container_client is None:
+        from azure.core.exceptions import ResourceExistsError
+        from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+        blob_service_client = _getOrCreateClient(f"aio:blobs:{connection_string}",
+                                                 lambda: AsyncBlobServiceClient.from_connection_string(connection_string))
+        container_client = blob_service_client.get_container_client(container_name)
+        if not await container_client.exists():
+            try:
+                await container_client.create_container()
+            except ResourceExistsError:
+                pass
+        container_client = _putClientIfAbsent(key, container_client)
+    return container_client
+
+
+def getAsyncTextAnalyticsClient() -> AsyncTextAnalyticsClient:
+    from azure.core.credentials import AzureKeyCredential
+    from azure.ai.textanalytics.aio import TextAnalyticsClient as AsyncTextAnalyticsClient
+    return _getOrCreateClient("aio:textAnalytics", lambda: AsyncTextAnalyticsClient(
+        endpoint=getTextAnalyticsEndpoint(),
+        credential=AzureKeyCredential(getTextAnalyticsKey()),
+    ))
@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (BACKEND_DIR, os.path.join(BACKEND_DIR, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+@pytest.fixture
+def sqliteStorage(tmp_path, monkeypatch):
+    # A fresh SQLite database per test, with the table names the function app reads from its settings
+    from schemaUtils import resetClients
+    monkeypatch.setenv("StorageBackend", "sqlite")
+    monkeypatch.setenv("SqliteDatabasePath", str(tmp_path / "storage.db"))
+    monkeypatch.setenv("StoresTableName", "TestStores")
+    monkeypatch.setenv("MedicineTableName", "TestMedicine")
+    monkeypatch.setenv("TokensTableName", "TestTokens")
+    resetClients()
+    yield
+    resetClients()
@@ -0,0 +1,56 @@
+import asyncio
+import time
+import pytest
+from EntityBatcher import AsyncEntityBatcher, EntityBatcher, analyzeHealthcareDocuments, analyzeHealthcareDocumentsAsync
+from fakes import installFakeServices
+from schemaUtils import resetClients
+
+@pytest.fixture
+def services():
+    resetClients()
+    yield installFakeServices(["amoxicillin", "ibuprofen"], nerLatencySeconds=0.05)
+    resetClients()
+
+def _names(document):
+    return [entity.text for entity in document.entities]
+
+def test_lone_async_document_skips_the_window(services):
+    async def run():
+        batcher = AsyncEntityBatcher(analyzeHealthcareDocumentsAsync, 5.0, 25, 4)
+        started = time.monotonic()
+        document = await batcher.submit("amoxicillin 500mg")
+        return document, time.monotonic() - started
+    document, elapsed = asyncio.run(run())
+    assert _names(document) == ["amoxicillin"]
+    assert elapsed < 1.0
+    assert services.asyncTextAnalytics.usage.calls == 1
+
+def test_async_documents_arriving_during_an_operation_share_the_next(services):
+    async def run():
+        batcher = AsyncEntityBatcher(analyzeHealthcareDocumentsAsync, 0.01, 25, 4)
+        first = batcher.submit("amoxicillin")
+        # The first operation is running when the rest arrive
+        await asyncio.sleep(0.01)
+        rest = [batcher.submit(f"ibuprofen {index}") for index in range(5)]
+        return await first, await asyncio.gather(*rest)
+    first, rest = asyncio.run(run())
+    assert _names(first) == ["amoxicillin"]
+    assert all(_names(document) == ["ibuprofen"] for document in rest)
+    assert services.asyncTextAnalytics.usage.calls == 2
+    assert services.asyncTextAnalytics.usage.documents == 6
+    assert services.textAnalytics.usage.calls == 0
+
+def test_async_documents_of_one_loop_iteration_share_an_operation(services):
+    async def run():
+        batcher = AsyncEntityBatcher(analyzeHealthcareDocumentsAsync, 5.0, 25, 4)
+        return await asyncio.gather(*[batcher.submit(text) for text in ("amoxicillin", "ibuprofen", "amoxicillin")])
+    documents = asyncio.run(run())
+    assert [_names(document) for document in documents] == [["amoxicillin"], ["ibuprofen"], ["amoxicillin"]]
+    assert services.asyncTextAnalytics.usage.calls == 1
+    assert services.asyncTextAnalytics.usage.documents == 2
+
+def test_lone_sync_document_skips_the_window(services):
+    batcher = EntityBatcher(analyzeHealthcareDocuments, 5.0, 25, 4)
+    started = time.monotonic()
+    assert _names(batcher.submit("ibuprofen").result(timeout=2)) == ["ibuprofen"]
+    assert time.monotonic() - started < 1.0
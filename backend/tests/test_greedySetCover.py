@@ -0,0 +1,26 @@
+from Algortihms import coverStoreMasks, greedySetCover, toMedicationBits
+
+def test_store_covering_the_most_medications_wins():
+    masks = {'a': 0b0011, 'b': 0b1110, 'c': 0b0001, 'd': 0b1000}
+    assert greedySetCover(masks, 0b1111) == ({'a', 'b'}, 0)
+
+def test_ties_are_broken_by_store_name():
+    assert greedySetCover({'b': 0b01, 'a': 0b01, 'c': 0b10}, 0b11) == ({'a', 'c'}, 0)
+
+def test_costs_prefer_the_lowest_cost_per_medication():
+    masks = {'far': 0b111, 'near1': 0b011, 'near2': 0b100}
+    assert greedySetCover(masks, 0b111, {'far': 10.0, 'near1': 1.0, 'near2': 1.0}) == ({'near1', 'near2'}, 0)
+    assert greedySetCover(masks, 0b111, {'far': 1.5, 'near1': 1.0, 'near2': 1.0}) == ({'far'}, 0)
+
+def test_uncoverable_medications_are_returned():
+    assert greedySetCover({'a': 0b001}, 0b101) == ({'a'}, 0b100)
+    assert greedySetCover({}, 0b1) == (set(), 0b1)
+
+def test_stores_outside_the_target_are_never_selected():
+    assert greedySetCover({'a': 0b100, 'b': 0b011}, 0b011) == ({'b'}, 0)
+
+def test_cover_names_medications_no_store_has():
+    bits = toMedicationBits({'aspirin', 'ibuprofen', 'insulin'})
+    masks = {'Store A': bits['aspirin'], 'Store B': bits['aspirin'] | bits['ibuprofen']}
+    selected, notFound, distances = coverStoreMasks(bits, masks, None)
+    assert (selected, notFound, distances) == ({'Store B'}, {'insulin'}, {})
@@ -0,0 +1,55 @@
+import base64
+import json
+import azure.functions as func
+import pytest
+from Image import ImageParser
+
+BOUNDARY = "----form7MA4YWxk"
+
+def _part(name, data, fileName=None, contentType="image/jpeg"):
+    disposition = f'form-data; name="{name}"' + (f'; filename="{fileName}"' if fileName else "")
+    headers = f"Content-Disposition: {disposition}\r\n" + (f"Content-Type: {contentType}\r\n" if fileName else "")
+    return f"--{BOUNDARY}\r\n{headers}\r\n".encode() + data + b"\r\n"
+
+def _multipart(*parts, contentType=f"multipart/form-data; boundary={BOUNDARY}", params=None):
+    body = b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+    return func.HttpRequest(method="POST", url="/api/LocateMedicine", headers={"Content-Type": contentType}, params=params or {}, body=body)
+
+# Binary data that looks like the start of a delimiter without being one
+PHOTO = b"\xff\xd8\xff\xe0\r\n--\r\n--" + BOUNDARY[:-1].encode() + b"\x00\r\n\r\n\xff\xd9"
+
+def test_image_field_is_sliced_out_exactly():
+    request = _multipart(_part("latitude", b"32.1"), _part("image", PHOTO, "rx.jpg"), _part("longitude", b"34.8"))
+    image = ImageParser.parse(request)
+    assert (image.data, image.name) == (PHOTO, "rx.jpg")
+
+def test_first_file_is_used_without_an_image_field():
+    request = _multipart(_part("note", b"hello"), _part("scan", PHOTO, "first.jpg"), _part("other", b"x", "second.jpg"))
+    assert ImageParser.parse(request).name == "first.jpg"
+
+def test_image_field_wins_over_an_earlier_file():
+    request = _multipart(_part("scan", b"other", "first.jpg"), _part("image", PHOTO))
+    image = ImageParser.parse(request)
+    assert image.data == PHOTO
+    assert image.name == "upload"
+
+def test_quoted_boundary_and_name_from_the_query_string():
+    request = _multipart(_part("image", PHOTO), contentType=f'multipart/form-data; boundary="{BOUNDARY}"', params={"imageName": "query.jpg"})
+    assert ImageParser.parse(request).name == "query.jpg"
+
+@pytest.mark.parametrize("request_", [
+    _multipart(_part("image", PHOTO, "rx.jpg"), contentType="multipart/form-data"),
+    _multipart(_part("note", b"no file here")),
+    func.HttpRequest(method="POST", url="/api/LocateMedicine", headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+                     body=f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"image\"\r\n\r\ntruncated".encode()),
+])
+def test_forms_without_an_image_are_rejected(request_):
+    with pytest.raises(ValueError):
+        ImageParser.parse(request_)
+
+def test_binary_and_json_uploads():
+    binary = func.HttpRequest(method="POST", url="/api/LocateMedicine", headers={"Content-Type": "image/jpeg"}, params={"imageName": "raw.jpg"}, body=PHOTO)
+    assert (ImageParser.parse(binary).data, ImageParser.parse(binary).name) == (PHOTO, "raw.jpg")
+    body = json.dumps({"imageData": base64.b64encode(PHOTO).decode(), "imageName": "json.jpg"}).encode()
+    encoded = func.HttpRequest(method="POST", url="/api/LocateMedicine", headers={"Content-Type": "application/json"}, body=body)
+    assert ImageParser.parse(encoded).data == PHOTO
@@ -0,0 +1,71 @@
+import json
+from azure.data.tables import TableTransactionError
+from schemaUtils import createTableIfNotExists, getMedicineIndexTableName, getMedicineTableName
+from InventoryImport import importInventory
+
+def _rows(count: int, storeName: str = "Test Store") -> bytes:
+    return "\n".join(json.dumps({"medicineName": "Aspirin", "manufacturer": "Bayer", "expiryDate": "2099-01-01",
+                                 "batchNumber": f"b{index}", "price": 1.5, "quantity": 2}) for index in range(count)).encode()
+
+def test_import_commits_every_row(sqliteStorage):
+    _, table = createTableIfNotExists(getMedicineTableName())
+    report = importInventory(table, "Test Store", _rows(150), "application/x-ndjson")
+    assert (report.imported, report.failed) == (150, 0)
+    assert len(list(table.query_entities("PartitionKey eq 'teststore'"))) == 150
+
+def test_import_reports_invalid_rows_by_row_number(sqliteStorage):
+    _, table = createTableIfNotExists(getMedicineTableName())
+    body = _rows(2) + b"\nnot json\n" + json.dumps({"manufacturer": "x"}).encode()
+    report = importInventory(table, "Test Store", body, "application/x-ndjson")
+    assert report.imported == 2
+    assert [error['row'] for error in report.errors] == [3, 4]
+
+def test_failed_chunk_only_reports_its_own_rows(sqliteStorage):
+    _, table = createTableIfNotExists(getMedicineTableName())
+    _, index_table = createTableIfNotExists(getMedicineIndexTableName())
+    submit = table.table.submit_transaction
+    calls = []
+    def failSecondChunk(operations, **kwargs):
+        calls.append(len(operations))
+        if len(calls) == 2:
+            error = TableTransactionError(message="bad request")
+            error.status_code = 400
+            raise error
+        return submit(operations, **kwargs)
+    table.table.submit_transaction = failSecondChunk
+    report = importInventory(table, "Test Store", _rows(150), "application/x-ndjson")
+    assert (report.imported, report.failed) == (100, 50)
+    assert len(list(table.query_entities("PartitionKey eq 'teststore'"))) == 100
+    # The committed chunk is visible to availability through the index
+    assert len(list(index_table.query_entities("PartitionKey eq 'aspirin'"))) == 100
+
+def test_import_records_one_availability_change_per_pair(sqliteStorage):
+    from schemaUtils import getAvailabilityChangesTableName
+    _, table = createTableIfNotExists(getMedicineTableName())
+    importInventory(table, "Test Store", _rows(150), "application/x-ndjson")
+    _, changes_table = createTableIfNotExists(getAvailabilityChangesTableName())
+    changes = list(changes_table.list_entities())
+    assert [(change['MedicineName'], change['StoreName'], change['Available'], change['Extends']) for change in changes] == [("aspirin", "Test Store", True, True)]
+
+def test_failed_lookup_only_fails_its_window(sqliteStorage, monkeypatch):
+    from azure.core.exceptions import HttpResponseError
+    import InventoryImport
+    monkeypatch.setattr(InventoryImport, "IMPORT_WINDOW_ROWS", 100)
+    _, table = createTableIfNotExists(getMedicineTableName())
+    query = table.table.query_entities
+    def failSecondWindow(query_filter, **kwargs):
+        # The lookup of the second window's batches
+        if "RowKey eq 'aspirin_b100'" in query_filter:
+            raise HttpResponseError(message="timeout")
+        return query(query_filter, **kwargs)
+    table.table.query_entities = failSecondWindow
+    report = importInventory(table, "Test Store", _rows(250), "application/x-ndjson")
+    assert (report.imported, report.failed) == (150, 100)
+    assert [error['row'] for error in report.errors] == list(range(101, 201))
+
+def test_missing_price_is_stored_as_a_double(sqliteStorage):
+    _, table = createTableIfNotExists(getMedicineTableName())
+    row = {"medicineName": "Aspirin", "manufacturer": "Bayer", "expiryDate": "2099-01-01", "batchNumber": "free", "quantity": 1}
+    importInventory(table, "Test Store", json.dumps(row).encode(), "application/x-ndjson")
+    price = table.get_entity("teststore", "aspirin_free")['Price']
+    assert isinstance(price, float) and price == 0.0
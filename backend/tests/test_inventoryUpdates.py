@@ -0,0 +1,34 @@
+from schemaUtils import createTableIfNotExists, getMedicineIndexTableName, getMedicineTableName
+from InventoryImport import importInventory
+from Medicine import Medicine, MedicineEntityParser, removeMedicineFromInventory
+from test_inventoryImport import _rows
+
+def _raceFirstUpdate(table, quantity):
+    # Another checkout commits between this request's read and its conditional write, which then fails once
+    update = table.table.update_entity
+    calls = []
+    def racingUpdate(entity, **kwargs):
+        if not calls:
+            update({'PartitionKey': entity['PartitionKey'], 'RowKey': entity['RowKey'], 'Quantity': quantity})
+        calls.append(entity['Quantity'])
+        return update(entity, **kwargs)
+    table.table.update_entity = racingUpdate
+    return calls
+
+def _batch(table):
+    entity = next(iter(table.query_entities("PartitionKey eq 'teststore'")))
+    return MedicineEntityParser.parse(entity)
+
+def _indexRow(medicine):
+    _, index_table = createTableIfNotExists(getMedicineIndexTableName())
+    return index_table.get_entity(partition_key=medicine.MedicineName, row_key=Medicine.indexKeyFromEntity(medicine.asdict()))
+
+def test_checkout_after_a_conflict_indexes_the_committed_quantity(sqliteStorage):
+    _, table = createTableIfNotExists(getMedicineTableName())
+    importInventory(table, "Test Store", _rows(1), "application/x-ndjson")
+    medicine = _batch(table)
+    calls = _raceFirstUpdate(table, 1)
+    removeMedicineFromInventory(medicine, table, "Test Store")
+    assert calls == [1, 0]
+    assert table.get_entity(*medicine.key())['Quantity'] == 0
+    assert _indexRow(medicine)['InStock'] is False
@@ -0,0 +1,72 @@
+import importlib
+import json
+import azure.functions as func
+import pytest
+import TokenUtils
+from schemaUtils import createTableIfNotExists, getMedicineTableName
+from InventoryImport import importInventory
+from Medicine import MedicineEntityParser, encodeContinuationToken, decodeContinuationToken, findMedicineEntities
+from TokenUtils import RevocationList, TokenCredentials
+from test_inventoryImport import _rows
+
+listInventory = importlib.import_module("ListInventory")
+
+@pytest.fixture
+def inventory(sqliteStorage, monkeypatch):
+    monkeypatch.setattr(TokenUtils, "_revocationList", RevocationList())
+    _, table = createTableIfNotExists(getMedicineTableName())
+    importInventory(table, "Test Store", _rows(250), "application/x-ndjson")
+    importInventory(table, "Other Store", _rows(3), "application/x-ndjson")
+    return table
+
+def _list(token, **params):
+    request = func.HttpRequest(method="GET", url="/api/ListInventory", headers={"Authorization": f"Bearer {token}"}, params=params, body=b"")
+    return listInventory.main(request)
+
+def test_pages_round_trip_every_batch_once(inventory):
+    token = TokenCredentials.create("Test Store")
+    batches, continuationToken, pages = [], None, 0
+    while True:
+        params = {"pageSize": "100", **({"continuationToken": continuationToken} if continuationToken else {})}
+        response = _list(token, **params)
+        assert response.status_code == 200
+        body = json.loads(response.get_body())
+        batches += [item['BatchNumber'] for item in body['items']]
+        assert all(item['StoreName'] == "Test Store" for item in body['items'])
+        pages += 1
+        continuationToken = body['continuationToken']
+        if continuationToken is None:
+            break
+    assert pages == 3
+    assert sorted(batches) == sorted(f"b{index}" for index in range(250))
+
+def test_storage_tokens_come_back_unchanged():
+    for token in (json.dumps(["teststore", "aspirin_b1"]), {'PartitionKey': "teststore", 'RowKey': "aspirin_b1"}):
+        assert decodeContinuationToken(encodeContinuationToken(token)) == token
+
+def test_tokens_that_storage_never_hands_out_are_rejected():
+    for value in ("not base64 json", encodeContinuationToken(7), encodeContinuationToken(["teststore", "aspirin_b1"])):
+        with pytest.raises(ValueError):
+            decodeContinuationToken(value)
+
+def test_invalid_continuation_token_is_a_bad_request(inventory):
+    assert _list(TokenCredentials.create("Test Store"), continuationToken="%%%").status_code == 400
+
+def _moveToLegacyKey(table):
+    entity = next(iter(table.query_entities("PartitionKey eq 'teststore'")))
+    medicine = MedicineEntityParser.parse(entity)
+    table.delete_entity(partition_key=entity['PartitionKey'], row_key=entity['RowKey'])
+    table.create_entity(entity={**dict(entity), 'PartitionKey': medicine.legacyUid(), 'RowKey': medicine.legacyUid()})
+    return medicine
+
+def test_legacy_keys_are_not_looked_up_by_default(inventory, monkeypatch):
+    monkeypatch.delenv("MedicineLegacyKeysEnabled", raising=False)
+    medicine = _moveToLegacyKey(inventory)
+    assert findMedicineEntities(medicine, inventory, "Test Store") is None
+
+def test_legacy_keys_are_adopted_when_enabled(inventory, monkeypatch):
+    monkeypatch.setenv("MedicineLegacyKeysEnabled", "true")
+    medicine = _moveToLegacyKey(inventory)
+    entity = findMedicineEntities(medicine, inventory, "Test Store")
+    assert (entity['PartitionKey'], entity['RowKey']) == medicine.key()
+    assert not list(inventory.query_entities(f"PartitionKey eq '{medicine.legacyUid()}'"))
@@ -0,0 +1,62 @@
+import importlib
+import time
+import azure.functions as func
+import jwt
+import pytest
+import TokenUtils
+from TokenUtils import RevocationList, TokenCredentials
+
+logout = importlib.import_module("logout")
+
+@pytest.fixture
+def revocations(sqliteStorage, monkeypatch):
+    monkeypatch.setattr(TokenUtils, "_revocationList", RevocationList())
+
+def _request(token):
+    return func.HttpRequest(method="POST", url="/api/logout", headers={"Authorization": f"Bearer {token}"}, body=b"")
+
+def test_logout_revokes_the_token(revocations):
+    token = TokenCredentials.create("Store 1")
+    other = TokenCredentials.create("Store 1")
+    assert logout.main(_request(token)).status_code == 200
+    with pytest.raises(jwt.InvalidTokenError):
+        TokenCredentials.decodeRequestToken(_request(token))
+    assert TokenCredentials.decodeRequestToken(_request(other))['store_name'] == "Store 1"
+    # Another worker reads the revocation from the tokens table
+    assert RevocationList().isRevoked(jwt.decode(token, options={"verify_signature": False})['jti'])
+
+def test_logout_with_a_revoked_token_is_unauthorized(revocations):
+    token = TokenCredentials.create("Store 1")
+    assert logout.main(_request(token)).status_code == 200
+    assert logout.main(_request(token)).status_code == 401
+
+def test_logout_without_a_token_is_a_bad_request(revocations):
+    request = func.HttpRequest(method="POST", url="/api/logout", headers={}, body=b"")
+    assert logout.main(request).status_code == 400
+
+def test_failed_reload_keeps_the_last_list(revocations, monkeypatch):
+    from azure.core.exceptions import HttpResponseError
+    token = TokenCredentials.create("Store 1")
+    assert logout.main(_request(token)).status_code == 200
+    revocationList = RevocationList()
+    tokenId = jwt.decode(token, options={"verify_signature": False})['jti']
+    assert revocationList.isRevoked(tokenId)
+    calls = []
+    def failingLoad():
+        calls.append(1)
+        raise HttpResponseError(message="unavailable")
+    monkeypatch.setattr(revocationList, "_load", failingLoad)
+    monkeypatch.setenv("TokenRevocationRefreshSeconds", "0")
+    for _ in range(3):
+        assert revocationList.isRevoked(tokenId)
+        while revocationList._loadLock.locked():
+            time.sleep(0.001)
+    assert 1 <= len(calls) <= 3
+
+def test_first_load_failure_does_not_fail_requests(revocations, monkeypatch):
+    from azure.core.exceptions import HttpResponseError
+    def failingLoad():
+        raise HttpResponseError(message="unavailable")
+    monkeypatch.setattr(TokenUtils._revocationList, "_load", failingLoad)
+    token = TokenCredentials.create("Store 1")
+    assert TokenCredentials.decodeRequestToken(_request(token))['store_name'] == "Store 1"
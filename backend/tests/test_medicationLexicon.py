@@ -0,0 +1,47 @@
+import time
+from MedicationLexicon import MedicationLexicon
+
+def _lexicon(medications=()) -> MedicationLexicon:
+    lexicon = MedicationLexicon()
+    lexicon.nextRefreshAt = float('inf')
+    lexicon.medications.update(medications)
+    return lexicon
+
+def test_known_medications_match_exactly(sqliteStorage):
+    lexicon = _lexicon({"prednisolone", "aspirin"})
+    assert lexicon.resolve({"aspirin", "daily"}) == ({"aspirin"}, {"daily"})
+
+def test_near_miss_of_a_known_medication_goes_to_text_analytics(sqliteStorage):
+    lexicon = _lexicon({"prednisolone"})
+    assert lexicon.resolve({"prednisone"}) == (set(), {"prednisone"})
+
+def test_word_is_trusted_as_non_medication_only_after_repeated_misses(sqliteStorage, monkeypatch):
+    monkeypatch.setenv("MedicationLexiconNegativeHits", "3")
+    lexicon = _lexicon()
+    for _ in range(2):
+        lexicon.learn({"tablet"}, [])
+        assert lexicon.resolve({"tablet"}) == (set(), {"tablet"})
+    lexicon.learn({"tablet"}, [])
+    assert lexicon.resolve({"tablet"}) == (set(), set())
+
+def test_misses_expire(sqliteStorage, monkeypatch):
+    monkeypatch.setenv("MedicationLexiconNegativeHits", "1")
+    lexicon = _lexicon()
+    lexicon.learn({"tablet"}, [])
+    lexicon.misses["tablet"] = (5, time.time() - 8 * 24 * 3600)
+    assert lexicon.resolve({"tablet"}) == (set(), {"tablet"})
+
+def test_learned_terms_are_shared_through_the_table(sqliteStorage, monkeypatch):
+    monkeypatch.setenv("MedicationLexiconNegativeHits", "1")
+    _lexicon().learn({"amoxicillin", "tablet"}, ["Amoxicillin 500mg"])
+    other = MedicationLexicon()
+    other.refreshIfDue()
+    assert other.resolve({"amoxicillin", "tablet", "daily"}) == ({"amoxicillin"}, {"daily"})
+
+def test_expired_misses_are_pruned_on_refresh(sqliteStorage, monkeypatch):
+    from schemaUtils import createTableIfNotExists, getMedicationLexiconTableName
+    _lexicon().learn({"tablet"}, [])
+    monkeypatch.setenv("MedicationLexiconNegativeTtlDays", "0")
+    MedicationLexicon().refreshIfDue()
+    _, table = createTableIfNotExists(getMedicationLexiconTableName())
+    assert list(table.list_entities()) == []
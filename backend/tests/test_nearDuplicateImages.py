@@ -0,0 +1,90 @@
+import time
+from io import BytesIO
+import pytest
+from NearDuplicateImages import BKTree, NearDuplicateIndex, hashRowKey, pruneImageHashes
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image, ImageDraw, ImageFont
+
+def _prescription(patient: str, medication: str) -> Image.Image:
+    image = Image.new('L', (1240, 1754), 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=36)
+    draw.rectangle((60, 60, 1180, 200), outline=0, width=4)
+    draw.text((80, 100), "CLINIC PRESCRIPTION FORM", fill=0, font=font)
+    for y in range(300, 1600, 120):
+        draw.line((60, y, 1180, y), fill=0, width=2)
+    draw.text((80, 250), f"Patient: {patient}", fill=0, font=font)
+    draw.text((80, 370), f"Rx: {medication}", fill=0, font=font)
+    return image
+
+def _jpeg(image: Image.Image, scale: float = 1.0, quality: int = 90) -> bytes:
+    if scale != 1.0:
+        image = image.resize((int(image.width * scale), int(image.height * scale)), Image.BILINEAR)
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+@pytest.fixture
+def nearDuplicates(sqliteStorage, monkeypatch):
+    monkeypatch.setenv("NearDuplicateDetectionEnabled", "true")
+    index = NearDuplicateIndex()
+    index.nextRefreshAt = float('inf')
+    return index
+
+def test_bk_tree_finds_the_nearest_value_within_the_radius():
+    tree = BKTree()
+    for value, item in ((0b0000, "a"), (0b0111, "b"), (0b1111, "c")):
+        tree.add(value, item)
+    assert tree.nearest(0b0001, 1) == (1, "a")
+    assert tree.nearest(0b1001, 1) is None
+
+def test_disabled_by_default(sqliteStorage):
+    assert NearDuplicateIndex().hashOf(_jpeg(_prescription("John Smith", "Amoxicillin 500mg"))) is None
+
+def test_reencoded_photo_reuses_the_ocr_result(nearDuplicates):
+    original = _prescription("John Smith", "Amoxicillin 500mg")
+    nearDuplicates.record(nearDuplicates.hashOf(_jpeg(original)), "ocr-original")
+    assert nearDuplicates.find(nearDuplicates.hashOf(_jpeg(original, scale=0.6, quality=60))) == "ocr-original"
+
+@pytest.mark.parametrize("patient, medication", [("Jane Doe", "Amoxicillin 500mg"), ("John Smith", "Amoxicillin 250mg")])
+def test_other_prescription_on_the_same_form_is_not_reused(nearDuplicates, patient, medication):
+    nearDuplicates.record(nearDuplicates.hashOf(_jpeg(_prescription("John Smith", "Amoxicillin 500mg"))), "ocr-original")
+    assert nearDuplicates.find(nearDuplicates.hashOf(_jpeg(_prescription(patient, medication)))) is None
+
+def test_prune_deletes_expired_hashes_and_their_regions(nearDuplicates):
+    from NearDuplicateImages import getImageHashTableName
+    from schemaUtils import createTableIfNotExists
+    nearDuplicates.record(nearDuplicates.hashOf(_jpeg(_prescription("John Smith", "Amoxicillin 500mg"))), "ocr-original")
+    _, table = createTableIfNotExists(getImageHashTableName())
+    assert pruneImageHashes(table, time.time() + 1, retained=set()) == 1
+    assert list(table.query_entities(f"RowKey ge '{hashRowKey(0)}'")) == []
+    assert nearDuplicates.find(nearDuplicates.hashOf(_jpeg(_prescription("John Smith", "Amoxicillin 500mg")))) is None
+
+def test_other_workers_load_recorded_hashes_in_the_background(nearDuplicates):
+    original = _prescription("John Smith", "Amoxicillin 500mg")
+    nearDuplicates.record(nearDuplicates.hashOf(_jpeg(original)), "ocr-original")
+    other = NearDuplicateIndex()
+    other.refreshIfDue()
+    deadline = time.monotonic() + 5
+    while other.loadedSince is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert other.find(other.hashOf(_jpeg(original, scale=0.8))) == "ocr-original"
+
+def test_refresh_evicts_expired_hashes_and_prunes_their_regions(nearDuplicates, monkeypatch):
+    from azure.core.exceptions import ResourceNotFoundError
+    from NearDuplicateImages import _regionsContainer, getImageHashTableName
+    from schemaUtils import createTableIfNotExists
+    original = _prescription("John Smith", "Amoxicillin 500mg")
+    nearDuplicates.record(nearDuplicates.hashOf(_jpeg(original)), "ocr-original")
+    monkeypatch.setenv("ImageHashRetentionDays", "0")
+    # Row keys have millisecond resolution, the row has to be older than the cutoff
+    time.sleep(0.01)
+    nearDuplicates.refreshLock.acquire()
+    nearDuplicates._refresh()
+    assert nearDuplicates.entries == {}
+    assert nearDuplicates.find(nearDuplicates.hashOf(_jpeg(original, scale=0.8))) is None
+    _, table = createTableIfNotExists(getImageHashTableName())
+    assert list(table.query_entities(f"RowKey ge '{hashRowKey(0)}'")) == []
+    with pytest.raises(ResourceNotFoundError):
+        _regionsContainer().get_blob_client("ocr-original").download_blob()
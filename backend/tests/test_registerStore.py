@@ -0,0 +1,27 @@
+import pytest
+from azure.core.exceptions import HttpResponseError
+import TokenUtils
+from Store import Store, getStoreLoginByEmail
+from TokenUtils import registerStore
+
+def _store(name="Store 1", email="owner@example.com"):
+    return Store(StoreName=name, Email=email, ContactNumber="0", Latitude="32.0", Longitude="34.8", Password="hash")
+
+def test_duplicate_name_releases_the_email(sqliteStorage):
+    registerStore(_store())
+    with pytest.raises(ValueError):
+        registerStore(_store(email="other@example.com"))
+    assert getStoreLoginByEmail("other@example.com") is None
+
+def test_failed_store_write_releases_the_email(sqliteStorage, monkeypatch):
+    write = TokenUtils.writeEntityToTable
+    def failStoreWrite(entity, table_client, **kwargs):
+        if isinstance(entity, Store):
+            raise HttpResponseError(message="timeout")
+        return write(entity, table_client, **kwargs)
+    monkeypatch.setattr(TokenUtils, "writeEntityToTable", failStoreWrite)
+    with pytest.raises(HttpResponseError):
+        registerStore(_store())
+    assert getStoreLoginByEmail("owner@example.com") is None
+    monkeypatch.setattr(TokenUtils, "writeEntityToTable", write)
+    assert registerStore(_store())['token']
@@ -0,0 +1,63 @@
+import uuid
+from datetime import datetime, timezone
+import pytest
+from azure.data.tables import EdmType, EntityProperty
+from SqliteStorage import ODataFilterTranslator, SqliteDatabase
+
+@pytest.fixture
+def table():
+    database = SqliteDatabase(':memory:')
+    table = database.createTableIfNotExists('Test')
+    table.create_entity({'PartitionKey': 'a', 'RowKey': '1', 'Name': "O'Brien", 'Quantity': 0, 'InStock': False,
+                         'ExpiryDate': datetime(2024, 1, 1, tzinfo=timezone.utc), 'Code': '5'})
+    table.create_entity({'PartitionKey': 'a', 'RowKey': '2', 'Name': 'Aspirin', 'Quantity': 5, 'InStock': True,
+                         'ExpiryDate': datetime(2030, 1, 1, tzinfo=timezone.utc), 'Code': 5})
+    table.create_entity({'PartitionKey': 'b', 'RowKey': '1', 'Name': 'aspirin', 'Quantity': 2.5, 'InStock': True,
+                         'Id': EntityProperty(uuid.UUID('6f0e7a4c-0000-4000-8000-00000000abcd'), EdmType.GUID)})
+    yield table
+    database.close()
+
+def _keys(table, query_filter):
+    return sorted((entity['PartitionKey'], entity['RowKey']) for entity in table.query_entities(query_filter))
+
+@pytest.mark.parametrize("query_filter, expected", [
+    ("PartitionKey eq 'a'", [('a', '1'), ('a', '2')]),
+    ("PartitionKey eq 'a' and RowKey gt '1'", [('a', '2')]),
+    ("Name eq 'O''Brien'", [('a', '1')]),
+    ("Name eq 'aspirin'", [('b', '1')]),
+    ("Quantity ge 2", [('a', '2'), ('b', '1')]),
+    ("Quantity le 0 or ExpiryDate lt datetime'2025-01-01T00:00:00Z'", [('a', '1')]),
+    ("InStock eq true and ExpiryDate ge datetime'2025-01-01T00:00:00Z'", [('a', '2')]),
+    ("not (PartitionKey eq 'a') or Quantity eq 0", [('a', '1'), ('b', '1')]),
+    ("PartitionKey eq 'b' or PartitionKey eq 'a' and Quantity gt 0", [('a', '2'), ('b', '1')]),
+    ("Id eq guid'6F0E7A4C-0000-4000-8000-00000000ABCD'", [('b', '1')]),
+])
+def test_filters_match_like_table_storage(table, query_filter, expected):
+    assert _keys(table, query_filter) == expected
+
+@pytest.mark.parametrize("query_filter, expected", [
+    # A comparison only matches properties of the literal's type
+    ("Code eq 5", [('a', '2')]),
+    ("Code eq '5'", [('a', '1')]),
+    ("ExpiryDate lt '2025-01-01'", []),
+    ("Timestamp gt 0 or RowKey eq '2'", [('a', '2')]),
+])
+def test_comparisons_are_typed(table, query_filter, expected):
+    assert _keys(table, query_filter) == expected
+
+@pytest.mark.parametrize("query_filter", [
+    "(PartitionKey eq 'a'",
+    "PartitionKey like 'a'",
+    "PartitionKey eq 'a' 'b'",
+    "PartitionKey eq",
+    "PartitionKey eq binary'00'",
+    "eq 'a'",
+])
+def test_invalid_filters_are_rejected(query_filter):
+    with pytest.raises(ValueError):
+        ODataFilterTranslator.translate(query_filter)
+
+def test_key_comparisons_use_the_primary_key(table):
+    where, parameters = ODataFilterTranslator.translate("(PartitionKey eq 'a' or PartitionKey eq 'b') and Quantity gt 0")
+    plan = table.database.execute(f"EXPLAIN QUERY PLAN SELECT RowKey FROM entities WHERE TableName = ? AND {where}", ['Test'] + parameters)
+    assert any('PRIMARY KEY (TableName=? AND PartitionKey=?)' in row[-1] for row in plan)
@@ -0,0 +1,40 @@
+import asyncio
+import pytest
+import Store as StoreModule
+from schemaUtils import createTableIfNotExists, getStoresTableName
+from SqliteStorage import SqliteTableClient
+from Store import Store, getStores, getStoresAsync
+
+@pytest.fixture
+def stores(sqliteStorage, monkeypatch):
+    StoreModule._storeCache.clear()
+    _, table = createTableIfNotExists(getStoresTableName())
+    names = [f"Store {index}" for index in range(40)]
+    for index, name in enumerate(names):
+        store = Store(StoreName=name, Email=f"{index}@example.com", ContactNumber="0", Latitude="32.0", Longitude="34.8", Password="x")
+        table.create_entity(entity={**store.asdict(), 'PartitionKey': store.uid(), 'RowKey': ''})
+    queries = []
+    query = SqliteTableClient.query_entities
+    def counted(client, query_filter, **kwargs):
+        queries.append(query_filter)
+        return query(client, query_filter, **kwargs)
+    monkeypatch.setattr(SqliteTableClient, "query_entities", counted)
+    yield names, queries
+    StoreModule._storeCache.clear()
+
+def test_async_stores_are_fetched_fifteen_per_query(stores):
+    names, queries = stores
+    found = asyncio.run(getStoresAsync(names + ["Missing Store"]))
+    assert sorted(found) == sorted(names)
+    assert found["Store 7"].Email == "7@example.com"
+    assert len(queries) == 3
+    # Cached now
+    asyncio.run(getStoresAsync(names))
+    assert len(queries) == 3
+
+def test_sync_and_async_stores_agree(stores):
+    names, queries = stores
+    found = getStores(names[:20])
+    StoreModule._storeCache.clear()
+    assert asyncio.run(getStoresAsync(names[:20])) == found
+    assert len(queries) == 4
@@ -0,0 +1,37 @@
+import time
+import StoreLocator
+from StoreLocator import Location, StoreGrid
+
+def test_radius_search_crosses_the_antimeridian():
+    grid = StoreGrid()
+    grid.add("fiji", -17.8, 179.95)
+    grid.add("samoa", -17.8, -179.95)
+    grid.add("far", -17.8, 170.0)
+    assert set(grid.distances(Location(-17.8, 179.99, RadiusKm=20))) == {"fiji", "samoa"}
+    assert set(grid.distances(Location(-17.8, -179.99, RadiusKm=20))) == {"fiji", "samoa"}
+
+def test_longitude_180_and_minus_180_share_a_cell():
+    grid = StoreGrid()
+    grid.add("east", 0.0, 180.0)
+    assert set(grid.distances(Location(0.0, -180.0, RadiusKm=1))) == {"east"}
+
+def test_stale_grid_keeps_serving_while_it_refreshes(monkeypatch):
+    loads = []
+    def load():
+        loads.append(time.monotonic())
+        time.sleep(0.2)
+        grid = StoreGrid()
+        grid.add(f"store{len(loads)}", 0.0, 0.0)
+        return grid
+    monkeypatch.setattr(StoreLocator, "_loadStoreGrid", load)
+    monkeypatch.setattr(StoreLocator, "_grid", None)
+    first = StoreLocator.getStoreGrid()
+    monkeypatch.setattr(StoreLocator, "_gridLoadedAt", 0.0)
+    startedAt = time.monotonic()
+    assert StoreLocator.getStoreGrid() is first
+    assert time.monotonic() - startedAt < 0.1
+    StoreLocator.addStoreLocation("registered", 1.0, 1.0)
+    deadline = time.monotonic() + 5
+    while StoreLocator._grid is first and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert set(StoreLocator._grid.positions) == {"store2", "registered"}
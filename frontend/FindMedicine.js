@@ -59,9 +59,10 @@ function FindMedicineScreen() {
     setMarkers([]);
     setOrigin(null);
     try {
+      const loc = await getLocation();
       const response = await makeRequest(
         'LocateMedicine',
-        JSON.stringify({ imageData: base64Img, imageName: imageName })
+        JSON.stringify({ imageData: base64Img, imageName: imageName, ...loc })
       );
       const data = await response.json();
       console.log(data)
@@ -74,7 +75,6 @@ function FindMedicineScreen() {
             description: store.Email,
           }))
         );
-        const loc = await getLocation();
         setOrigin(loc);
         const status = response.status
         console.log(status)
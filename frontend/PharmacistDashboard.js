@@ -2,7 +2,9 @@ import React, { useCallback } from 'react';
 import { View, ScrollView, Text, TouchableOpacity, Alert, BackHandler } from 'react-native';
 import { useFocusEffect } from '@react-navigation/native';
 import { globalStyles } from './styles';
+import AsyncStorage from '@react-native-async-storage/async-storage';
 import {logout} from './TokenUtils'
+import {makeRequest} from './CommunicationUtils'
 import Icon from 'react-native-vector-icons/MaterialCommunityIcons';
 
 function PharmacistDashboard({ navigation }) {
@@ -42,6 +44,13 @@ function PharmacistDashboard({ navigation }) {
 
   const handleLogout = async () => {
     console.log('Logout process initiated');
+    try {
+      // Revokes the token on the server, the app logs out even if that fails
+      const token = await AsyncStorage.getItem('access_token');
+      await makeRequest('logout', null, { 'Authorization': `Bearer ${token}` });
+    } catch (error) {
+      console.error('Error revoking token:', error);
+    }
     await logout(navigation)
   };
 